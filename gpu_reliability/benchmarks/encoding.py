@@ -0,0 +1,66 @@
+"""
+Compare the dedicated stat serializer against the original `asdict` + `StatsEncoder` path.
+
+    python -m gpu_reliability.benchmarks.encoding --records 100000
+
+"""
+from dataclasses import asdict
+from json import dumps
+from timeit import timeit
+from click import command, option, secho
+from gpu_reliability.models import LaunchRequest, PlatformType
+from gpu_reliability.stats_logger import Stat, StatsEncoder, encode_stat
+
+
+def legacy_encode(stat: Stat) -> str:
+    return dumps(asdict(stat), cls=StatsEncoder)
+
+
+def sample_stats():
+    return [
+        Stat(
+            platform=PlatformType.GCP,
+            request=LaunchRequest(spot=False, geography="us-central1-b"),
+            create_success=True,
+            create_seconds=41.73291015625,
+        ),
+        Stat(
+            platform=PlatformType.AWS,
+            request=LaunchRequest(spot=True, geography="us-east-1"),
+            create_success=False,
+            create_seconds=3.2,
+            error="[Code: Server.InsufficientInstanceCapacity]: There is no Spot capacity available",
+        ),
+        Stat(
+            platform=PlatformType.GCP,
+            request=LaunchRequest(spot=True, geography="europe-west4-a"),
+            create_success=False,
+            error="[Code: ZONE_RESOURCE_POOL_EXHAUSTED]: The zone does not have enough resources",
+            warnings=["[Code: DISK_SIZE_LARGER_THAN_IMAGE_SIZE]: Disk size is larger than image size"],
+        ),
+    ]
+
+
+@command()
+@option("--records", type=int, default=100_000)
+def benchmark_encoding(records):
+    stats = sample_stats()
+    batch = [stats[i % len(stats)] for i in range(records)]
+
+    for stat in stats:
+        assert encode_stat(stat) == legacy_encode(stat)
+
+    timings = {
+        "asdict + StatsEncoder": timeit(lambda: [legacy_encode(stat) for stat in batch], number=1),
+        "encode_stat": timeit(lambda: [encode_stat(stat) for stat in batch], number=1),
+    }
+
+    baseline = timings["asdict + StatsEncoder"]
+    for name, elapsed in timings.items():
+        secho(
+            f"{name:<24} {elapsed:8.3f}s  {records / elapsed:12,.0f} records/s  {baseline / elapsed:5.2f}x"
+        )
+
+
+if __name__ == "__main__":
+    benchmark_encoding()
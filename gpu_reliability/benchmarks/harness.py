@@ -0,0 +1,347 @@
+"""
+Measure the overhead of the harness itself against the in-process fake clouds, so it can run
+offline and catch regressions in CI. The fakes answer instantly apart from their simulated
+instance latencies, so every measurement here is time spent in our own code.
+
+    python -m gpu_reliability.benchmarks.harness --probes 10 --probes 100 --probes 1000
+
+"""
+from dataclasses import dataclass
+from itertools import cycle
+from pathlib import Path
+from sys import exit
+from tempfile import TemporaryDirectory
+from threading import Event, Lock, Thread, active_count
+from time import monotonic, process_time, sleep
+from typing import Dict, List, Optional, Tuple
+from uuid import UUID
+from click import Choice, command, option, secho
+from gpu_reliability.benchmarks.encoding import sample_stats
+from gpu_reliability.engine import ProbeEngine
+from gpu_reliability.models import LaunchRequest
+from gpu_reliability.platforms.aws import AWSPlatform
+from gpu_reliability.platforms.base import INSTANCE_TAG, INSTANCE_TAG_VALUE, PlatformBase
+from gpu_reliability.platforms.fake_cloud import FakeCloudBehavior, LatencyDistribution
+from gpu_reliability.platforms.fake_ec2 import DEFAULT_REGIONS, FakeEC2Session
+from gpu_reliability.platforms.fake_gce import fake_compute_clients
+from gpu_reliability.platforms.gcp import GCPPlatform
+from gpu_reliability.platforms.launch_queue import LaunchQueue
+from gpu_reliability.ratelimit import ApiFamily, RateLimit, RateLimiter
+from gpu_reliability.sketch import LatencySketch
+from gpu_reliability.stats_logger import BufferedStatsLogger, StatsLogger
+
+
+GCP_ZONES = ["us-central1-a", "us-central1-b", "us-east1-c", "europe-west4-a", "asia-east1-a"]
+# The harness's own rate limits would dominate at high probe counts; the benchmark is after
+# the cost of everything else
+UNLIMITED = {family: RateLimit(rate=1e9, burst=1e9) for family in ApiFamily}
+
+
+@dataclass
+class ProbeRun:
+    platform: str
+    engine: str
+    probes: int
+    wall_seconds: float
+    cpu_seconds: float
+    peak_threads: int
+    scheduling_p50: Optional[float]
+    scheduling_p99: Optional[float]
+    sweep_seconds: float
+    targeted_seconds: float
+
+
+class ThreadSampler:
+    """
+    Samples the process's thread count in the background and keeps the peak.
+
+    """
+    def __init__(self, interval: float = 0.01):
+        self.interval = interval
+        self.peak = active_count()
+        self.stopped = Event()
+        self.thread = Thread(target=self.run, daemon=True)
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.peak = max(self.peak, active_count())
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *_):
+        self.stopped.set()
+        self.thread.join()
+
+
+class TimedLaunches:
+    """
+    Mixed into a platform to time each launch from when it was triggered until it starts
+    running, which covers waiting in the queue, for a launch slot and for an executor thread.
+
+    """
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.timing_lock = Lock()
+        self.triggered_at: Dict[UUID, float] = {}
+        self.scheduling_seconds = LatencySketch()
+
+    def triggered(self, request: LaunchRequest):
+        with self.timing_lock:
+            self.triggered_at[request.identifier] = monotonic()
+
+    def run_launch(self, request: LaunchRequest):
+        with self.timing_lock:
+            self.scheduling_seconds.add(monotonic() - self.triggered_at.pop(request.identifier))
+        super().run_launch(request)
+
+
+class TimedAWSPlatform(TimedLaunches, AWSPlatform):
+    pass
+
+
+class TimedGCPPlatform(TimedLaunches, GCPPlatform):
+    pass
+
+
+def build_platform(platform_type: str, storage: StatsLogger, probes: int, launch_slots: int, behavior: FakeCloudBehavior) -> Tuple[PlatformBase, List[str]]:
+    options = dict(
+        storage=storage,
+        max_concurrent_launches=launch_slots,
+        launch_queue=LaunchQueue(max_size=probes),
+        # Only the cleanups the benchmark runs itself should be timed
+        full_sweep_interval=24 * 60 * 60,
+    )
+
+    if platform_type == "aws":
+        platform = TimedAWSPlatform(
+            access_key_id="",
+            secret_key="",
+            machine_type="g4dn.xlarge",
+            session=FakeEC2Session(behavior),
+            rate_limiter=RateLimiter(UNLIMITED),
+            **options,
+        )
+        return platform, DEFAULT_REGIONS
+
+    platform = TimedGCPPlatform(
+        project_id="fake-project",
+        service_account="",
+        machine_type="n1-standard-4",
+        accelerator_type="nvidia-tesla-t4",
+        compute_clients=fake_compute_clients(behavior),
+        rate_limiter=RateLimiter(UNLIMITED),
+        **options,
+    )
+    return platform, GCP_ZONES
+
+
+def live_instances(platform: PlatformBase) -> int:
+    if isinstance(platform, AWSPlatform):
+        return len(platform.session.live_instances())
+    return len(platform.instance_client.compute.live_instances())
+
+
+def wait_for_launches(platform: PlatformBase, probes: int, timeout: float):
+    """
+    :raises TimeoutError: If the launches haven't all finished within `timeout` seconds, for
+        instance because some were dropped or a slot was never freed
+
+    """
+    deadline = monotonic() + timeout
+    while True:
+        with platform.condition:
+            metrics = platform.launch_queue.metrics
+            if metrics.started >= probes and not platform.launch_slots.total:
+                return
+            if monotonic() > deadline:
+                raise TimeoutError(
+                    f"Only {metrics.started} of {probes} launches started within {timeout}s: "
+                    f"{metrics.submitted} submitted, {metrics.coalesced} coalesced, {metrics.rejected} rejected, "
+                    f"{len(platform.launch_queue)} queued and {platform.launch_slots.total} still in flight"
+                )
+        sleep(0.005)
+
+
+def run_probes(
+    platform_type: str,
+    engine_type: str,
+    probes: int,
+    behavior: FakeCloudBehavior,
+    output_dir: Path,
+    slot_ratio: float,
+    engine_workers: Optional[int],
+    timeout: float,
+) -> ProbeRun:
+    storage = BufferedStatsLogger(output_dir / f"{platform_type}-{engine_type}-{probes}.jsonl")
+    # Fewer slots than probes, so launches have to wait for earlier ones to free their slots
+    launch_slots = max(1, int(probes * slot_ratio))
+    platform, geographies = build_platform(platform_type, storage, probes, launch_slots, behavior)
+    # The startup sweep isn't part of the launch phase
+    platform.instance_registry.swept()
+
+    engine = ProbeEngine([platform], max_workers=engine_workers or launch_slots) if engine_type == "asyncio" else None
+    if engine is None:
+        platform.spawn()
+
+    requests = [LaunchRequest(spot=False, geography=geography) for geography, _ in zip(cycle(geographies), range(probes))]
+
+    start = monotonic()
+    cpu_start = process_time()
+    try:
+        with ThreadSampler() as sampler:
+            for request in requests:
+                platform.triggered(request)
+                if engine is not None:
+                    engine.submit(platform, request)
+                else:
+                    platform.set_should_launch(request)
+            wait_for_launches(platform, probes, timeout)
+        wall_seconds = monotonic() - start
+        cpu_seconds = process_time() - cpu_start
+    finally:
+        # Also stops launches that are still queued after a timeout
+        if engine is not None:
+            engine.close()
+        else:
+            platform.quit()
+            platform.join()
+
+    sweep_seconds = time_cleanup(platform, geographies, probes, full_sweep=True)
+    targeted_seconds = time_cleanup(platform, geographies, probes, full_sweep=False)
+
+    platform.close()
+    storage.close()
+
+    return ProbeRun(
+        platform=platform_type,
+        engine=engine_type,
+        probes=probes,
+        wall_seconds=wall_seconds,
+        cpu_seconds=cpu_seconds,
+        peak_threads=sampler.peak,
+        scheduling_p50=platform.scheduling_seconds.quantile(0.5),
+        scheduling_p99=platform.scheduling_seconds.quantile(0.99),
+        sweep_seconds=sweep_seconds,
+        targeted_seconds=targeted_seconds,
+    )
+
+
+def time_cleanup(platform: PlatformBase, geographies: List[str], probes: int, full_sweep: bool) -> float:
+    """
+    Leave `probes` running instances behind and time how long a cleanup takes to remove them.
+    A full sweep has to search for them; otherwise they're registered, as launched ones would be.
+
+    """
+    for index, geography in zip(range(probes), cycle(geographies)):
+        name = f"gpu-test-staged-{index}"
+        if isinstance(platform, AWSPlatform):
+            instance_id = platform.session.add_instance(geography, {INSTANCE_TAG: INSTANCE_TAG_VALUE, "Name": name}).instance_id
+        else:
+            platform.instance_client.compute.add_instance(geography, name, {INSTANCE_TAG: INSTANCE_TAG_VALUE})
+            instance_id = None
+        if not full_sweep:
+            platform.instance_registry.add(name, geography, instance_id)
+
+    start = monotonic()
+    platform.cleanup_resources(full_sweep=full_sweep)
+    elapsed = monotonic() - start
+
+    if live_instances(platform):
+        raise AssertionError(f"Cleanup left {live_instances(platform)} instances behind")
+    return elapsed
+
+
+def stats_throughput(output_dir: Path, records: int) -> float:
+    """
+    :return: Stats per second that a BufferedStatsLogger accepts and persists
+
+    """
+    stats = sample_stats()
+    storage = BufferedStatsLogger(output_dir / "throughput.jsonl")
+
+    start = monotonic()
+    for index in range(records):
+        storage.write(stats[index % len(stats)])
+    storage.close()
+    return records / (monotonic() - start)
+
+
+def format_seconds(value: Optional[float]) -> str:
+    return "-" if value is None else f"{value * 1000:.1f}ms"
+
+
+@command()
+@option("--probes", "probe_counts", type=int, multiple=True, default=[10, 100, 1000], help="Concurrent probes to measure; repeat for several")
+@option("--platform", "platform_types", type=Choice(["aws", "gcp"]), multiple=True, default=["aws", "gcp"])
+@option("--engine", "engine_types", type=Choice(["threads", "asyncio"]), multiple=True, default=["threads", "asyncio"])
+@option("--slot-ratio", type=float, default=0.5, help="Launch slots per probe; below 1 so launches queue behind each other")
+@option("--engine-workers", type=int, default=None, help="Threads of the asyncio engine; defaults to one per launch slot")
+@option("--create-latency", type=float, default=0.2, help="Median seconds the fake clouds take to start an instance")
+@option("--delete-latency", type=float, default=0.02, help="Median seconds the fake clouds take to delete an instance")
+@option("--stats-records", type=int, default=100_000)
+@option("--timeout", type=float, default=60.0, help="Fail a run whose launches haven't all finished after this many seconds")
+@option("--max-scheduling-p99", type=float, default=None, help="Fail if any run's p99 scheduling latency exceeds this many seconds")
+@option("--min-stats-throughput", type=float, default=None, help="Fail if fewer stats per second are written")
+def benchmark_harness(
+    probe_counts,
+    platform_types,
+    engine_types,
+    slot_ratio,
+    engine_workers,
+    create_latency,
+    delete_latency,
+    stats_records,
+    timeout,
+    max_scheduling_p99,
+    min_stats_throughput,
+):
+    behavior = FakeCloudBehavior(
+        create_latency=LatencyDistribution(create_latency, 0.5),
+        delete_latency=LatencyDistribution(delete_latency, 0.5),
+        seed=42,
+    )
+
+    failures = []
+    with TemporaryDirectory() as directory:
+        output_dir = Path(directory)
+
+        throughput = stats_throughput(output_dir, stats_records)
+        secho(f"Stats writes: {throughput:,.0f} records/s")
+        if min_stats_throughput is not None and throughput < min_stats_throughput:
+            failures.append(f"stats throughput {throughput:,.0f} records/s")
+
+        secho(
+            f"{'platform':<9}{'engine':<9}{'probes':>7}{'wall':>9}{'cpu':>9}{'threads':>9}"
+            f"{'sched p50':>11}{'sched p99':>11}{'sweep':>10}{'targeted':>10}"
+        )
+        for platform_type in platform_types:
+            for engine_type in engine_types:
+                for probes in probe_counts:
+                    run = run_probes(
+                        platform_type,
+                        engine_type,
+                        probes,
+                        behavior,
+                        output_dir,
+                        slot_ratio,
+                        engine_workers,
+                        timeout,
+                    )
+                    secho(
+                        f"{run.platform:<9}{run.engine:<9}{run.probes:>7}{run.wall_seconds:>8.2f}s{run.cpu_seconds:>8.2f}s"
+                        f"{run.peak_threads:>9}{format_seconds(run.scheduling_p50):>11}{format_seconds(run.scheduling_p99):>11}"
+                        f"{run.sweep_seconds:>9.2f}s{run.targeted_seconds:>9.2f}s"
+                    )
+                    if max_scheduling_p99 is not None and (run.scheduling_p99 or 0) > max_scheduling_p99:
+                        failures.append(f"{run.platform}/{run.engine} at {run.probes} probes: p99 scheduling {format_seconds(run.scheduling_p99)}")
+
+    for failure in failures:
+        secho(f"Regression: {failure}", fg="red")
+    if failures:
+        exit(1)
+
+
+if __name__ == "__main__":
+    benchmark_harness()
@@ -0,0 +1,101 @@
+from threading import Lock, Thread
+from time import monotonic
+from typing import Callable, Dict, Generic, Hashable, Optional, Set, Tuple, TypeVar
+from gpu_reliability.logging import logger
+
+
+Key = TypeVar("Key", bound=Hashable)
+Value = TypeVar("Value")
+
+
+@logger
+class ExpiringCache(Generic[Key, Value]):
+    """
+    Thread-safe cache of values that are loaded on first use and reloaded once they are
+    older than `ttl` seconds. Concurrent misses for the same key share a single load.
+
+    """
+    def __init__(
+        self,
+        loader: Callable[[Key], Value],
+        ttl: float,
+        refresh_after: Optional[float] = None,
+        max_stale: Optional[float] = None,
+    ):
+        """
+        :param refresh_after: Age after which a cached value is still served, but reloaded in
+            a background thread so callers don't wait on the loader
+        :param max_stale: If reloading an expired value fails, keep serving the stale value
+            until it is this many seconds past `ttl`. None serves it indefinitely, 0 never.
+
+        """
+        self.loader = loader
+        self.ttl = ttl
+        self.refresh_after = refresh_after
+        self.max_stale = max_stale
+
+        self.lock = Lock()
+        self.key_locks: Dict[Key, Lock] = {}
+        # key -> (value, monotonic time it was loaded)
+        self.values: Dict[Key, Tuple[Value, float]] = {}
+        self.refreshing: Set[Key] = set()
+
+    def get(self, key: Optional[Key] = None) -> Value:
+        cached = self.values.get(key)
+        if cached is not None:
+            age = monotonic() - cached[1]
+            if age < self.ttl:
+                if self.refresh_after is not None and age >= self.refresh_after:
+                    self.refresh_in_background(key)
+                return cached[0]
+
+        with self.lock:
+            key_lock = self.key_locks.setdefault(key, Lock())
+
+        with key_lock:
+            # Another thread may have finished loading while we waited
+            cached = self.values.get(key)
+            if cached is not None and monotonic() - cached[1] < self.ttl:
+                return cached[0]
+
+            try:
+                return self.load(key)
+            except Exception:
+                if cached is None or not self.can_serve_stale(cached):
+                    raise
+                self.logger.exception(f"Unable to reload `{key}`, serving the cached value")
+                return cached[0]
+
+    def load(self, key: Key) -> Value:
+        value = self.loader(key)
+        self.values[key] = (value, monotonic())
+        return value
+
+    def can_serve_stale(self, cached: Tuple[Value, float]) -> bool:
+        return self.max_stale is None or monotonic() - cached[1] < self.ttl + self.max_stale
+
+    def refresh_in_background(self, key: Key):
+        with self.lock:
+            if key in self.refreshing:
+                return
+            self.refreshing.add(key)
+            key_lock = self.key_locks.setdefault(key, Lock())
+
+        def refresh():
+            try:
+                with key_lock:
+                    self.load(key)
+            except Exception:
+                # The current value stays in place until it expires
+                self.logger.exception(f"Background refresh of `{key}` failed")
+            finally:
+                with self.lock:
+                    self.refreshing.discard(key)
+
+        Thread(target=refresh, name="cache-refresh", daemon=True).start()
+
+    def invalidate(self, key: Optional[Key] = None):
+        self.values.pop(key, None)
+
+    def clear(self):
+        self.values.clear()
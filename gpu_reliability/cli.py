@@ -1,103 +1,397 @@
-from click import command, option, Path as ClickPath, secho
-from gpu_reliability.platforms.gcp import GCPPlatform
-from gpu_reliability.platforms.aws import AWSPlatform
-from gpu_reliability.stats_logger import StatsLogger
-from gpu_reliability.platforms.base import LaunchRequest, PlatformType
-from time import sleep
-from random import random, choice
-from contextlib import contextmanager
+from click import ClickException, group, option, Path as ClickPath, Choice, secho
+from gpu_reliability.stats_logger import StatsLogger, BufferedStatsLogger, FsyncPolicy, read_stats
+from gpu_reliability.rollups import Rollups, rollups_path
+from gpu_reliability.columnar import ColumnarStatsLogger, convert_jsonl
+from gpu_reliability.sqlite import LaunchFilter, SqliteStatsLogger, SqliteStatsReader, convert_jsonl as convert_jsonl_sqlite
+from gpu_reliability.report import build_report, QUANTILES
+from gpu_reliability.follow import StatsFollower
+from gpu_reliability.engine import ProbeEngine
+from gpu_reliability.matrix import ProbeMatrix, expand_targets
+from gpu_reliability.metrics import MetricsServer, PlatformMetrics
+from gpu_reliability.ratelimit import ApiFamily, CircuitBreaker
+from json import dumps
+from gpu_reliability.models import PlatformType
+from gpu_reliability.platforms.backends import load_platform
+from gpu_reliability.platforms.base import PlatformBase
+from gpu_reliability.platforms.launch_queue import LaunchQueue, DropPolicy
+from gpu_reliability.platforms.journal import InstanceJournal, journal_path
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from gpu_reliability.settings import Settings
-
-
-@contextmanager
-def sample_timing(samples: int, sleep_interval_seconds: int, total_time_seconds: int) -> bool:
-    """
-    On expectation, runs `samples` per `total_time_seconds` period given this
-    function is called once every `sleep_interval`.
-
-    For a simplified example let's consider a minute instead of a day:
-
-    - samples = 10
-    - total_time = 60 seconds
-    - sleep_interval = 2 (only 30 trials per minute)
-    - every second we want a 1/3 (10/30) likelihood of running
-
-    E[samples / (total_time/sleep_interval)]
-
-    """
-    should_run = (samples / (total_time_seconds / sleep_interval_seconds)) > random()
-    yield should_run
-    sleep(sleep_interval_seconds)
+from datetime import datetime, timedelta
+from time import sleep
+from gpu_reliability.settings import PLATFORM_SETTINGS
+from pydantic import ValidationError
+from gpu_reliability.scheduler import ScheduleKind, TriggerScheduler
 
 
 SPOT_STATUS = [False]
 GCP_ZONES = [
     "us-central1-b"
 ]
+GCP_MACHINE_TYPES = [
+    "n1-standard-4",
+]
+GCP_ACCELERATOR_TYPES = [
+    "nvidia-tesla-t4",
+]
 AWS_REGIONS = [
     "us-east-1",
 ]
+AWS_MACHINE_TYPES = [
+    "g4dn.xlarge",
+]
 
 
-def create_random_request(platform_type: PlatformType) -> LaunchRequest:
-    return LaunchRequest(
-        spot=choice(SPOT_STATUS),
-        geography=choice(GCP_ZONES if platform_type == PlatformType.GCP else AWS_REGIONS),
-    )
+@group()
+def cli():
+    pass
 
 
-@command()
+@cli.command(name="run")
 @option("--output-path", type=ClickPath(exists=False), required=True)
-@option("--daily-samples", type=int, default=24 * 2)
+@option("--output-format", type=Choice(["jsonl", "columnar", "sqlite"]), default="jsonl")
+@option("--platforms", "platform_names", type=Choice([platform.value for platform in PlatformType], case_sensitive=False), multiple=True, default=[platform.value for platform in PlatformType], help="Cloud to probe; repeat for several. Only the selected clouds' SDKs are loaded and credentials required.")
+@option("--daily-samples", type=int, default=24 * 2, help="Triggers per day")
+@option("--schedule", "schedule_kind", type=Choice([kind.value for kind in ScheduleKind], case_sensitive=False), default=ScheduleKind.STRATIFIED.value, help="Spread each day's triggers evenly over the day, or uniformly at random")
+@option("--seed", type=int, default=None, help="Seed of the trigger times, to reproduce an earlier run's schedule")
+@option("--buffered-writes/--unbuffered-writes", default=True, help="Write stats from a background thread in batches")
+@option("--fsync-policy", type=Choice([policy.value for policy in FsyncPolicy], case_sensitive=False), default=FsyncPolicy.BATCH.value)
+@option("--rollups/--no-rollups", "maintain_rollups", default=True, help="Maintain hourly and daily aggregates in a sidecar file")
+@option("--max-concurrent-launches", type=int, default=None, help="Launches per platform that may be in flight at once; defaults to one, or to every target with --fan-out")
+@option("--drop-policy", type=Choice([policy.value for policy in DropPolicy], case_sensitive=False), default=DropPolicy.QUEUE.value, help="What happens to launches triggered while every slot is busy")
+@option("--max-queued-launches", type=int, default=4, help="Launches per platform that may wait for a slot with the queue policy")
+@option("--engine", "engine_type", type=Choice(["threads", "asyncio"]), default="threads", help="Run each platform on its own worker thread, or every platform on one event loop")
+@option("--engine-workers", type=int, default=32, help="Threads shared by blocking cloud API calls with the asyncio engine")
+@option("--gcp-zone", "gcp_zones", multiple=True, default=GCP_ZONES, help="GCP zone to probe; repeat for several")
+@option("--gcp-machine-type", "gcp_machine_types", multiple=True, default=GCP_MACHINE_TYPES, help="GCP machine type to probe; repeat for several")
+@option("--gcp-accelerator-type", "gcp_accelerator_types", multiple=True, default=GCP_ACCELERATOR_TYPES, help="GCP accelerator to probe; repeat for several")
+@option("--aws-region", "aws_regions", multiple=True, default=AWS_REGIONS, help="AWS region to probe; repeat for several")
+@option("--aws-machine-type", "aws_machine_types", multiple=True, default=AWS_MACHINE_TYPES, help="AWS machine type to probe; repeat for several")
+@option("--fan-out/--sample-one", default=False, help="Launch every combination of the probe targets on each trigger, rather than one random target per platform")
+@option("--max-launches-per-region", type=int, default=None, help="Launches per platform and region that may be in flight at once")
+@option("--breaker-threshold", type=int, default=3, help="Consecutive out of capacity launches before a target is paused")
+@option("--breaker-cooldown", type=int, default=30 * 60, help="Seconds to pause launches to an out of capacity target")
+@option("--metrics-port", type=int, default=None, help="Serve Prometheus metrics at /metrics on this port")
+@option("--metrics-host", default="127.0.0.1", help="Interface the metrics endpoint listens on")
 def benchmark(
     output_path,
+    output_format,
+    platform_names,
     daily_samples,
-    sleep_interval=10,
+    schedule_kind,
+    seed,
+    buffered_writes,
+    fsync_policy,
+    maintain_rollups,
+    max_concurrent_launches,
+    drop_policy,
+    max_queued_launches,
+    engine_type,
+    engine_workers,
+    gcp_zones,
+    gcp_machine_types,
+    gcp_accelerator_types,
+    aws_regions,
+    aws_machine_types,
+    fan_out,
+    max_launches_per_region,
+    breaker_threshold,
+    breaker_cooldown,
+    metrics_port,
+    metrics_host,
+    healthcheck_interval=10,
 ):
-    settings = Settings()
-    storage = StatsLogger(Path(output_path).expanduser())
-
-    platforms = [
-        GCPPlatform(
-            project_id=settings.gcp_project,
-            machine_type="n1-standard-4",
-            accelerator_type="nvidia-tesla-t4",
-            service_account=settings.gcp_service_account,
-            storage=storage,
-        ),
-        AWSPlatform(
-            access_key_id=settings.aws_access_key_id,
-            secret_key=settings.aws_access_secret_key,
-            machine_type="g4dn.xlarge",
+    """
+    Launch GPU instances at random times throughout the day and record the outcomes
+    """
+    platform_types = [platform_type for platform_type in PlatformType if platform_type.value in {name.upper() for name in platform_names}]
+    # Validated before anything is written, so missing credentials fail fast
+    try:
+        settings = {platform_type: PLATFORM_SETTINGS[platform_type]() for platform_type in platform_types}
+    except ValidationError as e:
+        raise ClickException(f"Missing settings for the selected platforms:\n{e}")
+
+    output_path = Path(output_path).expanduser()
+    fsync_policy = FsyncPolicy(fsync_policy.upper())
+    drop_policy = DropPolicy(drop_policy.upper())
+
+    scheduler = TriggerScheduler(seed=seed)
+    scheduler.add("trigger", daily_samples, ScheduleKind(schedule_kind.upper()))
+    secho(f"Trigger schedule seed: {scheduler.seed}")
+
+    rollups = None
+    if maintain_rollups:
+        rollups = Rollups(rollups_path(output_path))
+        # Backfill from an existing log that predates the sidecar, or its current format
+        if (rollups.stale or not rollups.path.exists()) and output_format == "jsonl" and output_path.is_file():
+            rollups.rebuild(read_stats(output_path))
+
+    if output_format == "columnar":
+        # The columnar store is always written by a background writer
+        storage = ColumnarStatsLogger(output_path, fsync_policy=fsync_policy, rollups=rollups)
+    elif output_format == "sqlite":
+        # As is the database, so platform threads never wait on a transaction
+        storage = SqliteStatsLogger(output_path, fsync_policy=fsync_policy, rollups=rollups)
+    elif buffered_writes:
+        storage = BufferedStatsLogger(output_path, fsync_policy=fsync_policy, rollups=rollups)
+    else:
+        storage = StatsLogger(output_path, rollups=rollups)
+
+    probe_targets = []
+    if PlatformType.GCP in platform_types:
+        probe_targets += expand_targets(PlatformType.GCP, gcp_zones, gcp_machine_types, gcp_accelerator_types, SPOT_STATUS)
+    if PlatformType.AWS in platform_types:
+        probe_targets += expand_targets(PlatformType.AWS, aws_regions, aws_machine_types, spot=SPOT_STATUS)
+    matrix = ProbeMatrix(probe_targets, seed=scheduler.seed)
+
+    def targets(platform_type: PlatformType) -> int:
+        # A fanned out trigger queues a launch for every target at once
+        return len(matrix.targets_for(platform_type)) if fan_out else 1
+
+    # Instances a crashed run left behind are registered with their platforms on creation
+    journal = InstanceJournal(journal_path(output_path))
+
+    metrics = PlatformMetrics()
+    metrics_server = MetricsServer(metrics.registry, metrics_port, metrics_host).start() if metrics_port is not None else None
+
+    def launch_queue(platform_type: PlatformType) -> LaunchQueue:
+        return LaunchQueue(drop_policy, max_queued_launches * targets(platform_type))
+
+    def build_platform(platform_type: PlatformType) -> PlatformBase:
+        platform_class = load_platform(platform_type)
+        platform_settings = settings[platform_type]
+        options = dict(
             storage=storage,
+            max_concurrent_launches=max_concurrent_launches or targets(platform_type),
+            launch_queue=launch_queue(platform_type),
+            max_launches_per_region=max_launches_per_region,
+            circuit_breaker=CircuitBreaker(breaker_threshold, breaker_cooldown),
+            journal=journal,
+            metrics=metrics,
+        )
+
+        if platform_type == PlatformType.GCP:
+            return platform_class(
+                project_id=platform_settings.gcp_project,
+                machine_type=gcp_machine_types[0],
+                accelerator_type=gcp_accelerator_types[0],
+                service_account=platform_settings.gcp_service_account,
+                **options,
+            )
+        return platform_class(
+            access_key_id=platform_settings.aws_access_key_id,
+            secret_key=platform_settings.aws_access_secret_key,
+            machine_type=aws_machine_types[0],
+            **options,
         )
-    ]
 
-    for platform in platforms:
-        # Spawn on startup to provide a baseline
-        platform.set_should_launch(create_random_request(platform.platform_type))
+    platforms = [build_platform(platform_type) for platform_type in platform_types]
+
+    # Tear down what the previous run left behind before probing, so its instances can't
+    # be mistaken for capacity in use by this one
+    recovering = [platform for platform in platforms if len(platform.instance_registry)]
+    if recovering:
+        secho(f"Tearing down {sum(len(platform.instance_registry) for platform in recovering)} instances left by the previous run...")
+        with ThreadPoolExecutor(max_workers=len(recovering)) as executor:
+            list(executor.map(lambda platform: platform.cleanup_resources(), recovering))
+
+    engine = ProbeEngine(platforms, max_workers=engine_workers) if engine_type == "asyncio" else None
+
+    def trigger():
+        # Every launch of the trigger shares its id and is queued before any platform starts one
+        requests = matrix.fan_out() if fan_out else matrix.sample()
+        for platform in platforms:
+            for request in requests.get(platform.platform_type, []):
+                if engine is not None:
+                    engine.submit(platform, request)
+                else:
+                    platform.set_should_launch(request)
+
+    # Spawn on startup to provide a baseline
+    trigger()
 
     try:
         while True:
             # Healthcheck of threads; if they have quit, restart them
-            for platform in platforms:
-                if not platform.is_spawned:
-                    platform.spawn()
+            if engine is None:
+                for platform in platforms:
+                    if not platform.is_spawned:
+                        platform.spawn()
 
             # Spawn all at the same time
-            with sample_timing(daily_samples, sleep_interval, total_time_seconds=60*60*24) as should_run:
-                if should_run:
-                    for platform in platforms:
-                        secho(f"Trigger launch: `{platform.platform_type}`")
-                        platform.set_should_launch(create_random_request(platform.platform_type))
+            if scheduler.wait(timeout=healthcheck_interval) is not None:
+                secho("Trigger launch")
+                trigger()
     except KeyboardInterrupt:
         secho("Shutdown triggered, cleaning up resources...", fg="red")
         # Close the running threads
-        for platform in platforms:
-            platform.quit()
-            platform.join()
+        if engine is not None:
+            engine.close()
+        else:
+            for platform in platforms:
+                platform.quit()
+                platform.join()
 
         # Cleanup any resources that are still remaining
         for platform in platforms:
-            platform.cleanup_resources()
+            platform.cleanup_resources(full_sweep=True)
+            platform.close()
+
+            queue_metrics = platform.launch_queue.metrics
+            secho(
+                f"{platform.platform_type.value}: {queue_metrics.started} launches started, "
+                f"{queue_metrics.coalesced} coalesced, {queue_metrics.rejected} rejected, "
+                f"max queue depth {queue_metrics.max_depth}, "
+                f"p90 queue wait {format_seconds(queue_metrics.wait_seconds.quantile(0.9))}, "
+                f"p90 delete {format_seconds(platform.delete_seconds.quantile(0.9))}, "
+                f"{format_seconds(platform.rate_limiter.waited_seconds(ApiFamily.READ))} waiting on read API limits, "
+                f"{format_seconds(platform.rate_limiter.waited_seconds(ApiFamily.MUTATE))} waiting on mutate API limits"
+            )
+
+        # Persist any stats that are still queued for the writer
+        storage.close()
+        journal.close()
+        if metrics_server is not None:
+            metrics_server.close()
+
+
+@cli.command()
+@option("--input-path", type=ClickPath(exists=True, dir_okay=False), required=True, help="Existing stats jsonl file")
+@option("--output-path", type=ClickPath(), required=True, help="Columnar store directory or SQLite database")
+@option("--output-format", type=Choice(["columnar", "sqlite"]), default="columnar")
+def convert(input_path, output_path, output_format):
+    """
+    Append a jsonl stats file to a columnar store or SQLite database
+    """
+    convert_format = convert_jsonl if output_format == "columnar" else convert_jsonl_sqlite
+    converted, skipped = convert_format(Path(input_path).expanduser(), Path(output_path).expanduser())
+    secho(f"Converted {converted} launches ({skipped} lines skipped)", fg="green")
+
+
+@cli.command()
+@option("--input-path", type=ClickPath(exists=True, dir_okay=False), required=True, help="SQLite stats database")
+@option("--platform", "platform_name", type=Choice([platform.value for platform in PlatformType], case_sensitive=False), default=None)
+@option("--geography", default=None)
+@option("--spot/--on-demand", default=None)
+@option("--machine-type", default=None)
+@option("--accelerator-type", default=None)
+@option("--error-code", default=None, help="Only launches that failed with this code")
+@option("--days", type=int, default=None, help="Only launches in the last this many days")
+@option("--hours", type=(int, int), default=None, help="Only launches between these hours of the day, like `2 4`")
+def query(input_path, platform_name, geography, spot, machine_type, accelerator_type, error_code, days, hours):
+    """
+    Success rate and errors of the launches in a SQLite database that match the filters
+    """
+    launch_filter = LaunchFilter(
+        platform=PlatformType(platform_name.upper()) if platform_name else None,
+        geography=geography,
+        spot=spot,
+        machine_type=machine_type,
+        accelerator_type=accelerator_type,
+        error_code=error_code,
+        since=datetime.now() - timedelta(days=days) if days is not None else None,
+        hours=hours,
+    )
+
+    with SqliteStatsReader(Path(input_path).expanduser()) as reader:
+        summary = reader.summary(launch_filter)
+
+    success_rate = f"{summary.success_rate:.1%}" if summary.success_rate is not None else "-"
+    secho(f"launches={summary.launches}  success={success_rate}  dropped={summary.dropped}")
+    for error, count in summary.errors.items():
+        secho(f"  {count:>6}  {error}", fg="red")
+
+
+@cli.command()
+@option("--input-path", type=ClickPath(exists=True, dir_okay=False), required=True, help="Stats jsonl file")
+def rebuild_rollups(input_path):
+    """
+    Recompute the hourly and daily rollups sidecar from the raw stats log
+    """
+    input_path = Path(input_path).expanduser()
+    rollups = Rollups(rollups_path(input_path))
+    rollups.rebuild(read_stats(input_path))
+    secho(f"Wrote {len(rollups.buckets)} buckets to {rollups.path}", fg="green")
+
+
+def format_seconds(value):
+    return "-" if value is None else f"{value:.1f}s"
+
+
+@cli.command()
+@option("--input-path", type=ClickPath(exists=True, dir_okay=False), required=True, help="Stats jsonl file")
+@option("--workers", type=int, default=None, help="Processes used to aggregate large files, defaults to the CPU count")
+@option("--json", "as_json", is_flag=True, default=False, help="Print the report as JSON")
+def report(input_path, workers, as_json):
+    """
+    Summarize launch success, latency and errors by platform, geography and spot
+    """
+    summary = build_report(Path(input_path).expanduser(), workers=workers).to_dict()
+
+    if as_json:
+        secho(dumps(summary, indent=2))
+        return
+
+    for group in summary["groups"]:
+        spot = "spot" if group["spot"] else "on-demand"
+        success_rate = f"{group['success_rate']:.1%}" if group["success_rate"] is not None else "-"
+        latencies = "  ".join(
+            f"p{int(quantile * 100)}={format_seconds(group['create_seconds'][f'p{int(quantile * 100)}'])}"
+            for quantile in QUANTILES
+        )
+        hardware = "/".join(value for value in [group["machine_type"], group["accelerator_type"]] if value)
+        label = " ".join(value for value in [group["platform"], group["geography"], hardware] if value)
+        secho(f"{label} ({spot})", bold=True)
+        secho(f"  launches={group['launches']}  success={success_rate}  dropped={group['dropped']}  {latencies}")
+        if group["phase_seconds"]:
+            phases = "  ".join(
+                f"{phase}={format_seconds(quantiles['p50'])}"
+                for phase, quantiles in group["phase_seconds"].items()
+            )
+            secho(f"  p50 by phase: {phases}")
+
+        for error, count in group["errors"].items():
+            secho(f"  {count:>6}  {error}", fg="red")
+
+        hourly = " ".join(
+            "  - " if rate is None else f"{rate * 100:3.0f}%"
+            for rate in group["hourly_success_rate"]
+        )
+        secho(f"  success by hour (00-23): {hourly}")
+
+    if summary["skipped"]:
+        secho(f"Skipped {summary['skipped']} unparseable lines", fg="yellow")
+
+
+@cli.command()
+@option("--input-path", type=ClickPath(dir_okay=False), required=True, help="Stats jsonl file, which may not exist yet")
+@option("--refresh-interval", type=float, default=10, help="Seconds between reading new launches")
+@option("--history/--no-history", default=True, help="Start with the last week of launches already in the file, or only new ones")
+@option("--once", is_flag=True, default=False, help="Print the current windows and exit")
+def tail(input_path, refresh_interval, history, once):
+    """
+    Follow a stats file as it's written, with success and latency over the last hour, day and week
+    """
+    follower = StatsFollower(Path(input_path).expanduser(), history=history)
+    try:
+        while True:
+            follower.poll()
+
+            secho(f"{datetime.now().isoformat(timespec='seconds')}", bold=True)
+            for (platform, geography), windows in follower.availability.summaries().items():
+                secho(f"{platform} {geography}", bold=True)
+                for name, window in windows.items():
+                    success_rate = f"{window.success_rate:.1%}" if window.success_rate is not None else "-"
+                    latencies = "  ".join(
+                        f"p{int(quantile * 100)}={format_seconds(window.latency.quantile(quantile))}"
+                        for quantile in QUANTILES
+                    )
+                    secho(f"  {name:<5} launches={window.launches}  success={success_rate}  {latencies}")
+
+            if once:
+                break
+            sleep(refresh_interval)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        follower.close()
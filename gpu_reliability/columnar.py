@@ -0,0 +1,431 @@
+"""
+Append-only columnar storage for launch stats. Each column lives in its own fixed-width
+little endian file so analysis can memory map the history instead of re-parsing JSON:
+
+    strings.jsonl       dictionary of geography, hardware, error and warning strings; the id is the line number
+    <column>.bin        one value per launch for every entry of `ROW_COLUMNS`
+    warnings.bin        flattened warning string ids, sliced per launch by `warnings_end`
+
+"""
+from datetime import datetime, timedelta
+from json import dumps, loads, JSONDecodeError
+from os import fsync
+from pathlib import Path
+from struct import Struct
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from uuid import UUID
+from gpu_reliability.models import LaunchPhase, LaunchRequest, PlatformType
+from gpu_reliability.stats_logger import BufferedStatsLogger, Stat, decode_stat
+import numpy as np
+
+
+# Explicit codes, rather than enum order, so that adding a platform never rewrites history
+PLATFORM_CODES = {
+    PlatformType.GCP: 0,
+    PlatformType.AWS: 1,
+}
+PLATFORMS_BY_CODE = {code: platform for platform, code in PLATFORM_CODES.items()}
+
+# String id used for optional values that are not present
+MISSING_STRING = -1
+MISSING_TRIGGER = bytes(16)
+# Column of each launch phase's duration, NaN when the launch didn't reach it
+PHASE_COLUMNS = {phase: f"{phase.value}_seconds" for phase in LaunchPhase}
+
+EPOCH = datetime(1970, 1, 1)
+
+# column name -> (struct format, numpy dtype)
+ROW_COLUMNS = {
+    # Microseconds since the epoch in the same (naive, local) clock that Stat.timestamp uses
+    "timestamp": ("<q", "<i8"),
+    "platform": ("<B", "u1"),
+    "geography": ("<i", "<i4"),
+    "spot": ("<?", "?"),
+    "create_success": ("<?", "?"),
+    # NaN when the launch didn't report a duration
+    "create_seconds": ("<d", "<f8"),
+    "error": ("<i", "<i4"),
+    "identifier": ("16s", "S16"),
+    # Exclusive end offset of this launch's entries in the warnings column
+    "warnings_end": ("<Q", "<u8"),
+    "machine_type": ("<i", "<i4"),
+    "accelerator_type": ("<i", "<i4"),
+    # All zero when the launch wasn't part of a trigger
+    "trigger_id": ("16s", "S16"),
+    **{column: ("<d", "<f8") for column in PHASE_COLUMNS.values()},
+}
+
+# Columns added after the store format was first released, with the value that launches
+# written before them are backfilled with
+BACKFILLED_COLUMNS = {
+    "machine_type": MISSING_STRING,
+    "accelerator_type": MISSING_STRING,
+    "trigger_id": MISSING_TRIGGER,
+    **{column: float("nan") for column in PHASE_COLUMNS.values()},
+}
+WARNINGS_COLUMN = ("<i", "<i4")
+STRINGS_FILE = "strings.jsonl"
+
+
+def column_path(path: Path, name: str) -> Path:
+    return path / f"{name}.bin"
+
+
+def timestamp_micros(timestamp: datetime) -> int:
+    if timestamp.tzinfo is not None:
+        timestamp = timestamp.astimezone().replace(tzinfo=None)
+    return (timestamp - EPOCH) // timedelta(microseconds=1)
+
+
+def read_strings(path: Path) -> List[str]:
+    strings_path = path / STRINGS_FILE
+    if not strings_path.exists():
+        return []
+
+    strings = []
+    with open(strings_path) as file:
+        for line in file:
+            # A torn final line means the process died mid-append; nothing references it yet
+            if not line.endswith("\n"):
+                break
+            strings.append(loads(line))
+    return strings
+
+
+class ColumnarStatsWriter:
+    """
+    Append stats to a columnar store. Not thread-safe; ColumnarStatsLogger funnels every
+    write through a single writer thread.
+
+    """
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+
+        self.strings = read_strings(self.path)
+        self.string_ids = {value: index for index, value in enumerate(self.strings)}
+
+        self.structs = {name: Struct(format) for name, (format, _) in ROW_COLUMNS.items()}
+        self.warnings_struct = Struct(WARNINGS_COLUMN[0])
+
+        self.rows, self.warnings_count = self.repair()
+
+        self.strings_file = open(self.path / STRINGS_FILE, "a")
+        self.column_files = {name: open(column_path(self.path, name), "ab") for name in ROW_COLUMNS}
+        self.warnings_file = open(column_path(self.path, "warnings"), "ab")
+
+    def repair(self) -> Tuple[int, int]:
+        """
+        Truncate every column to the last launch that was fully written so that a crash
+        mid-append never misaligns the columns.
+
+        """
+        strings_path = self.path / STRINGS_FILE
+        strings_path.touch()
+        with open(strings_path, "r+b") as file:
+            file.truncate(len("".join(dumps(value) + "\n" for value in self.strings).encode()))
+
+        self.backfill()
+
+        sizes = {}
+        for name, struct in self.structs.items():
+            column = column_path(self.path, name)
+            column.touch()
+            sizes[name] = column.stat().st_size // struct.size
+        rows = min(sizes.values())
+
+        warnings_path = column_path(self.path, "warnings")
+        warnings_path.touch()
+        warnings_count = warnings_path.stat().st_size // self.warnings_struct.size
+
+        # Step back over launches whose warnings didn't make it to disk
+        warnings_end = 0
+        with open(column_path(self.path, "warnings_end"), "rb") as file:
+            while rows > 0:
+                file.seek((rows - 1) * self.structs["warnings_end"].size)
+                (warnings_end,) = self.structs["warnings_end"].unpack(file.read(self.structs["warnings_end"].size))
+                if warnings_end <= warnings_count:
+                    break
+                rows -= 1
+        if rows == 0:
+            warnings_end = 0
+
+        for name, struct in self.structs.items():
+            with open(column_path(self.path, name), "r+b") as file:
+                file.truncate(rows * struct.size)
+        with open(warnings_path, "r+b") as file:
+            file.truncate(warnings_end * self.warnings_struct.size)
+
+        return rows, warnings_end
+
+    def backfill(self):
+        """
+        Create the columns that were added to the format since this store was written, so
+        they line up with the existing launches.
+
+        """
+        timestamps = column_path(self.path, "timestamp")
+        if not timestamps.exists():
+            return
+
+        rows = timestamps.stat().st_size // self.structs["timestamp"].size
+        for name, value in BACKFILLED_COLUMNS.items():
+            column = column_path(self.path, name)
+            if not column.exists():
+                column.write_bytes(self.structs[name].pack(value) * rows)
+
+    def string_id(self, value: Optional[str]) -> int:
+        if value is None:
+            return MISSING_STRING
+
+        string_id = self.string_ids.get(value)
+        if string_id is None:
+            string_id = len(self.strings)
+            self.strings.append(value)
+            self.string_ids[value] = string_id
+            self.strings_file.write(dumps(value) + "\n")
+        return string_id
+
+    def append_many(self, stats: Iterable[Stat]):
+        columns = {name: bytearray() for name in ROW_COLUMNS}
+        warnings = bytearray()
+
+        # Counted locally so a stat that fails to pack leaves the writer in step with the files
+        rows = self.rows
+        warnings_count = self.warnings_count
+
+        for stat in stats:
+            for warning in stat.warnings:
+                warnings += self.warnings_struct.pack(self.string_id(warning))
+                warnings_count += 1
+
+            values = {
+                "timestamp": timestamp_micros(stat.timestamp),
+                "platform": PLATFORM_CODES[stat.platform],
+                "geography": self.string_id(stat.request.geography),
+                "spot": stat.request.spot,
+                "create_success": stat.create_success,
+                "create_seconds": float("nan") if stat.create_seconds is None else stat.create_seconds,
+                "error": self.string_id(stat.error),
+                "identifier": stat.request.identifier.bytes,
+                "warnings_end": warnings_count,
+                "machine_type": self.string_id(stat.request.machine_type),
+                "accelerator_type": self.string_id(stat.request.accelerator_type),
+                "trigger_id": MISSING_TRIGGER if stat.request.trigger_id is None else stat.request.trigger_id.bytes,
+                **{
+                    column: stat.phase_seconds.get(phase.value, float("nan"))
+                    for phase, column in PHASE_COLUMNS.items()
+                },
+            }
+            for name, value in values.items():
+                columns[name] += self.structs[name].pack(value)
+            rows += 1
+
+        # Dependencies are written before the rows that reference them, so a reader that
+        # sizes itself by the row columns never sees dangling string or warning ids
+        self.strings_file.flush()
+        self.warnings_file.write(warnings)
+        self.warnings_file.flush()
+        for name, file in self.column_files.items():
+            file.write(columns[name])
+            file.flush()
+
+        self.rows = rows
+        self.warnings_count = warnings_count
+
+    def append(self, stat: Stat):
+        self.append_many([stat])
+
+    def sync(self):
+        for file in [self.strings_file, self.warnings_file, *self.column_files.values()]:
+            file.flush()
+            fsync(file.fileno())
+
+    def close(self):
+        for file in [self.strings_file, self.warnings_file, *self.column_files.values()]:
+            file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class ColumnarStatsLogger(BufferedStatsLogger):
+    """
+    Drop-in StatsLogger that writes to a columnar store directory instead of a jsonl file.
+
+    """
+    def __init__(self, path: Union[str, Path], **kwargs):
+        # Creating the directory first also keeps the base class from touching a file at `path`
+        Path(path).mkdir(parents=True, exist_ok=True)
+        super().__init__(path, **kwargs)
+
+    def open_output(self):
+        return ColumnarStatsWriter(self.path)
+
+    def write_batch(self, output: ColumnarStatsWriter, batch: List[Stat]):
+        output.append_many(batch)
+
+    def sync_output(self, output: ColumnarStatsWriter):
+        output.sync()
+
+
+def map_column(path: Path, dtype: str) -> np.ndarray:
+    # mmap refuses zero-length files
+    if not path.exists() or path.stat().st_size == 0:
+        return np.empty(0, dtype=dtype)
+    dtype = np.dtype(dtype)
+    length = path.stat().st_size // dtype.itemsize
+    return np.memmap(path, dtype=dtype, mode="r", shape=(length,))
+
+
+class ColumnarStatsReader:
+    """
+    Read-only view over a columnar store. Columns are memory mapped, so the arrays are
+    backed by the page cache rather than copied into memory. The view is a snapshot of
+    the launches that were fully written when the reader was created.
+
+    """
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.strings = read_strings(self.path)
+        self.string_ids = {value: index for index, value in enumerate(self.strings)}
+
+        mapped = {name: map_column(column_path(self.path, name), dtype) for name, (_, dtype) in ROW_COLUMNS.items()}
+        for name, value in BACKFILLED_COLUMNS.items():
+            # Stores that no writer has opened since the column was added
+            if not column_path(self.path, name).exists():
+                mapped[name] = np.full(len(mapped["timestamp"]), value, dtype=ROW_COLUMNS[name][1])
+        self.rows = min(len(column) for column in mapped.values())
+
+        warnings = map_column(column_path(self.path, "warnings"), WARNINGS_COLUMN[1])
+        # Launches whose warnings are still in flight are excluded from the snapshot
+        while self.rows > 0 and mapped["warnings_end"][self.rows - 1] > len(warnings):
+            self.rows -= 1
+
+        self.columns = {name: column[:self.rows] for name, column in mapped.items()}
+        self.warnings_ids = warnings
+
+    def __len__(self):
+        return self.rows
+
+    @property
+    def timestamp(self) -> np.ndarray:
+        return self.columns["timestamp"].view("datetime64[us]")
+
+    @property
+    def platform(self) -> np.ndarray:
+        return self.columns["platform"]
+
+    @property
+    def geography(self) -> np.ndarray:
+        return self.columns["geography"]
+
+    @property
+    def spot(self) -> np.ndarray:
+        return self.columns["spot"]
+
+    @property
+    def create_success(self) -> np.ndarray:
+        return self.columns["create_success"]
+
+    @property
+    def create_seconds(self) -> np.ndarray:
+        return self.columns["create_seconds"]
+
+    @property
+    def error(self) -> np.ndarray:
+        return self.columns["error"]
+
+    @property
+    def machine_type(self) -> np.ndarray:
+        return self.columns["machine_type"]
+
+    @property
+    def accelerator_type(self) -> np.ndarray:
+        return self.columns["accelerator_type"]
+
+    def phase_seconds(self, phase: LaunchPhase) -> np.ndarray:
+        return self.columns[PHASE_COLUMNS[phase]]
+
+    def string_id(self, value: str) -> int:
+        """
+        Dictionary id for a geography, hardware type, error or warning; MISSING_STRING if it never occurs,
+        which conveniently matches no launch when used in a mask.
+
+        """
+        return self.string_ids.get(value, MISSING_STRING)
+
+    def string(self, string_id: int) -> Optional[str]:
+        return None if string_id == MISSING_STRING else self.strings[string_id]
+
+    def warnings(self, row: int) -> List[str]:
+        ends = self.columns["warnings_end"]
+        start = int(ends[row - 1]) if row > 0 else 0
+        return [self.strings[string_id] for string_id in self.warnings_ids[start:int(ends[row])]]
+
+    def uuid_bytes(self, name: str, row: int) -> bytes:
+        # numpy strips trailing null bytes from fixed-width strings
+        return bytes(self.columns[name][row]).ljust(16, b"\0")
+
+    def trigger_id(self, row: int) -> Optional[UUID]:
+        value = self.uuid_bytes("trigger_id", row)
+        return None if value == MISSING_TRIGGER else UUID(bytes=value)
+
+    def stat(self, row: int) -> Stat:
+        create_seconds = float(self.create_seconds[row])
+        return Stat(
+            platform=PLATFORMS_BY_CODE[int(self.platform[row])],
+            create_success=bool(self.create_success[row]),
+            request=LaunchRequest(
+                spot=bool(self.spot[row]),
+                geography=self.string(int(self.geography[row])),
+                identifier=UUID(bytes=self.uuid_bytes("identifier", row)),
+                machine_type=self.string(int(self.machine_type[row])),
+                accelerator_type=self.string(int(self.accelerator_type[row])),
+                trigger_id=self.trigger_id(row),
+            ),
+            create_seconds=None if create_seconds != create_seconds else create_seconds,
+            error=self.string(int(self.error[row])),
+            timestamp=EPOCH + timedelta(microseconds=int(self.columns["timestamp"][row])),
+            warnings=self.warnings(row),
+            phase_seconds={
+                phase.value: float(seconds)
+                for phase in LaunchPhase
+                if (seconds := self.phase_seconds(phase)[row]) == seconds
+            },
+        )
+
+
+def convert_jsonl(jsonl_path: Union[str, Path], store_path: Union[str, Path], batch_size: int = 10_000) -> Tuple[int, int]:
+    """
+    Append every launch in an existing stats.jsonl file to a columnar store.
+
+    :return: Count of converted launches, and count of lines skipped because they don't
+        describe a launch
+
+    """
+    converted = 0
+    skipped = 0
+
+    with ColumnarStatsWriter(store_path) as writer, open(jsonl_path) as file:
+        batch = []
+        for line in file:
+            try:
+                batch.append(decode_stat(loads(line)))
+            except (JSONDecodeError, KeyError, TypeError, ValueError):
+                skipped += 1
+                continue
+
+            if len(batch) >= batch_size:
+                writer.append_many(batch)
+                converted += len(batch)
+                batch = []
+
+        writer.append_many(batch)
+        converted += len(batch)
+        writer.sync()
+
+    return converted, skipped
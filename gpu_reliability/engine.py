@@ -0,0 +1,205 @@
+import asyncio
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from threading import Thread
+from typing import Callable, Dict, List, Optional, Set, TypeVar
+from gpu_reliability.models import LaunchRequest
+from gpu_reliability.platforms.base import PlatformBase
+from gpu_reliability.logging import logger
+
+
+Result = TypeVar("Result")
+
+
+@dataclass
+class PlatformState:
+    # Set while a cleanup runs, so launches that finish meanwhile ask for another pass
+    # instead of starting an overlapping one
+    cleaning: bool = False
+    cleanup_requested: bool = False
+    probes: Set[asyncio.Task] = field(default_factory=set)
+
+
+@logger
+class ProbeEngine:
+    """
+    Runs the probes of many platforms as coroutines on one event loop, instead of a worker
+    thread per platform. Each probe launches an instance, records it, and cleans up the
+    platform once it finishes.
+
+    The cloud SDKs only offer blocking calls, so they run on a single shared executor. Its size
+    caps the blocking calls in flight across every platform, however many are probed.
+
+    Platforms keep their own launch queue and launch slots, so drop policies and concurrency
+    limits behave the same as with `PlatformBase.spawn`. Their worker threads should not be spawned as well.
+
+    """
+    def __init__(
+        self,
+        platforms: List[PlatformBase],
+        max_workers: int = 32,
+        probe_timeout: Optional[float] = None,
+    ):
+        """
+        :param max_workers: Threads shared by the blocking SDK calls of every platform
+        :param probe_timeout: Seconds after which we stop waiting on a launch. The blocking
+            call can't be interrupted, so it finishes (and records its outcome) in the
+            background and keeps its launch slot until then.
+
+        """
+        self.platforms = platforms
+        self.probe_timeout = probe_timeout
+
+        self.executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="probe")
+        self.states: Dict[PlatformBase, PlatformState] = {
+            platform: PlatformState()
+            for platform in platforms
+        }
+        self.closing = False
+
+        self.loop = asyncio.new_event_loop()
+        self.cleanup_tasks: List[asyncio.Task] = []
+        self.thread = Thread(target=self.run_loop, name="probe-engine", daemon=True)
+        self.thread.start()
+
+    def run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.cleanup_tasks = [
+            self.loop.create_task(self.cleanup_periodically(platform))
+            for platform in self.platforms
+        ]
+        self.loop.run_forever()
+
+    def submit(self, platform: PlatformBase, request: LaunchRequest) -> Future:
+        """
+        Queue a launch on `platform`. Safe to call from any thread.
+
+        :return: Future that resolves to whether the launch was accepted by the platform's queue
+
+        """
+        if self.closing:
+            raise ValueError("Probe engine has already been closed")
+        return asyncio.run_coroutine_threadsafe(self.enqueue(platform, request), self.loop)
+
+    async def enqueue(self, platform: PlatformBase, request: LaunchRequest) -> bool:
+        if self.closing:
+            raise ValueError("Probe engine has already been closed")
+
+        accepted, dropped = platform.launch_queue.put(request, platform.has_capacity(request))
+
+        if dropped is not None:
+            self.logger.info(f"Replaced a `{platform.platform_type.value}` launch that was still waiting for a slot")
+
+        if accepted:
+            self.dispatch(platform)
+        else:
+            await self.offload(platform.reject_launch, request)
+        return accepted
+
+    def dispatch(self, platform: PlatformBase):
+        state = self.states[platform]
+        while (queued := platform.start_next_launch()) is not None:
+            probe = self.loop.create_task(self.probe(platform, queued.request))
+            state.probes.add(probe)
+            probe.add_done_callback(state.probes.discard)
+
+    async def probe(self, platform: PlatformBase, request: LaunchRequest):
+        launch = self.loop.run_in_executor(self.executor, partial(platform.run_launch, request))
+        # Freed when the blocking call returns rather than when we stop waiting on it, so the
+        # slot count matches the launches really in flight
+        launch.add_done_callback(partial(self.launch_finished, platform, request))
+
+        try:
+            await asyncio.wait_for(asyncio.shield(launch), self.probe_timeout)
+        except asyncio.TimeoutError:
+            self.logger.warning(
+                f"`{platform.platform_type.value}` launch exceeded {self.probe_timeout}s, "
+                "leaving it to finish in the background"
+            )
+        except Exception:
+            # Logged by `launch_finished`
+            pass
+
+    def launch_finished(self, platform: PlatformBase, request: LaunchRequest, launch: asyncio.Future):
+        platform.launch_slots.release(platform.region_for(request.geography))
+
+        if not launch.cancelled() and launch.exception() is not None:
+            # Already recorded by `run_launch`; unlike a worker thread, the engine keeps running
+            self.logger.error(f"`{platform.platform_type.value}` launch crashed", exc_info=launch.exception())
+
+        if self.closing:
+            return
+        state = self.states[platform]
+        followup = self.loop.create_task(self.cleanup(platform))
+        state.probes.add(followup)
+        followup.add_done_callback(state.probes.discard)
+        self.dispatch(platform)
+
+    async def cleanup(self, platform: PlatformBase):
+        """
+        Clean up the platform's finished launches. Ones still in flight are left to their own
+        cleanup, so this doesn't wait for the platform to go idle.
+
+        """
+        state = self.states[platform]
+        if state.cleaning:
+            state.cleanup_requested = True
+            return
+
+        state.cleaning = True
+        try:
+            while True:
+                state.cleanup_requested = False
+                try:
+                    await self.offload(platform.cleanup_resources)
+                except Exception:
+                    self.logger.exception(f"`{platform.platform_type.value}` cleanup failed")
+                if not state.cleanup_requested or self.closing:
+                    break
+        finally:
+            state.cleaning = False
+
+    async def cleanup_periodically(self, platform: PlatformBase):
+        while True:
+            await asyncio.sleep(platform.cleanup_interval)
+            await self.cleanup(platform)
+
+    async def offload(self, func: Callable[..., Result], *args) -> Result:
+        return await self.loop.run_in_executor(self.executor, partial(func, *args))
+
+    async def shutdown(self, timeout: Optional[float]):
+        self.closing = True
+
+        for task in self.cleanup_tasks:
+            task.cancel()
+
+        for platform in self.platforms:
+            dropped = platform.launch_queue.clear()
+            if dropped:
+                self.logger.warning(f"Dropped {dropped} queued `{platform.platform_type.value}` launches on shutdown")
+
+        probes = [probe for state in self.states.values() for probe in state.probes]
+        if not probes:
+            return
+
+        _, pending = await asyncio.wait(probes, timeout=timeout)
+        for probe in pending:
+            probe.cancel()
+        if pending:
+            self.logger.warning(f"Cancelled {len(pending)} launches that were still in flight on shutdown")
+
+    def close(self, timeout: Optional[float] = None):
+        """
+        Stop accepting launches and wait up to `timeout` seconds for the ones in flight. Leftover
+        resources are left to the platforms' own `cleanup_resources`.
+
+        """
+        if self.closing:
+            return
+
+        asyncio.run_coroutine_threadsafe(self.shutdown(timeout), self.loop).result()
+        self.loop.call_soon_threadsafe(self.loop.stop)
+        self.thread.join()
+        self.loop.close()
+        self.executor.shutdown(wait=False, cancel_futures=True)
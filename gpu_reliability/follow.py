@@ -0,0 +1,293 @@
+"""
+Follow a stats jsonl file while the harness appends to it, keeping rolling-window availability
+for every platform and geography. Only newly appended bytes are ever parsed, and each launch
+updates the windows in constant time, so it can run next to the harness indefinitely.
+
+Windows are rings of fixed-width slots. A launch lands in the slot for its timestamp, reusing
+the slot once its previous contents have aged out of the window, so a window's edges are
+rounded to its slot width.
+
+"""
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from json import JSONDecodeError, loads
+from os import fstat
+from pathlib import Path
+from typing import BinaryIO, Dict, List, Optional, Tuple, Union
+from gpu_reliability.logging import logger
+from gpu_reliability.sketch import LatencySketch
+from gpu_reliability.stats_logger import Stat, decode_stat, is_harness_error
+
+
+@dataclass(frozen=True)
+class Window:
+    name: str
+    seconds: int
+    slots: int
+
+
+WINDOWS = [
+    Window("hour", 60 * 60, 60),
+    Window("day", 24 * 60 * 60, 96),
+    Window("week", 7 * 24 * 60 * 60, 168),
+]
+
+# (platform, geography)
+GroupKey = Tuple[str, str]
+
+# Once a binary search narrows the start of recent history to this many bytes, read lines in order
+SCAN_BYTES = 64 * 1024
+
+
+@dataclass
+class WindowSlot:
+    # Index of the slot-width interval since the epoch these counts belong to
+    slot: int = -1
+    launches: int = 0
+    successes: int = 0
+    latency: LatencySketch = field(default_factory=LatencySketch)
+
+
+@dataclass
+class WindowSummary:
+    launches: int
+    successes: int
+    latency: LatencySketch
+
+    @property
+    def success_rate(self) -> Optional[float]:
+        return self.successes / self.launches if self.launches else None
+
+
+class RollingWindow:
+    def __init__(self, window: Window):
+        self.window = window
+        self.slot_seconds = window.seconds / window.slots
+        self.slots = [WindowSlot() for _ in range(window.slots)]
+
+    def add(self, timestamp: float, success: bool, create_seconds: Optional[float]):
+        slot = int(timestamp // self.slot_seconds)
+        entry = self.slots[slot % len(self.slots)]
+        if entry.slot != slot:
+            if entry.slot > slot:
+                # Already aged out of the window by newer launches
+                return
+            entry = self.slots[slot % len(self.slots)] = WindowSlot(slot=slot)
+
+        entry.launches += 1
+        if success:
+            entry.successes += 1
+        entry.latency.add(create_seconds)
+
+    def summary(self, now: float) -> WindowSummary:
+        current = int(now // self.slot_seconds)
+        summary = WindowSummary(launches=0, successes=0, latency=LatencySketch())
+        for entry in self.slots:
+            if current - len(self.slots) < entry.slot <= current:
+                summary.launches += entry.launches
+                summary.successes += entry.successes
+                summary.latency.merge(entry.latency)
+        return summary
+
+
+class RollingAvailability:
+    """
+    Rolling windows of success rate and `create_seconds` for every platform and geography.
+
+    """
+    def __init__(self, windows: List[Window] = WINDOWS):
+        self.windows = windows
+        self.groups: Dict[GroupKey, List[RollingWindow]] = {}
+
+    def add(self, stat: Stat):
+        # Launches the harness dropped itself say nothing about the cloud's availability
+        if not stat.create_success and is_harness_error(stat.error):
+            return
+
+        key = (stat.platform.value, stat.request.geography)
+        windows = self.groups.get(key)
+        if windows is None:
+            windows = self.groups[key] = [RollingWindow(window) for window in self.windows]
+
+        timestamp = stat.timestamp.timestamp()
+        for window in windows:
+            window.add(timestamp, stat.create_success, stat.create_seconds)
+
+    def summaries(self, now: Optional[datetime] = None) -> Dict[GroupKey, Dict[str, WindowSummary]]:
+        now = (now or datetime.now()).timestamp()
+        return {
+            key: {window.window.name: window.summary(now) for window in windows}
+            for key, windows in sorted(self.groups.items())
+        }
+
+
+def parse_timestamp(line: bytes) -> Optional[datetime]:
+    try:
+        return datetime.fromisoformat(loads(line)["timestamp"])
+    except (JSONDecodeError, KeyError, TypeError, ValueError):
+        return None
+
+
+def find_offset(path: Union[str, Path], since: datetime) -> int:
+    """
+    Binary search the file for the first line written at or after `since`, so following
+    can start with recent history without parsing everything before it. Launches are
+    appended roughly in time order; ones recorded slightly out of order around the boundary
+    may be included or skipped.
+
+    :return: Byte offset of the start of that line
+
+    """
+    with open(path, "rb") as file:
+        # `low` is always the start of a line written before `since`, or of the file
+        low = 0
+        high = file.seek(0, 2)
+
+        while high - low > SCAN_BYTES:
+            middle = (low + high) // 2
+            file.seek(middle)
+            # Skip to the start of the next full line
+            file.readline()
+            line_start = file.tell()
+            timestamp = parse_timestamp(file.readline())
+            if timestamp is not None and timestamp < since:
+                low = line_start
+            else:
+                high = middle
+
+        file.seek(low)
+        while True:
+            offset = file.tell()
+            line = file.readline()
+            if not line:
+                return offset
+            timestamp = parse_timestamp(line)
+            if timestamp is None or timestamp >= since:
+                return offset
+
+
+@logger
+class FileFollower:
+    """
+    Reads the lines appended to a file since the last poll. Survives the file being truncated,
+    which starts over from the beginning, and being rotated: the rest of the old file is read
+    before following the new one from its start.
+
+    """
+    def __init__(self, path: Union[str, Path], offset: int = 0):
+        self.path = Path(path)
+        self.start_offset = offset
+
+        self.file: Optional[BinaryIO] = None
+        # Trailing bytes of a line that's still being written
+        self.partial = b""
+
+    @property
+    def offset(self) -> int:
+        """
+        Bytes of the current file consumed as complete lines.
+
+        """
+        if self.file is None:
+            return self.start_offset
+        return self.file.tell() - len(self.partial)
+
+    def open(self) -> bool:
+        try:
+            self.file = open(self.path, "rb")
+        except FileNotFoundError:
+            return False
+        self.file.seek(self.start_offset)
+        self.partial = b""
+        return True
+
+    def poll(self) -> List[bytes]:
+        if self.file is None and not self.open():
+            return []
+
+        if fstat(self.file.fileno()).st_size < self.file.tell():
+            self.logger.warning(f"`{self.path}` was truncated, reading from the start")
+            self.file.seek(0)
+            self.partial = b""
+
+        lines = self.read_available()
+
+        if self.rotated():
+            self.logger.info(f"`{self.path}` was rotated, following the new file")
+            if self.partial:
+                # The old file will never be finished
+                lines.append(self.partial)
+            self.file.close()
+            self.file = None
+            self.start_offset = 0
+            if self.open():
+                lines += self.read_available()
+
+        return lines
+
+    def read_available(self) -> List[bytes]:
+        data = self.file.read()
+        if not data:
+            return []
+        *lines, self.partial = (self.partial + data).split(b"\n")
+        return lines
+
+    def rotated(self) -> bool:
+        try:
+            return self.path.stat().st_ino != fstat(self.file.fileno()).st_ino
+        except FileNotFoundError:
+            # Moved away and not recreated yet; keep reading the old file until it is
+            return False
+
+    def close(self):
+        if self.file is not None:
+            self.file.close()
+            self.file = None
+
+
+class StatsFollower:
+    """
+    Feeds the launches appended to a stats file into rolling availability windows.
+
+    """
+    def __init__(self, path: Union[str, Path], availability: Optional[RollingAvailability] = None, history: bool = True):
+        """
+        :param history: Start with the launches already in the file that fall within the
+            longest window, rather than only the ones appended from now on
+
+        """
+        self.path = Path(path)
+        self.availability = availability if availability is not None else RollingAvailability()
+
+        offset = 0
+        if self.path.exists():
+            if history:
+                longest = max(window.seconds for window in self.availability.windows)
+                offset = find_offset(self.path, datetime.now() - timedelta(seconds=longest))
+            else:
+                offset = self.path.stat().st_size
+        self.follower = FileFollower(self.path, offset)
+
+        # Lines that didn't describe a launch
+        self.skipped = 0
+
+    def poll(self) -> int:
+        """
+        :return: Launches read since the last poll
+
+        """
+        launches = 0
+        for line in self.follower.poll():
+            if not line.strip():
+                continue
+            try:
+                stat = decode_stat(loads(line))
+            except (JSONDecodeError, KeyError, TypeError, ValueError):
+                self.skipped += 1
+                continue
+            self.availability.add(stat)
+            launches += 1
+        return launches
+
+    def close(self):
+        self.follower.close()
@@ -0,0 +1,94 @@
+"""
+Probe targets that a single trigger fans out to. Every launch from the same trigger shares a
+trigger id, so the stats from one sampling instant can be lined up as a cross-section of
+availability across geographies and hardware.
+
+"""
+from dataclasses import dataclass
+from itertools import product
+from random import Random
+from typing import Dict, Iterable, List, Optional
+from uuid import UUID, uuid4
+from gpu_reliability.models import LaunchRequest, PlatformType
+
+
+@dataclass(frozen=True)
+class ProbeTarget:
+    platform_type: PlatformType
+    geography: str
+    machine_type: Optional[str] = None
+    # Only used by platforms that attach accelerators separately from the machine type
+    accelerator_type: Optional[str] = None
+    spot: bool = False
+
+    def request(self, trigger_id: Optional[UUID] = None) -> LaunchRequest:
+        return LaunchRequest(
+            spot=self.spot,
+            geography=self.geography,
+            machine_type=self.machine_type,
+            accelerator_type=self.accelerator_type,
+            trigger_id=trigger_id,
+        )
+
+
+def expand_targets(
+    platform_type: PlatformType,
+    geographies: Iterable[str],
+    machine_types: Iterable[Optional[str]] = (None,),
+    accelerator_types: Iterable[Optional[str]] = (None,),
+    spot: Iterable[bool] = (False,),
+) -> List[ProbeTarget]:
+    """
+    Every combination of the given geographies, hardware and spot settings on one platform.
+
+    """
+    return [
+        ProbeTarget(
+            platform_type=platform_type,
+            geography=geography,
+            machine_type=machine_type,
+            accelerator_type=accelerator_type,
+            spot=is_spot,
+        )
+        for geography, machine_type, accelerator_type, is_spot in product(
+            geographies,
+            machine_types,
+            accelerator_types,
+            spot,
+        )
+    ]
+
+
+class ProbeMatrix:
+    def __init__(self, targets: List[ProbeTarget], seed: Optional[int] = None):
+        """
+        :param seed: Seeds the targets `sample` picks, so a run's choices can be reproduced
+
+        """
+        self.targets = targets
+        self.rng = Random(seed)
+
+    def targets_for(self, platform_type: PlatformType) -> List[ProbeTarget]:
+        return [target for target in self.targets if target.platform_type == platform_type]
+
+    def fan_out(self, trigger_id: Optional[UUID] = None) -> Dict[PlatformType, List[LaunchRequest]]:
+        """
+        One launch for every target, grouped by the platform that should run them.
+
+        """
+        trigger_id = trigger_id or uuid4()
+        requests: Dict[PlatformType, List[LaunchRequest]] = {}
+        for target in self.targets:
+            requests.setdefault(target.platform_type, []).append(target.request(trigger_id))
+        return requests
+
+    def sample(self, trigger_id: Optional[UUID] = None) -> Dict[PlatformType, List[LaunchRequest]]:
+        """
+        One launch for a random target of each platform.
+
+        """
+        trigger_id = trigger_id or uuid4()
+        return {
+            platform_type: [self.rng.choice(self.targets_for(platform_type)).request(trigger_id)]
+            for platform_type in dict.fromkeys(target.platform_type for target in self.targets)
+        }
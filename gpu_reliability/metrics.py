@@ -0,0 +1,316 @@
+"""
+In-process metrics for a running harness, served in the Prometheus text format so launch
+outcomes, sweep durations and orphaned instances can be alerted on without tailing the stats
+file. Recording holds a metric's lock just long enough to bump a number; values that are
+already tracked elsewhere, like queue depth, are read by collectors when the endpoint is scraped.
+
+"""
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from math import inf
+from threading import Lock, Thread
+from typing import TYPE_CHECKING, Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+from gpu_reliability.logging import logger
+from gpu_reliability.ratelimit import ApiFamily
+
+if TYPE_CHECKING:
+    from gpu_reliability.platforms.base import PlatformBase
+
+
+# Values of a metric's labels, in the order of its label names
+LabelValues = Tuple[str, ...]
+# Called at scrape time for the current value of each label combination
+Collector = Callable[[], Iterable[Tuple[LabelValues, float]]]
+
+# Launches and deletes take from seconds to the create timeout
+LATENCY_BUCKETS = (0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600)
+# Sweeps list every region before deleting what they find
+SWEEP_BUCKETS = (1, 5, 10, 30, 60, 120, 300, 600, 1200)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape_label(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def format_value(value: float) -> str:
+    if value == inf:
+        return "+Inf"
+    if value == -inf:
+        return "-Inf"
+    return repr(float(value))
+
+
+class Metric:
+    TYPE = ""
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.label_names = tuple(label_names)
+
+        self.lock = Lock()
+        self.values: Dict[LabelValues, float] = {}
+        self.collectors: List[Collector] = []
+
+    def key(self, labels: Dict[str, str]) -> LabelValues:
+        if len(labels) != len(self.label_names):
+            raise ValueError(f"`{self.name}` takes the labels {self.label_names}, not {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def add_collector(self, collector: Collector):
+        self.collectors.append(collector)
+
+    def format_labels(self, values: LabelValues, extra: Optional[Tuple[str, str]] = None) -> str:
+        pairs = list(zip(self.label_names, values))
+        if extra is not None:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{escape_label(value)}"' for name, value in pairs) + "}"
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            values = dict(self.values)
+        for collector in self.collectors:
+            values.update(collector())
+        return [f"{self.name}{self.format_labels(key)} {format_value(value)}" for key, value in sorted(values.items())]
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.TYPE}", *self.samples()]
+        return "\n".join(lines) + "\n"
+
+
+class Counter(Metric):
+    TYPE = "counter"
+
+    def inc(self, amount: float = 1, **labels: str):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = self.values.get(key, 0) + amount
+
+    def value(self, **labels: str) -> float:
+        with self.lock:
+            return self.values.get(self.key(labels), 0)
+
+
+class Gauge(Metric):
+    TYPE = "gauge"
+
+    def set(self, value: float, **labels: str):
+        key = self.key(labels)
+        with self.lock:
+            self.values[key] = value
+
+
+class Histogram(Metric):
+    """
+    Counts observations in fixed buckets, so recording is a binary search and two additions.
+
+    """
+    TYPE = "histogram"
+
+    def __init__(self, name: str, documentation: str, label_names: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS):
+        super().__init__(name, documentation, label_names)
+        self.buckets = tuple(sorted(buckets))
+        # Per label combination: count in each bucket (the last one is +Inf), and the sum
+        self.counts: Dict[LabelValues, List[int]] = {}
+        self.sums: Dict[LabelValues, float] = {}
+
+    def observe(self, value: float, **labels: str):
+        key = self.key(labels)
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            counts = self.counts.get(key)
+            if counts is None:
+                counts = self.counts[key] = [0] * (len(self.buckets) + 1)
+            counts[index] += 1
+            self.sums[key] = self.sums.get(key, 0.0) + value
+
+    def count(self, **labels: str) -> int:
+        with self.lock:
+            return sum(self.counts.get(self.key(labels), []))
+
+    def samples(self) -> List[str]:
+        with self.lock:
+            counts = {key: list(values) for key, values in self.counts.items()}
+            sums = dict(self.sums)
+
+        lines = []
+        for key in sorted(counts):
+            cumulative = 0
+            for bound, count in zip([*self.buckets, inf], counts[key]):
+                cumulative += count
+                lines.append(f"{self.name}_bucket{self.format_labels(key, ('le', format_value(bound)))} {cumulative}")
+            lines.append(f"{self.name}_sum{self.format_labels(key)} {format_value(sums[key])}")
+            lines.append(f"{self.name}_count{self.format_labels(key)} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self.lock = Lock()
+        self.metrics: Dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        """
+        :return: The metric already registered under the same name, if there is one, so
+            several platforms can share their metrics
+
+        """
+        with self.lock:
+            existing = self.metrics.get(metric.name)
+            if existing is None:
+                self.metrics[metric.name] = metric
+                return metric
+
+        if type(existing) is not type(metric) or existing.label_names != metric.label_names:
+            raise ValueError(f"`{metric.name}` is already registered as a different metric")
+        return existing
+
+    def counter(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, label_names))
+
+    def gauge(self, name: str, documentation: str, label_names: Sequence[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, label_names))
+
+    def histogram(self, name: str, documentation: str, label_names: Sequence[str] = (), buckets: Sequence[float] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, label_names, buckets))
+
+    def render(self) -> str:
+        with self.lock:
+            metrics = list(self.metrics.values())
+        return "".join(metric.render() for metric in metrics)
+
+
+class PlatformMetrics:
+    """
+    Metrics that every platform records, labeled by platform.
+
+    """
+    def __init__(self, registry: Optional[MetricsRegistry] = None):
+        self.registry = registry if registry is not None else MetricsRegistry()
+
+        self.launches = self.registry.counter(
+            "gpu_reliability_launches_total",
+            "Launches by outcome: success, capacity (out of capacity), failure, rejected, paused (circuit open) or skipped",
+            ["platform", "geography", "outcome"],
+        )
+        self.create_seconds = self.registry.histogram(
+            "gpu_reliability_create_seconds",
+            "Seconds from the create call until the instance left its pending state",
+            ["platform"],
+        )
+        self.phase_seconds = self.registry.histogram(
+            "gpu_reliability_launch_phase_seconds",
+            "Seconds each launch spent in each phase",
+            ["platform", "phase"],
+        )
+        self.delete_seconds = self.registry.histogram(
+            "gpu_reliability_delete_seconds",
+            "Seconds cleanup took to delete each instance",
+            ["platform"],
+        )
+        self.sweep_seconds = self.registry.histogram(
+            "gpu_reliability_sweep_seconds",
+            "Seconds each full sweep of the account took",
+            ["platform"],
+            buckets=SWEEP_BUCKETS,
+        )
+        self.orphans = self.registry.counter(
+            "gpu_reliability_orphaned_instances_total",
+            "Tagged instances found by sweeps that this process didn't launch",
+            ["platform"],
+        )
+        self.tracked_instances = self.registry.gauge(
+            "gpu_reliability_tracked_instances",
+            "Instances launched by this process that cleanup hasn't deleted yet",
+            ["platform"],
+        )
+        self.launches_in_flight = self.registry.gauge(
+            "gpu_reliability_launches_in_flight",
+            "Launches holding a launch slot",
+            ["platform"],
+        )
+        self.queued_launches = self.registry.gauge(
+            "gpu_reliability_queued_launches",
+            "Launches waiting for a launch slot",
+            ["platform"],
+        )
+        self.worker_up = self.registry.gauge(
+            "gpu_reliability_worker_up",
+            "1 while the platform's worker thread is running; always 0 with the asyncio engine",
+            ["platform"],
+        )
+        self.rate_limit_wait_seconds = self.registry.counter(
+            "gpu_reliability_rate_limit_wait_seconds_total",
+            "Seconds calls spent waiting on our own API rate limits",
+            ["platform", "family"],
+        )
+
+    def register(self, platform: "PlatformBase"):
+        """
+        Read the platform's own state at scrape time, instead of recording it as it changes.
+
+        """
+        label = (platform.platform_type.value,)
+
+        self.tracked_instances.add_collector(lambda: [(label, len(platform.instance_registry))])
+        self.launches_in_flight.add_collector(lambda: [(label, platform.launch_slots.total)])
+        self.queued_launches.add_collector(lambda: [(label, len(platform.launch_queue))])
+        self.worker_up.add_collector(lambda: [(label, 1 if platform.is_spawned else 0)])
+        self.rate_limit_wait_seconds.add_collector(
+            lambda: [
+                ((*label, family.value), platform.rate_limiter.waited_seconds(family))
+                for family in ApiFamily
+            ] if platform.rate_limiter is not None else []
+        )
+
+
+@logger
+class MetricsServer:
+    """
+    Serves a registry at `/metrics` from a background thread.
+
+    """
+    def __init__(self, registry: MetricsRegistry, port: int, host: str = "127.0.0.1"):
+        """
+        :param port: 0 picks a free port, see `self.port`
+
+        """
+        self.registry = registry
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(handler):
+                if handler.path.split("?", 1)[0] != "/metrics":
+                    handler.send_error(404)
+                    return
+                body = registry.render().encode()
+                handler.send_response(200)
+                handler.send_header("Content-Type", CONTENT_TYPE)
+                handler.send_header("Content-Length", str(len(body)))
+                handler.end_headers()
+                handler.wfile.write(body)
+
+            def log_message(handler, format, *args):
+                # Scrapes every few seconds would drown out the harness's own logs
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), Handler)
+        self.server.daemon_threads = True
+        self.thread = Thread(target=self.server.serve_forever, name="metrics", daemon=True)
+
+    @property
+    def port(self) -> int:
+        return self.server.server_address[1]
+
+    def start(self) -> "MetricsServer":
+        self.thread.start()
+        self.logger.info(f"Serving metrics on port {self.port}")
+        return self
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
@@ -1,5 +1,6 @@
 from enum import Enum, unique
 from dataclasses import dataclass, field
+from typing import Optional
 from uuid import UUID, uuid4
 
 
@@ -9,7 +10,26 @@ class PlatformType(Enum):
     AWS = "AWS"
 
 
-@dataclass
+@unique
+class LaunchPhase(Enum):
+    """
+    Stages of a launch that are timed separately, so slow launches can be attributed to our
+    own lookups, our rate limits or the cloud itself.
+
+    """
+    # Resolving the boot image, including cache misses that call the API
+    IMAGE_LOOKUP = "image_lookup"
+    # Waiting on our own rate limits before a call
+    THROTTLE = "throttle"
+    # The call that requests the instance
+    SUBMIT = "submit"
+    # Waiting for the instance to leave its pending state
+    PROVISIONING = "provisioning"
+    # Fetching the state the instance ended up in
+    STATUS = "status"
+
+
+@dataclass(slots=True)
 class LaunchRequest:
     """
     Requested device launch. Intended for use only by one provider.
@@ -21,3 +41,11 @@ class LaunchRequest:
     geography: str
 
     identifier: UUID = field(default_factory=uuid4)
+
+    # Override the platform's configured hardware for this launch. AWS bundles the
+    # accelerator into the machine type so it only uses `machine_type`.
+    machine_type: Optional[str] = None
+    accelerator_type: Optional[str] = None
+
+    # Shared by every launch that was fanned out from the same sampling instant
+    trigger_id: Optional[UUID] = None
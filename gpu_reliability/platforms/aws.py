@@ -1,24 +1,42 @@
-from time import time, sleep
-from gpu_reliability.platforms.base import PlatformType, PlatformBase, LaunchRequest, INSTANCE_TAG, INSTANCE_TAG_VALUE
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor, as_completed, wait
+from threading import Lock
+from typing import Dict, List, Optional
+from uuid import uuid4
+from gpu_reliability.platforms.base import PlatformType, PlatformBase, LaunchRequest, LaunchSkipped, INSTANCE_TAG, INSTANCE_TAG_VALUE
+from gpu_reliability.models import LaunchPhase
+from gpu_reliability.cache import ExpiringCache
+from gpu_reliability.ratelimit import ApiFamily, CircuitBreaker, RateLimit, RateLimiter
+from gpu_reliability.platforms.launch_queue import LaunchQueue
+from gpu_reliability.platforms.journal import InstanceJournal
+from gpu_reliability.metrics import PlatformMetrics
+from gpu_reliability.platforms.registry import TrackedInstance
+from gpu_reliability.platforms.spans import LaunchSpans
+from gpu_reliability.platforms.aws_clients import AWSClientPool
+from gpu_reliability.platforms.aws_waiter import AWSInstanceCodes, InstanceState, InstanceStateWaiter
 from boto3 import Session
 from gpu_reliability.stats_logger import StatsLogger, Stat
-from enum import Enum
 from gpu_reliability.logging import logger
 from backoff import on_exception, expo
 from botocore.exceptions import ClientError
 
 
-class AWSInstanceCodes(Enum):
-    PENDING = 0
-    RUNNING = 16 
-    SHUTTING_DOWN = 32 
-    TERMINATED = 48
-    STOPPING = 64
-    STOPPED = 80
-
-
 @logger
 class AWSPlatform(PlatformBase):
+    # Maximum instance ids accepted by a single terminate_instances call
+    TERMINATE_BATCH_SIZE = 1000
+    # Amazon Linux 2; AMI ids differ between regions so the latest one is looked up in each
+    # https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/finding-an-ami.html#finding-an-ami-aws-cli
+    IMAGE_NAME = "amzn2-ami-hvm-*-x86_64-gp2"
+
+    CAPACITY_ERROR_CODES = {"InsufficientInstanceCapacity", "InsufficientHostCapacity", "InsufficientCapacity"}
+    # Well under EC2's request token buckets, which are also per region
+    # https://docs.aws.amazon.com/AWSEC2/latest/APIReference/throttling.html
+    API_LIMITS = {
+        ApiFamily.READ: RateLimit(rate=10, burst=50),
+        ApiFamily.MUTATE: RateLimit(rate=2, burst=20),
+    }
+
     def __init__(
         self,
         access_key_id: str,
@@ -27,34 +45,92 @@ class AWSPlatform(PlatformBase):
         storage: StatsLogger,
         create_timeout: int = 200,
         delete_timeout: int = 300,
+        cleanup_concurrency: int = 8,
+        cleanup_deadline: int = 120,
+        image_ttl: int = 24 * 60 * 60,
+        image_refresh_after: int = 60 * 60,
+        max_concurrent_launches: int = 1,
+        launch_queue: Optional[LaunchQueue] = None,
+        max_launches_per_region: Optional[int] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        full_sweep_interval: int = 6 * 60 * 60,
+        journal: Optional[InstanceJournal] = None,
+        metrics: Optional[PlatformMetrics] = None,
+        session: Optional[Session] = None,
     ):
         """
         :param service_account_path: Path to the service account JSON file
-        :param machine_type: AWS supported machine type
+        :param machine_type: AWS supported machine type, used for launches that don't request
+            a machine type of their own
+        :param cleanup_concurrency: Number of regions that are swept for leftover instances at once
+        :param cleanup_deadline: Seconds a full cleanup sweep may take before we stop waiting on
+            the regions that haven't finished
+        :param image_ttl: Seconds a region's resolved boot image may be used before it is looked up again
+        :param image_refresh_after: Seconds after which a region's resolved boot image is refreshed
+            in the background, so the lookup stays off the launch path
+        :param max_concurrent_launches: Launches that may be in flight at once
+        :param launch_queue: Holds launches while every slot is busy
+        :param max_launches_per_region: Launches that may be in flight at once in any one region
+        :param circuit_breaker: Pauses launches to targets that keep running out of capacity
+        :param rate_limiter: Shared by every call this platform makes to the EC2 API
+        :param full_sweep_interval: How often cleanup sweeps every region for tagged instances
+        :param journal: Records launched instances so they can be torn down after a crash
+        :param metrics: Shared by every platform that's served on the same metrics endpoint
+        :param session: Used instead of a session built from the access keys, like the
+            in-process `FakeEC2Session`
 
         """
-        super().__init__(storage=storage)
+        super().__init__(
+            storage=storage,
+            max_concurrent_launches=max_concurrent_launches,
+            launch_queue=launch_queue,
+            max_launches_per_region=max_launches_per_region,
+            circuit_breaker=circuit_breaker,
+            full_sweep_interval=full_sweep_interval,
+            journal=journal,
+            metrics=metrics,
+        )
         self.machine_type = machine_type
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter(self.API_LIMITS)
 
         self.create_timeout = create_timeout
         self.delete_timeout = delete_timeout
+        self.cleanup_deadline = cleanup_deadline
 
-        self.session = Session(
+        self.cleanup_executor = ThreadPoolExecutor(
+            max_workers=cleanup_concurrency,
+            thread_name_prefix="aws-cleanup",
+        )
+
+        self.session = session if session is not None else Session(
             aws_access_key_id=access_key_id,
             aws_secret_access_key=secret_key,
         )
+        self.clients = AWSClientPool(self.session)
+
+        self.image_cache = ExpiringCache(self.find_image, ttl=image_ttl, refresh_after=image_refresh_after)
+
+        self.waiters_lock = Lock()
+        self.waiters: Dict[str, InstanceStateWaiter] = {}
 
     @property
     def platform_type(self) -> PlatformType:
         return PlatformType.AWS
 
-    def launch_instance(self, request: LaunchRequest):
-        # Init the resources based on the region request since all downstream
+    def launch_instance(self, request: LaunchRequest, spans: LaunchSpans):
+        # Use the resources of the requested region since all downstream
         # requests that use these resources will be made in the same region
-        client = self.session.client("ec2", region_name=request.geography)
-        resource = self.session.resource("ec2", region_name=request.geography)
+        client = self.clients.client(request.geography)
 
-        instance_name = f"gpu-test-{int(time())}"
+        try:
+            with spans.span(LaunchPhase.IMAGE_LOOKUP):
+                image_id = self.image_cache.get(request.geography)
+        except Exception as e:
+            raise LaunchSkipped(f"Unable to resolve boot image: {e}") from e
+
+        # Also the idempotency token of the launch, so a retried call can't create a second instance
+        instance_name = f"gpu-test-{uuid4()}"
 
         # Custom options that can be configured by init parameters
         additional_options = {}
@@ -71,146 +147,350 @@ class AWSPlatform(PlatformBase):
 
         self.logger.info(f"Creating instance `{instance_name}`...")
 
-        start = time()
-        # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ec2.html#EC2.Client.run_instances
-        created_instance = client.run_instances(
-            BlockDeviceMappings=[
-                {
-                    "DeviceName": "/dev/xvda",
-                    "Ebs": {
-
-                        "DeleteOnTermination": True,
-                        "VolumeSize": 8,
-                        "VolumeType": "gp2"
-                    },
-                },
-            ],
-            # https://docs.aws.amazon.com/AWSEC2/latest/UserGuide/finding-an-ami.html#finding-an-ami-aws-cli
-            # aws ec2 describe-images --query 'Images[?CreationDate>=`2022-04-01`][]'
-            ImageId="ami-090fa75af13c156b4",
-            InstanceType=self.machine_type,
-            MaxCount=1,
-            MinCount=1,
-            Monitoring={
-                "Enabled": False
-            },
-            TagSpecifications=[
-                {
-                    "ResourceType": "instance",
-                    "Tags": [
+        # Registered before the call so a crash while it's in flight still leaves a record
+        self.instance_registry.add(instance_name, request.geography, launch=request.identifier)
+
+        with spans.span(LaunchPhase.THROTTLE):
+            self.rate_limiter.acquire(ApiFamily.MUTATE, request.geography)
+
+        start = monotonic()
+        try:
+            # https://boto3.amazonaws.com/v1/documentation/api/latest/reference/services/ec2.html#EC2.Client.run_instances
+            with spans.span(LaunchPhase.SUBMIT):
+                created_instance = client.run_instances(
+                    BlockDeviceMappings=[
                         {
-                            "Key": INSTANCE_TAG,
-                            "Value": INSTANCE_TAG_VALUE,
+                            "DeviceName": "/dev/xvda",
+                            "Ebs": {
+
+                                "DeleteOnTermination": True,
+                                "VolumeSize": 8,
+                                "VolumeType": "gp2"
+                            },
                         },
+                    ],
+                    ClientToken=instance_name,
+                    ImageId=image_id,
+                    InstanceType=request.machine_type or self.machine_type,
+                    MaxCount=1,
+                    MinCount=1,
+                    Monitoring={
+                        "Enabled": False
+                    },
+                    TagSpecifications=[
                         {
-                            "Key": "Name",
-                            "Value": instance_name,
+                            "ResourceType": "instance",
+                            "Tags": [
+                                {
+                                    "Key": INSTANCE_TAG,
+                                    "Value": INSTANCE_TAG_VALUE,
+                                },
+                                {
+                                    "Key": "Name",
+                                    "Value": instance_name,
+                                },
+                            ]
                         },
-                    ]
-                },
-            ],
-            **additional_options,
-        )
+                    ],
+                    **additional_options,
+                )
+        except ClientError as e:
+            # Capacity and quota errors are raised by the call itself rather than reported
+            # through the instance state
+            self.instance_registry.remove(instance_name)
+            error = e.response.get("Error", {})
+            self.record(
+                Stat(
+                    platform=self.platform_type,
+                    request=request,
+                    create_success=False,
+                    error=f"[Code: {error.get('Code')}]: {error.get('Message')}",
+                    phase_seconds=spans.phase_seconds,
+                )
+            )
+            return
 
         instance_id = created_instance["Instances"][0]["InstanceId"]
+        self.instance_registry.resolve(instance_name, instance_id, AWSInstanceCodes.PENDING.name)
+
+        # The waiter batches describe calls across launches, so the state comes back with the
+        # wait rather than from a separate status call
+        with spans.span(LaunchPhase.PROVISIONING):
+            state = self.wait_for_status(
+                instance_id,
+                lambda x: x != AWSInstanceCodes.PENDING,
+                self.create_timeout,
+                region=request.geography,
+            )
+        create_time = state.transition_at - start
 
-        instance, state_type = self.wait_for_status(
-            instance_id,
-            lambda x: x != AWSInstanceCodes.PENDING,
-            self.create_timeout,
-            resource=resource,
-        )
-        create_time = time() - start
+        if state.code == AWSInstanceCodes.TERMINATED:
+            # Spot requests that can't be fulfilled terminate on their own
+            self.instance_registry.remove(instance_name)
+        else:
+            self.instance_registry.update(instance_name, state.code.name)
 
         self.logger.info(f"Finished creating instance `{instance_name}`")
 
         error = None
-        if state_type != AWSInstanceCodes.RUNNING:
-            final_state_code = instance.state_reason["Code"]
-            final_state_text = instance.state_reason["Message"]
+        if state.code != AWSInstanceCodes.RUNNING:
+            state_reason = state.state_reason or {}
+            final_state_code = state_reason.get("Code")
+            final_state_text = state_reason.get("Message")
             error = f"[Code: {final_state_code}]: {final_state_text}"
 
         # Check status
-        self.storage.write(
+        self.record(
             Stat(
                 platform=self.platform_type,
-                request=self.should_launch,
+                request=request,
                 create_seconds=create_time,
-                create_success=state_type == AWSInstanceCodes.RUNNING,
+                create_success=state.code == AWSInstanceCodes.RUNNING,
                 error=error,
+                phase_seconds=spans.phase_seconds,
             )
         )
 
-    def cleanup_resources(self):
-        # Choose a random region since we just need to list this
-        simple_client = self.session.client("ec2", "us-east-1")
-        regions = [region["RegionName"] for region in simple_client.describe_regions()["Regions"]]
-
-        for region in regions:
-            resource = self.session.resource("ec2", region_name=region)
-            instances = resource.instances.filter(
-                Filters=[
-                    {
-                        "Name": f"tag:{INSTANCE_TAG}",
-                        "Values": [
-                            INSTANCE_TAG_VALUE
-                        ]
-                    },
-                    {
-                        # Only attempt to terminate instances that are fully running and where shutdown
-                        # actions haven't yet been taken
-                        "Name": "instance-state-name",
-                        "Values": [
-                            "running",
-                        ],
-                    }
-                ]
-            )
+    def find_image(self, region: str) -> str:
+        self.rate_limiter.acquire(ApiFamily.READ, region)
+        images = self.clients.client(region).describe_images(
+            Owners=["amazon"],
+            Filters=[
+                {"Name": "name", "Values": [self.IMAGE_NAME]},
+                {"Name": "state", "Values": ["available"]},
+            ],
+        )["Images"]
+        if not images:
+            raise ValueError(f"No `{self.IMAGE_NAME}` image in `{region}`")
+        return max(images, key=lambda image: image["CreationDate"])["ImageId"]
 
-            for instance in instances:
-                instance_id = instance.instance_id
-                instance_name = self.name_from_instance(instance)
+    def cleanup_resources(self, full_sweep: bool = False) -> Dict[str, float]:
+        """
+        :return: Seconds that each region took to clean up during a sweep, otherwise seconds that
+            each launched instance took to terminate
 
-                instances.terminate()
+        """
+        if full_sweep or self.instance_registry.sweep_due():
+            return self.sweep_resources()
+        return self.cleanup_launched()
 
-                self.logger.info(f"Deleting `{instance_name}`...")
+    def cleanup_launched(self) -> Dict[str, float]:
+        """
+        Terminate the instances this process launched, one batch per region, without searching
+        for them.
 
-                self.wait_for_status(
-                    instance_id,
-                    lambda x: x == AWSInstanceCodes.TERMINATED,
-                    self.delete_timeout,
-                    resource=resource,
-                )
+        :return: Seconds each instance took to terminate
 
-                self.logger.info(f"Finished deleting `{instance_name}`")
+        """
+        by_region: Dict[str, List[TrackedInstance]] = {}
+        for instance in self.instance_registry.settled():
+            by_region.setdefault(instance.geography, []).append(instance)
+
+        futures = {
+            self.cleanup_executor.submit(self.cleanup_launched_region, region, instances): region
+            for region, instances in by_region.items()
+        }
+
+        delete_seconds = {}
+        for future in as_completed(futures):
+            region = futures[future]
+            try:
+                delete_seconds.update(future.result())
+            except Exception:
+                # Left registered so the next cleanup tries again
+                self.logger.exception(f"Unable to terminate launched instances in `{region}`")
+
+        return delete_seconds
+
+    def cleanup_launched_region(self, region: str, instances: List[TrackedInstance]) -> Dict[str, float]:
+        targets = {
+            instance.instance_id: instance.name
+            for instance in instances
+            if instance.instance_id is not None
+        }
+
+        # Launches recovered from a crash that happened before run_instances returned; the
+        # instance may or may not have been created
+        unresolved = [instance.name for instance in instances if instance.instance_id is None]
+        if unresolved:
+            targets.update(self.find_instances(region, names=unresolved))
+
+        try:
+            delete_seconds = self.terminate_instances(region, targets) if targets else {}
+        except ClientError as e:
+            if e.response.get("Error", {}).get("Code") != "InvalidInstanceID.NotFound":
+                raise
+            # EC2 rejects the whole call if any id is gone, like ones journaled by a previous
+            # run. Look the instances up by name and terminate the ones that still exist.
+            targets = self.find_instances(region, names=list(targets.values()))
+            delete_seconds = self.terminate_instances(region, targets) if targets else {}
+
+        self.instance_registry.remove(*(instance.name for instance in instances))
+        return delete_seconds
+
+    def sweep_resources(self) -> Dict[str, float]:
+        """
+        Sweep every region in parallel for tagged instances that are still running.
 
-    def wait_for_status(
-        self,
-        instance_id: str,
-        break_condition,
-        max_wait: int,
-        resource: Session.resource,
-        check_interval: int = 1,
-    ):
-        instance = resource.Instance(instance_id)
-        instance_name = self.name_from_instance(instance)
+        :return: Seconds that each region took to clean up, for the regions that finished
+            within the sweep deadline
 
-        while max_wait > 0:
-            instance = resource.Instance(instance_id)
-            state_type = AWSInstanceCodes(instance.state["Code"])
-            self.logger.info(f"Status `{instance_name}`: {state_type}")
+        """
+        regions = self.clients.regions()
+
+        start = monotonic()
+        futures = {
+            self.cleanup_executor.submit(self.cleanup_region, region): region
+            for region in regions
+        }
+        done, not_done = wait(futures, timeout=self.cleanup_deadline)
+
+        region_seconds = {}
+        for future in done:
+            region = futures[future]
+            try:
+                region_seconds[region] = future.result()
+            except Exception:
+                self.logger.exception(f"Cleanup failed in `{region}`")
+
+        for future in not_done:
+            # Regions that never started are skipped; ones in flight keep running in the background
+            future.cancel()
+            self.logger.warning(f"Cleanup in `{futures[future]}` exceeded the {self.cleanup_deadline}s sweep deadline")
+
+        timings = ", ".join(
+            f"{region}={seconds:.1f}s"
+            for region, seconds in sorted(region_seconds.items(), key=lambda item: -item[1])
+        )
+        sweep_seconds = monotonic() - start
+        self.logger.info(f"Cleanup sweep finished in {sweep_seconds:.1f}s ({timings})")
+        self.metrics.sweep_seconds.observe(sweep_seconds, platform=self.platform_type.value)
+        self.instance_registry.swept()
+
+        return region_seconds
+
+    def cleanup_region(self, region: str) -> float:
+        start = monotonic()
+
+        # Instances of launches still in flight are cleaned up once those launches finish
+        instances = {
+            instance_id: name
+            for instance_id, name in self.find_instances(region).items()
+            if not self.instance_registry.in_flight(name)
+        }
+        orphans = [name for name in instances.values() if name not in self.instance_registry]
+        if orphans:
+            self.logger.warning(f"Found {len(orphans)} instances in `{region}` that this process didn't launch")
+            self.record_orphans(orphans)
+        if instances:
+            self.terminate_instances(region, instances)
+            self.instance_registry.remove(*instances.values())
+
+        return monotonic() - start
+
+    @on_exception(expo, ClientError, max_tries=8)
+    def find_instances(self, region: str, names: Optional[List[str]] = None) -> Dict[str, str]:
+        """
+        :param names: Only find the instances with these names. These are also found while
+            they're still pending, since we know they're ours and not another run's launch.
+        :return: Name of every tagged instance in the region that's running, by instance id
 
-            # Once we resolve the status of the resource, we don"t have to wait any longer
-            if break_condition(state_type):
-                return instance, state_type
+        """
+        filters = [
+            {
+                "Name": f"tag:{INSTANCE_TAG}",
+                "Values": [
+                    INSTANCE_TAG_VALUE
+                ]
+            },
+            {
+                # Only attempt to terminate instances that are fully running and where shutdown
+                # actions haven't yet been taken
+                "Name": "instance-state-name",
+                "Values": [
+                    "running",
+                ] if names is None else ["pending", "running"],
+            }
+        ]
+        if names is not None:
+            filters.append({"Name": "tag:Name", "Values": names})
+
+        # Results are a single page unless hundreds of instances leaked
+        self.rate_limiter.acquire(ApiFamily.READ, region)
+        paginator = self.clients.client(region).get_paginator("describe_instances")
+        pages = paginator.paginate(Filters=filters)
+
+        instances = {}
+        for page in pages:
+            for reservation in page["Reservations"]:
+                for instance in reservation["Instances"]:
+                    tagged_names = [tag["Value"] for tag in instance.get("Tags", []) if tag["Key"] == "Name"]
+                    instances[instance["InstanceId"]] = tagged_names[0] if tagged_names else instance["InstanceId"]
+        return instances
+
+    def terminate_instances(self, region: str, instances: Dict[str, str]) -> Dict[str, float]:
+        """
+        Terminate instances with one API call and track their shutdowns concurrently, so the
+        whole batch takes about as long as its slowest instance.
 
-            sleep(check_interval)
-            max_wait -= check_interval
+        :param instances: Instance names by instance id
+        :return: Seconds each instance took to terminate, for the ones that finished
+            within `delete_timeout`
 
-        raise TimeoutError(f"Instance `{instance_id}` did not reach break condition`")
+        """
+        client = self.clients.client(region)
+        for instance_name in instances.values():
+            self.logger.info(f"Deleting `{instance_name}`...")
+
+        start = monotonic()
+        instance_ids = list(instances)
+        for offset in range(0, len(instance_ids), self.TERMINATE_BATCH_SIZE):
+            self.rate_limiter.acquire(ApiFamily.MUTATE, region)
+            client.terminate_instances(InstanceIds=instance_ids[offset:offset + self.TERMINATE_BATCH_SIZE])
+
+        terminations = {
+            self.waiter(region).wait(
+                instance_id,
+                lambda x: x == AWSInstanceCodes.TERMINATED,
+                self.delete_timeout,
+            ): instance_id
+            for instance_id in instance_ids
+        }
+
+        delete_seconds = {}
+        for termination in as_completed(terminations):
+            instance_id = terminations[termination]
+            try:
+                delete_seconds[instance_id] = termination.result().transition_at - start
+            except TimeoutError:
+                self.logger.warning(f"`{instances[instance_id]}` did not terminate within {self.delete_timeout}s")
+                continue
+            self.logger.info(f"Finished deleting `{instances[instance_id]}` in {delete_seconds[instance_id]:.1f}s")
+
+        return self.record_deletes(delete_seconds)
+
+    def close(self):
+        super().close()
+        self.cleanup_executor.shutdown(wait=False, cancel_futures=True)
+        self.clients.close()
+
+    def waiter(self, region: str) -> InstanceStateWaiter:
+        with self.waiters_lock:
+            if region not in self.waiters:
+                self.waiters[region] = InstanceStateWaiter(
+                    self.clients.client(region),
+                    region,
+                    rate_limiter=self.rate_limiter,
+                )
+            return self.waiters[region]
 
-    @on_exception(expo, ClientError, max_tries=8)
-    def name_from_instance(self, instance):
-        # Sometimes AWS returns an error for these instances even if they do in fact exist
-        # https://stackoverflow.com/questions/8969677/aws-error-message-invalidinstanceid-notfound
-        return [tag for tag in instance.tags if tag["Key"] == "Name"][0]["Value"]
+    def wait_for_status(
+        self,
+        instance_id: str,
+        break_condition,
+        max_wait: int,
+        region: str,
+    ) -> InstanceState:
+        state = self.waiter(region).wait(instance_id, break_condition, max_wait).result()
+        self.logger.info(f"Status `{state.name or instance_id}`: {state.code}")
+        return state
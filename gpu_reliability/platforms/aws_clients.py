@@ -0,0 +1,86 @@
+from threading import Lock, local
+from typing import Dict, List
+from boto3 import Session
+from gpu_reliability.cache import ExpiringCache
+from gpu_reliability.logging import logger
+
+
+@logger
+class AWSClientPool:
+    """
+    Per-region cache of boto3 EC2 clients and resources. Building either loads the service
+    model and endpoint configuration, which is slow enough to distort launch timings if it
+    happens on every request.
+
+    Clients are thread-safe and shared by every thread. Resources are not, so each thread
+    gets its own resource per region.
+
+    """
+    def __init__(self, session: Session, region_ttl: float = 60 * 60):
+        """
+        :param region_ttl: Seconds to cache the list of enabled regions before fetching it again
+
+        """
+        self.session = session
+
+        # Sessions aren't safe to build clients from concurrently
+        self.lock = Lock()
+        self.clients: Dict[str, object] = {}
+        self.thread_resources = local()
+        self.resources: List[object] = []
+        self.closed = False
+
+        self.region_cache = ExpiringCache(lambda _: self.fetch_regions(), ttl=region_ttl)
+
+    def client(self, region: str):
+        client = self.clients.get(region)
+        if client is not None:
+            return client
+
+        with self.lock:
+            self.check_open()
+            if region not in self.clients:
+                self.clients[region] = self.session.client("ec2", region_name=region)
+            return self.clients[region]
+
+    def resource(self, region: str):
+        resources = getattr(self.thread_resources, "by_region", None)
+        if resources is None:
+            resources = self.thread_resources.by_region = {}
+
+        resource = resources.get(region)
+        if resource is None:
+            with self.lock:
+                self.check_open()
+                resource = resources[region] = self.session.resource("ec2", region_name=region)
+                self.resources.append(resource)
+        return resource
+
+    def regions(self) -> List[str]:
+        return self.region_cache.get()
+
+    def fetch_regions(self) -> List[str]:
+        # Any region can list the others
+        return [region["RegionName"] for region in self.client("us-east-1").describe_regions()["Regions"]]
+
+    def check_open(self):
+        if self.closed:
+            raise ValueError("Client pool has already been closed")
+
+    def close(self):
+        """
+        Release the connection pools held by every cached client.
+
+        """
+        with self.lock:
+            self.closed = True
+            clients = list(self.clients.values()) + [resource.meta.client for resource in self.resources]
+            self.clients = {}
+            self.resources = []
+            self.region_cache.clear()
+
+        for client in clients:
+            # `close` is only available on newer botocore releases
+            close = getattr(client, "close", None)
+            if close is not None:
+                close()
@@ -0,0 +1,202 @@
+from concurrent.futures import Future
+from dataclasses import dataclass
+from enum import Enum
+from threading import Condition, Thread
+from time import monotonic
+from typing import Callable, Dict, List, Optional
+from gpu_reliability.logging import logger
+from gpu_reliability.ratelimit import ApiFamily, RateLimiter
+
+
+class AWSInstanceCodes(Enum):
+    PENDING = 0
+    RUNNING = 16
+    SHUTTING_DOWN = 32
+    TERMINATED = 48
+    STOPPING = 64
+    STOPPED = 80
+
+
+@dataclass
+class InstanceState:
+    instance_id: str
+    code: AWSInstanceCodes
+    name: Optional[str]
+    # Populated by AWS when the state changed for a reason other than a normal launch
+    state_reason: Optional[dict]
+    # Monotonic time of the poll that first observed this state
+    observed_at: float
+    # Best monotonic estimate of when the transition happened: the midpoint between the last
+    # poll that didn't satisfy the wait and the one that did
+    transition_at: float
+
+
+@dataclass
+class PendingWait:
+    instance_id: str
+    condition: Callable[[AWSInstanceCodes], bool]
+    future: Future
+    deadline: float
+    last_unmet_at: float
+
+
+@logger
+class InstanceStateWaiter:
+    """
+    Resolves every outstanding wait on EC2 instance states in one region with a single
+    `describe_instances` call per tick. Polling starts fast so transitions are timestamped
+    precisely and backs off while nothing changes; registering a new wait resets it.
+
+    The polling thread only runs while there are waits outstanding.
+
+    """
+    # Upper bound on the values of a single describe_instances filter
+    BATCH_SIZE = 200
+
+    def __init__(
+        self,
+        client,
+        region: str,
+        min_interval: float = 0.2,
+        max_interval: float = 2.0,
+        backoff: float = 1.25,
+        rate_limiter: Optional[RateLimiter] = None,
+    ):
+        """
+        :param rate_limiter: Every describe call waits on its READ bucket for the region
+
+        """
+        self.client = client
+        self.region = region
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.backoff = backoff
+        self.rate_limiter = rate_limiter
+
+        self.condition = Condition()
+        self.pending: List[PendingWait] = []
+        self.interval = min_interval
+        self.thread: Optional[Thread] = None
+
+    def wait(self, instance_id: str, condition: Callable[[AWSInstanceCodes], bool], timeout: float) -> Future:
+        """
+        :return: Future that resolves to the first InstanceState satisfying `condition`, or
+            raises TimeoutError once `timeout` seconds pass without one
+
+        """
+        now = monotonic()
+        future = Future()
+
+        with self.condition:
+            self.pending.append(
+                PendingWait(
+                    instance_id=instance_id,
+                    condition=condition,
+                    future=future,
+                    deadline=now + timeout,
+                    last_unmet_at=now,
+                )
+            )
+            self.interval = self.min_interval
+
+            if self.thread is None:
+                self.thread = Thread(target=self.do_work, name=f"aws-waiter-{self.region}", daemon=True)
+                self.thread.start()
+            self.condition.notify()
+
+        return future
+
+    def describe(self, instance_ids: List[str]) -> Dict[str, InstanceState]:
+        states = {}
+        for offset in range(0, len(instance_ids), self.BATCH_SIZE):
+            batch = instance_ids[offset:offset + self.BATCH_SIZE]
+
+            if self.rate_limiter is not None:
+                self.rate_limiter.acquire(ApiFamily.READ, self.region)
+
+            sent_at = monotonic()
+            # Filtering by id, unlike `InstanceIds`, doesn't fail the whole call when a freshly
+            # launched instance isn't visible to the API yet
+            paginator = self.client.get_paginator("describe_instances")
+            pages = list(paginator.paginate(Filters=[{"Name": "instance-id", "Values": batch}]))
+            observed_at = (sent_at + monotonic()) / 2
+
+            for page in pages:
+                for reservation in page["Reservations"]:
+                    for instance in reservation["Instances"]:
+                        names = [tag["Value"] for tag in instance.get("Tags", []) if tag["Key"] == "Name"]
+                        states[instance["InstanceId"]] = InstanceState(
+                            instance_id=instance["InstanceId"],
+                            # The high byte of the code is reserved for internal use by AWS
+                            code=AWSInstanceCodes(instance["State"]["Code"] & 0xFF),
+                            name=names[0] if names else None,
+                            state_reason=instance.get("StateReason"),
+                            observed_at=observed_at,
+                            transition_at=observed_at,
+                        )
+        return states
+
+    def do_work(self):
+        while True:
+            with self.condition:
+                # Callers that gave up on a wait cancel its future; stop polling for them
+                self.pending = [wait for wait in self.pending if not wait.future.cancelled()]
+                if not self.pending:
+                    self.thread = None
+                    return
+                waits = list(self.pending)
+
+            try:
+                states = self.describe(list({wait.instance_id for wait in waits}))
+            except Exception:
+                # Throttling and transient API errors are retried on the next tick
+                self.logger.exception(f"Unable to describe instances in `{self.region}`")
+                states = {}
+
+            now = monotonic()
+            with self.condition:
+                for wait in waits:
+                    if not self.resolve(wait, states.get(wait.instance_id), now):
+                        continue
+                    self.pending.remove(wait)
+
+                if not self.pending:
+                    self.thread = None
+                    return
+
+                # Sleep until the next tick, or until a new wait is registered
+                self.condition.wait(self.interval)
+                self.interval = min(self.interval * self.backoff, self.max_interval)
+
+    def resolve(self, wait: PendingWait, state: Optional[InstanceState], now: float) -> bool:
+        """
+        Settle `wait` if `state` satisfies it or its deadline has passed.
+
+        :return: Whether the wait is finished and can be dropped
+
+        """
+        try:
+            met = state is not None and wait.condition(state.code)
+        except Exception as e:
+            self.logger.exception(f"Break condition for `{wait.instance_id}` failed")
+            if wait.future.set_running_or_notify_cancel():
+                wait.future.set_exception(e)
+            return True
+
+        if met:
+            state.transition_at = (wait.last_unmet_at + state.observed_at) / 2
+            # A cancelled future can't take a result; the caller no longer wants it anyway
+            if wait.future.set_running_or_notify_cancel():
+                wait.future.set_result(state)
+            return True
+
+        if now >= wait.deadline:
+            if wait.future.set_running_or_notify_cancel():
+                wait.future.set_exception(
+                    TimeoutError(f"Instance `{wait.instance_id}` did not reach break condition")
+                )
+            return True
+
+        if state is not None:
+            wait.last_unmet_at = state.observed_at
+        return False
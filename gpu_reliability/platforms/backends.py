@@ -0,0 +1,23 @@
+"""
+Platforms by type, imported only once they're selected. Each one pulls in its cloud's SDK,
+which dominates startup time, so commands that don't probe a cloud never import it.
+
+"""
+from importlib import import_module
+from typing import TYPE_CHECKING, Dict, Type
+from gpu_reliability.models import PlatformType
+
+if TYPE_CHECKING:
+    from gpu_reliability.platforms.base import PlatformBase
+
+
+# Module and class name of each platform
+PLATFORM_BACKENDS: Dict[PlatformType, str] = {
+    PlatformType.GCP: "gpu_reliability.platforms.gcp:GCPPlatform",
+    PlatformType.AWS: "gpu_reliability.platforms.aws:AWSPlatform",
+}
+
+
+def load_platform(platform_type: PlatformType) -> Type["PlatformBase"]:
+    module_name, class_name = PLATFORM_BACKENDS[platform_type].split(":")
+    return getattr(import_module(module_name), class_name)
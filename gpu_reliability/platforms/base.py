@@ -1,82 +1,356 @@
 from abc import ABC, abstractmethod
-from threading import Thread
-from time import sleep
+from concurrent.futures import Future, ThreadPoolExecutor
+from threading import Condition, Lock, Thread
+from time import monotonic
 from uuid import uuid4, UUID
 from gpu_reliability.models import PlatformType, LaunchRequest
-from gpu_reliability.stats_logger import StatsLogger, Stat
+from gpu_reliability.stats_logger import CIRCUIT_OPEN_CODE, StatsLogger, Stat, parse_error_code
 from dataclasses import dataclass, field
-from typing import Optional
+from functools import partial
+from typing import Dict, List, Optional, Set
+from gpu_reliability.logging import logger
+from gpu_reliability.platforms.launch_queue import LaunchQueue, LaunchSlots, QueuedLaunch, QUEUE_FULL_CODE
+from gpu_reliability.platforms.journal import InstanceJournal
+from gpu_reliability.platforms.registry import InstanceRegistry
+from gpu_reliability.platforms.spans import LaunchSpans
+from gpu_reliability.metrics import PlatformMetrics
+from gpu_reliability.ratelimit import CircuitBreaker, RateLimiter
+from gpu_reliability.sketch import LatencySketch
 
 
 INSTANCE_TAG = "gpu-reliability-test"
 INSTANCE_TAG_VALUE = "true"
 
 
+class LaunchSkipped(Exception):
+    """
+    Raised by `launch_instance` when the harness couldn't attempt the launch at all, for
+    instance because one of our own lookups failed. These aren't recorded as failed launches
+    since they say nothing about the capacity of the cloud.
+
+    """
+    pass
+
+
+@logger
 class PlatformBase(ABC):
-    def __init__(self, storage: StatsLogger, cleanup_interval=60):
+    # Error codes of launches that failed because the target is out of capacity
+    CAPACITY_ERROR_CODES: Set[str] = set()
+    # Platforms that throttle their own API calls set this once their client is configured
+    rate_limiter: Optional[RateLimiter] = None
+
+    def __init__(
+        self,
+        storage: StatsLogger,
+        cleanup_interval=60,
+        max_concurrent_launches: int = 1,
+        launch_queue: Optional[LaunchQueue] = None,
+        max_launches_per_region: Optional[int] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        full_sweep_interval: int = 6 * 60 * 60,
+        journal: Optional[InstanceJournal] = None,
+        metrics: Optional[PlatformMetrics] = None,
+    ):
         """
         :param cleanup_interval: How often to clean up resources (in seconds) even if we haven't
             actively launched an instance. Used for garbage collection in the case of unrecoverable
             crashes.
+        :param max_concurrent_launches: Launches that may be in flight at once. A launch can take
+            up to the create timeout when capacity is scarce, so with a single slot any trigger
+            during that time has to wait or be dropped.
+        :param launch_queue: Holds launches while every slot is busy and decides which ones are
+            dropped when it can't. Defaults to a short FIFO queue.
+        :param max_launches_per_region: Launches that may be in flight at once in any one region,
+            so a fanned out trigger doesn't exhaust a region's API quota
+        :param circuit_breaker: Pauses launches to targets that keep running out of capacity
+        :param full_sweep_interval: How often cleanup searches the whole account for tagged
+            instances (in seconds). Other cleanups only delete the instances this process launched.
+        :param journal: Records launched instances so they can be torn down after a crash. Ones
+            a previous run left behind are registered for the next cleanup.
+        :param metrics: Shared with the other platforms when they're served together. Defaults
+            to metrics of this platform alone, which are only recorded.
 
         """
         self.thread = None
         self.storage = storage
         self.cleanup_interval = cleanup_interval
+        self.max_concurrent_launches = max_concurrent_launches
+
+        self.launch_executor = ThreadPoolExecutor(
+            max_workers=max_concurrent_launches,
+            thread_name_prefix="launch",
+        )
 
-        self.should_launch: Optional[LaunchRequest] = None
+        # Guards the runloop state below; notified whenever it changes so the worker
+        # wakes up immediately instead of polling
+        self.condition = Condition()
+        self.launch_queue = launch_queue if launch_queue is not None else LaunchQueue()
+        self.launch_slots = LaunchSlots(max_concurrent_launches, max_launches_per_region)
+        self.circuit_breaker = circuit_breaker if circuit_breaker is not None else CircuitBreaker()
+        self.instance_registry = InstanceRegistry(full_sweep_interval, journal, owner=self.platform_type.value)
+        self.finished: List[Future] = []
         self.should_quit = False
 
-    def set_should_launch(self, should_launch: LaunchRequest):
+        # Deletes are batched across launches by cleanup and finish after the launch's stat is
+        # recorded, so their durations are aggregated here instead
+        self.delete_lock = Lock()
+        self.delete_seconds = LatencySketch()
+
+        self.metrics = metrics if metrics is not None else PlatformMetrics()
+        self.metrics.register(self)
+
+    def set_should_launch(self, should_launch: LaunchRequest) -> bool:
+        """
+        Queue a launch of a GPU instance, which the worker thread starts as soon as one of its
+        launch slots is free.
+
+        :return: Whether the launch was accepted. Rejected launches are recorded with the
+            `HarnessQueueFull` error code, so the gap in the samples stays visible without
+            counting against the cloud's availability.
+
+        """
+        with self.condition:
+            accepted, dropped = self.launch_queue.put(should_launch, self.has_capacity(should_launch))
+            self.condition.notify_all()
+
+        if dropped is not None:
+            self.logger.info("Replaced a launch that was still waiting for a slot with a newer one")
+
+        if not accepted:
+            self.reject_launch(should_launch)
+        return accepted
+
+    def region_for(self, geography: str) -> str:
+        """
+        Region that a geography belongs to, which launch slots are limited by.
+
+        """
+        return geography
+
+    def has_capacity(self, request: LaunchRequest) -> bool:
+        """
+        Whether `request` could start right away, behind the launches that are already waiting.
+
         """
-        When called, the worker thread will create a GPU instance on the next
-        possible occasion in its runloop
+        region = self.region_for(request.geography)
+        return self.launch_slots.available(
+            region,
+            queued_total=len(self.launch_queue),
+            queued_in_region=sum(
+                1
+                for queued in self.launch_queue.pending
+                if self.region_for(queued.request.geography) == region
+            ),
+        )
+
+    def can_start(self, request: LaunchRequest) -> bool:
+        return self.launch_slots.available(self.region_for(request.geography))
+
+    def start_next_launch(self) -> Optional[QueuedLaunch]:
         """
-        self.should_launch = should_launch
+        Take the oldest waiting launch that has a free slot, and reserve that slot for it.
+
+        """
+        queued = self.launch_queue.pop(self.can_start)
+        if queued is not None:
+            self.launch_slots.acquire(self.region_for(queued.request.geography))
+            self.logger.info(
+                f"Starting launch in `{queued.request.geography}` after {monotonic() - queued.queued_at:.2f}s "
+                f"in the queue ({len(self.launch_queue)} still waiting)"
+            )
+        return queued
+
+    def reject_launch(self, request: LaunchRequest):
+        self.logger.warning(f"All {self.max_concurrent_launches} launch slots are busy, rejecting launch")
+        self.record(
+            Stat(
+                platform=self.platform_type,
+                request=request,
+                create_success=False,
+                error=f"[Code: {QUEUE_FULL_CODE}]: All {self.max_concurrent_launches} launch slots were busy",
+            )
+        )
 
     def quit(self):
-        self.should_quit = True
+        """
+        Stop starting launches. The worker thread exits once the launches that are already in
+        flight have finished; ones still waiting in the queue are dropped.
+
+        """
+        with self.condition:
+            self.should_quit = True
+            self.condition.notify_all()
+
+    def has_work(self) -> bool:
+        if self.finished:
+            return True
+        if self.should_quit:
+            return not self.launch_slots.total
+        return self.launch_queue.ready(self.can_start)
 
     def do_work(self):
-        until_cleanup = self.cleanup_interval
+        next_cleanup = monotonic() + self.cleanup_interval
 
         while True:
-            if self.should_launch:
-                try:
-                    self.launch_instance(self.should_launch)
-                except Exception as e:
-                    self.storage.write(
-                        Stat(
-                            platform=self.platform_type,
-                            request=self.should_launch,
-                            create_success=False,
-                            error=str(e)
-                        )
-                    )
-                    raise
-                finally:
-                    self.set_should_launch(None)
-                    self.cleanup_resources()
-
-            if self.should_quit:
-                return
+            with self.condition:
+                # Sleep until a launch can start or has finished, we're asked to quit, or the
+                # next cleanup is due
+                while not self.has_work():
+                    remaining = next_cleanup - monotonic()
+                    if remaining <= 0:
+                        break
+                    self.condition.wait(remaining)
+
+                finished, self.finished = self.finished, []
+                should_quit = self.should_quit
+
+                if should_quit:
+                    dropped = self.launch_queue.clear()
+                    if dropped:
+                        self.logger.warning(f"Dropped {dropped} queued launches on shutdown")
+
+                while (queued := self.start_next_launch()) is not None:
+                    future = self.launch_executor.submit(self.run_launch, queued.request)
+                    future.add_done_callback(partial(self.launch_finished, queued.request))
+
+                idle = not self.launch_slots.total
 
-            # This event loop effectively runs every second
-            # This is convenient because it allows us to quickly respond to quit signals
-            # while still ensuring that we have a timer counting for the cleanup
-            sleep(1)
+            if finished:
+                # Instances of launches that are still in flight are left alone, so a backlog
+                # doesn't hold up deleting the ones that have been measured
+                self.cleanup_resources()
+                next_cleanup = monotonic() + self.cleanup_interval
+
+            for future in finished:
+                # Surface crashes on the worker thread, like a launch run inline would
+                error = future.exception()
+                if error is not None:
+                    raise error
 
-            until_cleanup -= 1
-            if until_cleanup <= 0:
-                until_cleanup = self.cleanup_interval
+            if should_quit and idle:
+                return
+
+            if monotonic() >= next_cleanup:
                 self.cleanup_resources()
+                # Keep a fixed cadence rather than drifting by the length of each cleanup,
+                # unless the cleanup overran a whole interval
+                next_cleanup += self.cleanup_interval
+                if next_cleanup <= monotonic():
+                    next_cleanup = monotonic() + self.cleanup_interval
+
+    def run_launch(self, request: LaunchRequest):
+        """
+        Launch an instance and record it if the launch crashes. Called from a launch slot,
+        either by the worker thread or by a `ProbeEngine`.
+
+        """
+        circuit = self.circuit_key(request)
+        if not self.circuit_breaker.allow(circuit):
+            # Recorded so the stretch the target spent out of capacity stays in the samples
+            self.logger.warning(f"Skipped launch: `{circuit}` is out of capacity")
+            self.record(
+                Stat(
+                    platform=self.platform_type,
+                    request=request,
+                    create_success=False,
+                    error=f"[Code: {CIRCUIT_OPEN_CODE}]: `{circuit}` is paused after running out of capacity",
+                )
+            )
+            return
+
+        spans = LaunchSpans()
+        try:
+            self.launch_instance(request, spans)
+        except LaunchSkipped as e:
+            self.logger.warning(f"Skipped launch: {e}")
+            self.metrics.launches.inc(platform=self.platform_type.value, geography=request.geography, outcome="skipped")
+        except Exception as e:
+            self.record(
+                Stat(
+                    platform=self.platform_type,
+                    request=request,
+                    create_success=False,
+                    error=str(e),
+                    phase_seconds=spans.phase_seconds,
+                )
+            )
+            raise
+        finally:
+            self.instance_registry.landed(request.identifier)
+
+    def record(self, stat: Stat):
+        """
+        Persist the outcome of a launch. Platforms record exactly one stat per launch through
+        here so that launches which ran out of capacity trip the target's circuit breaker.
+
+        """
+        self.storage.write(stat)
+
+        circuit = self.circuit_key(stat.request)
+        if stat.create_success:
+            self.circuit_breaker.record_success(circuit)
+            outcome = "success"
+        elif self.is_capacity_error(stat.error):
+            self.circuit_breaker.record_failure(circuit)
+            outcome = "capacity"
+        elif parse_error_code(stat.error) == QUEUE_FULL_CODE:
+            outcome = "rejected"
+        elif parse_error_code(stat.error) == CIRCUIT_OPEN_CODE:
+            outcome = "paused"
+        else:
+            outcome = "failure"
+
+        platform = self.platform_type.value
+        self.metrics.launches.inc(platform=platform, geography=stat.request.geography, outcome=outcome)
+        if stat.create_seconds is not None:
+            self.metrics.create_seconds.observe(stat.create_seconds, platform=platform)
+        for phase, seconds in stat.phase_seconds.items():
+            self.metrics.phase_seconds.observe(seconds, platform=platform, phase=phase)
+
+    def is_capacity_error(self, error: Optional[str]) -> bool:
+        # Matched anywhere in the message, since SDK exceptions aren't formatted as `[Code: X]`
+        return bool(error) and any(code in error for code in self.CAPACITY_ERROR_CODES)
+
+    def circuit_key(self, request: LaunchRequest) -> str:
+        hardware = "/".join(value for value in [request.machine_type, request.accelerator_type] if value)
+        key = f"{request.geography} {hardware}".strip()
+        return f"{key} (spot)" if request.spot else key
+
+    def record_deletes(self, delete_seconds: Dict[str, float]) -> Dict[str, float]:
+        """
+        Fold the seconds that cleanup took to delete each instance into `delete_seconds`.
+
+        :return: The same durations, so cleanups can record and return them in one step
+
+        """
+        with self.delete_lock:
+            self.delete_seconds.add_many(list(delete_seconds.values()))
+        for seconds in delete_seconds.values():
+            self.metrics.delete_seconds.observe(seconds, platform=self.platform_type.value)
+        return delete_seconds
+
+    def record_orphans(self, orphans: List[str]):
+        """
+        :param orphans: Names of tagged instances a sweep found that this process didn't launch
+
+        """
+        self.metrics.orphans.inc(len(orphans), platform=self.platform_type.value)
+
+    def launch_finished(self, request: LaunchRequest, future: Future):
+        with self.condition:
+            self.launch_slots.release(self.region_for(request.geography))
+            self.finished.append(future)
+            self.condition.notify_all()
 
     @abstractmethod
-    def launch_instance(self):
+    def launch_instance(self, request: LaunchRequest, spans: LaunchSpans):
         """
         Launch a new instance of the GPU into the cloud environment. Calling `self.cleanup_resources`
         is not necessary here so long as this is called from within `self.do_work`.
 
+        :param spans: Times the phases of this launch; their durations are included in the
+            launch's stat
+
         """
         pass
 
@@ -89,16 +363,30 @@ class PlatformBase(ABC):
         pass
 
     @abstractmethod
-    def cleanup_resources(self):
+    def cleanup_resources(self, full_sweep: bool = False):
         """
         Responsible for cleaning up any currently used resources. Called periodically:
         - After an exception
         - After a successful run
         - Randomly throughout lifecycle, to ensure we are not being billed for wasted compute
 
+        Routine cleanups only delete the instances in `self.instance_registry`. The first
+        cleanup, and one every `full_sweep_interval`, searches the account for every tagged
+        instance to catch ones that leaked from earlier runs.
+
+        :param full_sweep: Search the account even if a sweep isn't due, like on shutdown
+
         """
         pass
 
+    def close(self):
+        """
+        Release long-lived resources like API clients and thread pools. Called once the
+        platform has quit and its final cleanup has run.
+
+        """
+        self.launch_executor.shutdown(wait=False, cancel_futures=True)
+
     @property
     def is_spawned(self):
         return self.thread is not None and self.thread.is_alive()
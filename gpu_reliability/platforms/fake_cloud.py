@@ -0,0 +1,91 @@
+"""
+Behavior shared by the in-process fake clouds: how long instances take to change state, when
+capacity runs out and when calls get throttled. The fakes plug into the real platforms so the
+harness can be exercised, and its overhead measured, without an account or network access.
+
+"""
+from collections import Counter
+from dataclasses import dataclass
+from math import exp
+from random import Random
+from threading import Lock
+from typing import Dict, FrozenSet, Optional
+from gpu_reliability.ratelimit import RateLimit, TokenBucket
+
+
+@dataclass(frozen=True)
+class LatencyDistribution:
+    # Median seconds
+    median: float
+    # Spread of the lognormal around the median; 0 always takes exactly the median
+    sigma: float = 0.0
+
+    def sample(self, rng: Random) -> float:
+        if not self.sigma:
+            return self.median
+        return self.median * exp(rng.gauss(0, self.sigma))
+
+
+@dataclass(frozen=True)
+class FakeCloudBehavior:
+    create_latency: LatencyDistribution = LatencyDistribution(0.05, 0.5)
+    delete_latency: LatencyDistribution = LatencyDistribution(0.05, 0.5)
+    # Probability that any launch fails for lack of capacity
+    exhaustion_rate: float = 0.0
+    # Geographies where every launch fails for lack of capacity
+    exhausted_geographies: FrozenSet[str] = frozenset()
+    # Calls allowed in each region before they're throttled; None never throttles
+    throttle: Optional[RateLimit] = None
+    seed: Optional[int] = None
+
+
+class Throttled(Exception):
+    pass
+
+
+class FakeCloud:
+    """
+    Decisions and bookkeeping common to every fake API call. Thread-safe, like the clients of
+    the real clouds.
+
+    """
+    def __init__(self, behavior: FakeCloudBehavior):
+        self.behavior = behavior
+
+        self.lock = Lock()
+        self.rng = Random(behavior.seed)
+        self.buckets: Dict[str, TokenBucket] = {}
+        # API calls made by method name, to measure how much traffic the harness generates
+        self.calls: Counter = Counter()
+        self.throttled: Counter = Counter()
+
+    def call(self, method: str, region: str):
+        """
+        Account for an API call, raising Throttled if the region's quota is used up.
+
+        """
+        with self.lock:
+            self.calls[method] += 1
+            throttle = self.behavior.throttle
+            if throttle is None:
+                return
+            bucket = self.buckets.setdefault(region, TokenBucket(throttle.rate, throttle.burst))
+
+        if bucket.try_acquire():
+            with self.lock:
+                self.throttled[method] += 1
+            raise Throttled(f"Rate exceeded for `{method}` in `{region}`")
+
+    def is_exhausted(self, geography: str) -> bool:
+        if geography in self.behavior.exhausted_geographies:
+            return True
+        with self.lock:
+            return self.rng.random() < self.behavior.exhaustion_rate
+
+    def create_latency(self) -> float:
+        with self.lock:
+            return self.behavior.create_latency.sample(self.rng)
+
+    def delete_latency(self) -> float:
+        with self.lock:
+            return self.behavior.delete_latency.sample(self.rng)
@@ -0,0 +1,199 @@
+"""
+In-process stand-in for the EC2 API, passed to `AWSPlatform(session=FakeEC2Session())`. Only
+implements the calls and filters the platform makes.
+
+"""
+from dataclasses import dataclass
+from itertools import count
+from threading import Lock
+from time import monotonic
+from types import SimpleNamespace
+from typing import Dict, List, Optional
+from botocore.exceptions import ClientError
+from gpu_reliability.platforms.aws_waiter import AWSInstanceCodes
+from gpu_reliability.platforms.fake_cloud import FakeCloud, FakeCloudBehavior, Throttled
+
+
+DEFAULT_REGIONS = ["us-east-1", "us-east-2", "us-west-1", "us-west-2", "eu-west-1", "ap-south-1"]
+
+STATE_NAMES = {
+    AWSInstanceCodes.PENDING: "pending",
+    AWSInstanceCodes.RUNNING: "running",
+    AWSInstanceCodes.SHUTTING_DOWN: "shutting-down",
+    AWSInstanceCodes.TERMINATED: "terminated",
+}
+
+
+def client_error(code: str, message: str, operation: str) -> ClientError:
+    return ClientError({"Error": {"Code": code, "Message": message}}, operation)
+
+
+@dataclass
+class FakeEC2Instance:
+    instance_id: str
+    region: str
+    tags: Dict[str, str]
+    # Monotonic times of the state transitions
+    running_at: float
+    terminating_at: Optional[float] = None
+    terminated_at: Optional[float] = None
+
+    def code(self, now: float) -> AWSInstanceCodes:
+        if self.terminated_at is not None and now >= self.terminated_at:
+            return AWSInstanceCodes.TERMINATED
+        if self.terminating_at is not None:
+            return AWSInstanceCodes.SHUTTING_DOWN
+        if now >= self.running_at:
+            return AWSInstanceCodes.RUNNING
+        return AWSInstanceCodes.PENDING
+
+    def describe(self, now: float) -> dict:
+        code = self.code(now)
+        return {
+            "InstanceId": self.instance_id,
+            "State": {"Code": code.value, "Name": STATE_NAMES[code]},
+            "Tags": [{"Key": key, "Value": value} for key, value in self.tags.items()],
+        }
+
+
+class FakeEC2Session:
+    """
+    Plays the part of a boto3 Session. Every client it builds shares the same fake account.
+
+    """
+    def __init__(self, behavior: Optional[FakeCloudBehavior] = None, regions: List[str] = DEFAULT_REGIONS):
+        self.cloud = FakeCloud(behavior or FakeCloudBehavior())
+        self.regions = regions
+
+        self.lock = Lock()
+        self.instances: Dict[str, FakeEC2Instance] = {}
+        # Idempotency tokens of run_instances calls, and the instance each one created
+        self.client_tokens: Dict[str, str] = {}
+        self.ids = count()
+
+    def client(self, service: str, region_name: str) -> "FakeEC2Client":
+        return FakeEC2Client(self, region_name)
+
+    def resource(self, service: str, region_name: str):
+        return SimpleNamespace(meta=SimpleNamespace(client=self.client(service, region_name)))
+
+    def add_instance(self, region: str, tags: Dict[str, str]) -> FakeEC2Instance:
+        """
+        Create a running instance without going through the API, like one leaked by an earlier run.
+
+        """
+        with self.lock:
+            instance = FakeEC2Instance(f"i-{next(self.ids):017x}", region, tags, running_at=monotonic())
+            self.instances[instance.instance_id] = instance
+        return instance
+
+    def live_instances(self) -> List[FakeEC2Instance]:
+        now = monotonic()
+        with self.lock:
+            return [
+                instance
+                for instance in self.instances.values()
+                if instance.code(now) != AWSInstanceCodes.TERMINATED
+            ]
+
+
+@dataclass
+class FakePaginator:
+    client: "FakeEC2Client"
+
+    def paginate(self, Filters: List[dict]):
+        return [self.client.describe_instances(Filters=Filters)]
+
+
+class FakeEC2Client:
+    def __init__(self, session: FakeEC2Session, region: str):
+        self.session = session
+        self.region = region
+
+    def call(self, method: str):
+        try:
+            self.session.cloud.call(method, self.region)
+        except Throttled as e:
+            raise client_error("RequestLimitExceeded", str(e), method) from e
+
+    def describe_regions(self):
+        self.call("describe_regions")
+        return {"Regions": [{"RegionName": region} for region in self.session.regions]}
+
+    def describe_images(self, Owners=None, Filters=None):
+        self.call("describe_images")
+        return {"Images": [{"ImageId": f"ami-{self.region}", "CreationDate": "2023-01-01T00:00:00.000Z"}]}
+
+    def run_instances(self, TagSpecifications=(), ClientToken: Optional[str] = None, **_):
+        self.call("run_instances")
+        session = self.session
+
+        with session.lock:
+            if ClientToken is not None and ClientToken in session.client_tokens:
+                return {"Instances": [{"InstanceId": session.client_tokens[ClientToken]}]}
+
+        if session.cloud.is_exhausted(self.region):
+            raise client_error(
+                "InsufficientInstanceCapacity",
+                "We currently do not have sufficient capacity in the Availability Zone you requested.",
+                "RunInstances",
+            )
+
+        tags = {
+            tag["Key"]: tag["Value"]
+            for specification in TagSpecifications
+            for tag in specification["Tags"]
+        }
+        running_at = monotonic() + session.cloud.create_latency()
+
+        with session.lock:
+            instance = FakeEC2Instance(f"i-{next(session.ids):017x}", self.region, tags, running_at)
+            session.instances[instance.instance_id] = instance
+            if ClientToken is not None:
+                session.client_tokens[ClientToken] = instance.instance_id
+
+        return {"Instances": [{"InstanceId": instance.instance_id}]}
+
+    def get_paginator(self, operation: str) -> FakePaginator:
+        return FakePaginator(self)
+
+    def describe_instances(self, Filters: List[dict]):
+        self.call("describe_instances")
+        now = monotonic()
+
+        def matches(instance: FakeEC2Instance, name: str, values: List[str]) -> bool:
+            if name == "instance-id":
+                return instance.instance_id in values
+            if name == "instance-state-name":
+                return STATE_NAMES[instance.code(now)] in values
+            if name.startswith("tag:"):
+                return instance.tags.get(name[len("tag:"):]) in values
+            raise ValueError(f"Unsupported filter `{name}`")
+
+        with self.session.lock:
+            instances = [
+                instance.describe(now)
+                for instance in self.session.instances.values()
+                if instance.region == self.region
+                and all(matches(instance, flt["Name"], flt["Values"]) for flt in Filters)
+            ]
+        return {"Reservations": [{"Instances": instances}] if instances else []}
+
+    def terminate_instances(self, InstanceIds: List[str]):
+        self.call("terminate_instances")
+        now = monotonic()
+
+        with self.session.lock:
+            instances = [self.session.instances.get(instance_id) for instance_id in InstanceIds]
+            if any(instance is None or instance.region != self.region for instance in instances):
+                raise client_error("InvalidInstanceID.NotFound", "The instance ID does not exist", "TerminateInstances")
+
+            for instance in instances:
+                if instance.terminating_at is None:
+                    instance.terminating_at = now
+                    instance.terminated_at = now + self.session.cloud.delete_latency()
+
+        return {"TerminatingInstances": [{"InstanceId": instance_id} for instance_id in InstanceIds]}
+
+    def close(self):
+        pass
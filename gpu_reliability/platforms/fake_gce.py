@@ -0,0 +1,218 @@
+"""
+In-process stand-in for the Compute Engine API, passed to
+`GCPPlatform(compute_clients=fake_compute_clients())`. Only implements the calls the platform
+makes.
+
+"""
+from dataclasses import dataclass, field
+from itertools import count
+from threading import Lock
+from time import monotonic, sleep
+from types import SimpleNamespace
+from typing import Dict, List, Optional, Tuple
+from google.api_core.exceptions import NotFound, TooManyRequests, from_http_status
+from gpu_reliability.platforms.fake_cloud import FakeCloud, FakeCloudBehavior, Throttled
+from gpu_reliability.platforms.gcp import ComputeClients
+
+
+# Longest a single zone operations `wait` call blocks, like the real API
+MAX_OPERATION_WAIT = 120
+
+
+@dataclass
+class FakeGCEInstance:
+    name: str
+    zone: str
+    labels: Dict[str, str]
+    # Monotonic times of the state transitions
+    running_at: float
+    deleted_at: Optional[float] = None
+
+    def status(self, now: float) -> str:
+        if self.deleted_at is not None:
+            return "STOPPING"
+        return "RUNNING" if now >= self.running_at else "PROVISIONING"
+
+
+@dataclass
+class FakeOperation:
+    """
+    Mirrors the extended operations returned by the client library: `result` keeps calling
+    `_refresh`, which the platform points at the zone operations `wait`, until it's done.
+
+    """
+    name: str
+    done_at: float
+    error_code: str = ""
+    error_message: str = ""
+    warnings: List[SimpleNamespace] = field(default_factory=list)
+
+    def __post_init__(self):
+        self._refresh = lambda **_: sleep(max(self.done_at - monotonic(), 0))
+
+    @property
+    def done(self) -> bool:
+        return monotonic() >= self.done_at
+
+    def result(self, timeout: Optional[float] = None):
+        deadline = None if timeout is None else monotonic() + timeout
+        while not self.done:
+            if deadline is not None and monotonic() >= deadline:
+                raise TimeoutError(f"Operation `{self.name}` did not complete in {timeout}s")
+            self._refresh()
+
+        if self.error_code:
+            # Failed operations raise, as the client library's operations do
+            raise from_http_status(429, f"{self.error_code}: {self.error_message}")
+
+
+class FakeCompute:
+    """
+    Every fake client shares one fake project.
+
+    """
+    def __init__(self, behavior: Optional[FakeCloudBehavior] = None):
+        self.cloud = FakeCloud(behavior or FakeCloudBehavior())
+
+        self.lock = Lock()
+        # (zone, name) -> instance
+        self.instances: Dict[Tuple[str, str], FakeGCEInstance] = {}
+        self.operations: Dict[str, FakeOperation] = {}
+        self.operation_ids = count()
+
+    def call(self, method: str, zone: str):
+        try:
+            # Quotas are per region, and zones are named after their region
+            self.cloud.call(method, zone.rsplit("-", 1)[0])
+        except Throttled as e:
+            raise TooManyRequests(str(e)) from e
+
+    def operation(self, done_at: float, **kwargs) -> FakeOperation:
+        operation = FakeOperation(name=f"operation-{next(self.operation_ids)}", done_at=done_at, **kwargs)
+        with self.lock:
+            self.operations[operation.name] = operation
+        return operation
+
+    def instance(self, zone: str, name: str) -> FakeGCEInstance:
+        """
+        :raises NotFound: If the instance doesn't exist, or has finished deleting
+
+        """
+        now = monotonic()
+        with self.lock:
+            instance = self.instances.get((zone, name))
+            if instance is not None and instance.deleted_at is not None and now >= instance.deleted_at:
+                del self.instances[(zone, name)]
+                instance = None
+        if instance is None:
+            raise NotFound(f"The resource 'projects/fake/zones/{zone}/instances/{name}' was not found")
+        return instance
+
+    def add_instance(self, zone: str, name: str, labels: Dict[str, str]) -> FakeGCEInstance:
+        """
+        Create a running instance without going through the API, like one leaked by an earlier run.
+
+        """
+        instance = FakeGCEInstance(name=name, zone=zone, labels=labels, running_at=monotonic())
+        with self.lock:
+            self.instances[(zone, name)] = instance
+        return instance
+
+    def live_instances(self) -> List[FakeGCEInstance]:
+        now = monotonic()
+        with self.lock:
+            return [
+                instance
+                for instance in self.instances.values()
+                if instance.deleted_at is None or now < instance.deleted_at
+            ]
+
+
+class FakeImagesClient:
+    def __init__(self, compute: FakeCompute):
+        self.compute = compute
+
+    def get_from_family(self, project: str, family: str):
+        self.compute.call("get_from_family", "global")
+        return SimpleNamespace(self_link=f"https://www.googleapis.com/compute/v1/projects/{project}/global/images/{family}-v1")
+
+
+class FakeInstancesClient:
+    def __init__(self, compute: FakeCompute):
+        self.compute = compute
+
+    def insert(self, request):
+        zone = request.zone
+        self.compute.call("insert", zone)
+        resource = request.instance_resource
+
+        now = monotonic()
+        done_at = now + self.compute.cloud.create_latency()
+        if self.compute.cloud.is_exhausted(zone):
+            return self.compute.operation(
+                done_at,
+                error_code="ZONE_RESOURCE_POOL_EXHAUSTED",
+                error_message=f"The zone 'projects/fake/zones/{zone}' does not have enough resources available to fulfill the request.",
+            )
+
+        with self.compute.lock:
+            self.compute.instances[(zone, resource.name)] = FakeGCEInstance(
+                name=resource.name,
+                zone=zone,
+                labels=dict(resource.labels),
+                running_at=done_at,
+            )
+        return self.compute.operation(done_at)
+
+    def get(self, project: str, zone: str, instance: str):
+        self.compute.call("get", zone)
+        found = self.compute.instance(zone, instance)
+        return SimpleNamespace(name=found.name, status=found.status(monotonic()))
+
+    def aggregated_list(self, request):
+        self.compute.call("aggregated_list", "global")
+        # Only the `labels.KEY=VALUE` filters the platform uses are supported
+        key, value = request.filter[len("labels."):].split("=", 1)
+
+        now = monotonic()
+        by_zone: Dict[str, List[SimpleNamespace]] = {}
+        for instance in self.compute.live_instances():
+            if instance.labels.get(key) == value:
+                by_zone.setdefault(instance.zone, []).append(
+                    SimpleNamespace(name=instance.name, status=instance.status(now))
+                )
+
+        return [
+            (f"zones/{zone}", SimpleNamespace(warning=None, instances=instances))
+            for zone, instances in by_zone.items()
+        ]
+
+    def delete(self, project: str, zone: str, instance: str):
+        self.compute.call("delete", zone)
+        found = self.compute.instance(zone, instance)
+
+        with self.compute.lock:
+            if found.deleted_at is None:
+                found.deleted_at = monotonic() + self.compute.cloud.delete_latency()
+        return self.compute.operation(found.deleted_at)
+
+
+class FakeZoneOperationsClient:
+    def __init__(self, compute: FakeCompute):
+        self.compute = compute
+
+    def wait(self, operation: str, zone: str, project: str, **_):
+        self.compute.call("wait", zone)
+        with self.compute.lock:
+            found = self.compute.operations[operation]
+        sleep(min(max(found.done_at - monotonic(), 0), MAX_OPERATION_WAIT))
+        return found
+
+
+def fake_compute_clients(behavior: Optional[FakeCloudBehavior] = None) -> ComputeClients:
+    compute = FakeCompute(behavior)
+    return ComputeClients(
+        images=FakeImagesClient(compute),
+        instances=FakeInstancesClient(compute),
+        zone_operations=FakeZoneOperationsClient(compute),
+    )
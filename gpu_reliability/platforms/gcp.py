@@ -1,17 +1,52 @@
 from google.cloud import compute_v1
-from time import time
-from functools import partial
-from gpu_reliability.platforms.base import PlatformType, PlatformBase, LaunchRequest, INSTANCE_TAG, INSTANCE_TAG_VALUE
+from time import monotonic
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Any, Dict, List, Optional, Tuple
+from gpu_reliability.platforms.base import PlatformType, PlatformBase, LaunchRequest, LaunchSkipped, INSTANCE_TAG, INSTANCE_TAG_VALUE
+from gpu_reliability.platforms.launch_queue import LaunchQueue
+from gpu_reliability.platforms.journal import InstanceJournal
+from gpu_reliability.metrics import PlatformMetrics
+from gpu_reliability.platforms.spans import LaunchSpans
+from gpu_reliability.models import LaunchPhase
+from gpu_reliability.cache import ExpiringCache
+from gpu_reliability.ratelimit import ApiFamily, CircuitBreaker, RateLimit, RateLimiter, GLOBAL_REGION
 from google.oauth2.service_account import Credentials
 from gpu_reliability.stats_logger import StatsLogger, Stat
-from google.api_core.exceptions import NotFound
+from google.api_core.exceptions import GoogleAPICallError, NotFound
 from json import loads
 from gpu_reliability.logging import logger
 from uuid import uuid1
 
 
+@dataclass
+class ComputeClients:
+    images: Any
+    instances: Any
+    zone_operations: Any
+
+    @classmethod
+    def from_service_account(cls, service_account: str) -> "ComputeClients":
+        credentials = Credentials.from_service_account_info(loads(service_account))
+        return cls(
+            images=compute_v1.ImagesClient(credentials=credentials),
+            instances=compute_v1.InstancesClient(credentials=credentials),
+            zone_operations=compute_v1.ZoneOperationsClient(credentials=credentials),
+        )
+
+
 @logger
 class GCPPlatform(PlatformBase):
+    # Also covers ZONE_RESOURCE_POOL_EXHAUSTED_WITH_DETAILS
+    CAPACITY_ERROR_CODES = {"ZONE_RESOURCE_POOL_EXHAUSTED"}
+    # Compute Engine rate quotas apply to the whole project, so every call also shares a
+    # project-wide bucket
+    API_LIMITS = {
+        ApiFamily.READ: RateLimit(rate=10, burst=50),
+        ApiFamily.MUTATE: RateLimit(rate=2, burst=20),
+    }
+    PROJECT_API_LIMIT = RateLimit(rate=20, burst=100)
+
     def __init__(
         self,
         project_id: str,
@@ -21,43 +56,107 @@ class GCPPlatform(PlatformBase):
         storage: StatsLogger,
         create_timeout: int = 200,
         delete_timeout: int = 300,
+        image_ttl: int = 24 * 60 * 60,
+        image_refresh_after: int = 60 * 60,
+        cleanup_concurrency: int = 8,
+        max_concurrent_launches: int = 1,
+        launch_queue: Optional[LaunchQueue] = None,
+        max_launches_per_region: Optional[int] = None,
+        circuit_breaker: Optional[CircuitBreaker] = None,
+        rate_limiter: Optional[RateLimiter] = None,
+        full_sweep_interval: int = 6 * 60 * 60,
+        journal: Optional[InstanceJournal] = None,
+        metrics: Optional[PlatformMetrics] = None,
+        compute_clients: Optional[ComputeClients] = None,
     ):
         """
         :param service_account_path: Path to the service account JSON file
-        :param machine_type: For custom types, format as: `custom-CPUS-MEMORY` populating CPU and MEMORY counts
+        :param machine_type: For custom types, format as: `custom-CPUS-MEMORY` populating CPU and MEMORY counts.
+            Used for launches that don't request a machine type of their own.
         :param accelerator_type: To view the accelerators available in the given zone:
             `gcloud compute accelerator-types list --filter="zone:( us-central1-b us-east-a )"`
+        :param image_ttl: Seconds a resolved boot image may be used before it must be looked up again
+        :param image_refresh_after: Seconds after which a resolved boot image is refreshed in the background
+        :param cleanup_concurrency: Number of instances that are deleted at once during cleanup
+        :param max_concurrent_launches: Launches that may be in flight at once
+        :param launch_queue: Holds launches while every slot is busy
+        :param max_launches_per_region: Launches that may be in flight at once in any one region
+        :param circuit_breaker: Pauses launches to targets that keep running out of capacity
+        :param rate_limiter: Shared by every call this platform makes to the Compute Engine API
+        :param full_sweep_interval: How often cleanup lists every zone for labeled instances
+        :param journal: Records launched instances so they can be torn down after a crash
+        :param metrics: Shared by every platform that's served on the same metrics endpoint
+        :param compute_clients: Used instead of clients authenticated with `service_account`,
+            like the in-process fakes of `fake_gce`
 
         """
-        super().__init__(storage=storage)
+        super().__init__(
+            storage=storage,
+            max_concurrent_launches=max_concurrent_launches,
+            launch_queue=launch_queue,
+            max_launches_per_region=max_launches_per_region,
+            circuit_breaker=circuit_breaker,
+            full_sweep_interval=full_sweep_interval,
+            journal=journal,
+            metrics=metrics,
+        )
         self.project_id = project_id
+        self.rate_limiter = rate_limiter if rate_limiter is not None else RateLimiter(
+            self.API_LIMITS,
+            total=self.PROJECT_API_LIMIT,
+        )
         self.machine_type = machine_type
         self.accelerator_type = accelerator_type
 
         self.create_timeout = create_timeout
         self.delete_timeout = delete_timeout
 
-        credentials = Credentials.from_service_account_info(loads(service_account))
-        self.image_client = compute_v1.ImagesClient(credentials=credentials)
-        self.instance_client = compute_v1.InstancesClient(credentials=credentials)
-        self.zone_operations_client = compute_v1.ZoneOperationsClient(credentials=credentials)
+        if compute_clients is None:
+            compute_clients = ComputeClients.from_service_account(service_account)
+        self.image_client = compute_clients.images
+        self.instance_client = compute_clients.instances
+        self.zone_operations_client = compute_clients.zone_operations
+
+        self.cleanup_executor = ThreadPoolExecutor(
+            max_workers=cleanup_concurrency,
+            thread_name_prefix="gcp-cleanup",
+        )
+
+        # Images in a family change rarely, so a stale image is preferable to a failed launch
+        self.image_cache = ExpiringCache(
+            lambda key: self.fetch_image(*key),
+            ttl=image_ttl,
+            refresh_after=image_refresh_after,
+        )
 
     @property
     def platform_type(self) -> PlatformType:
         return PlatformType.GCP
 
-    def launch_instance(self, request: LaunchRequest):
+    def region_for(self, geography: str) -> str:
+        # Zones are named after their region, like `us-central1-b`
+        return geography.rsplit("-", 1)[0]
+
+    def launch_instance(self, request: LaunchRequest, spans: LaunchSpans):
+        machine_type = request.machine_type or self.machine_type
+        accelerator_type = request.accelerator_type or self.accelerator_type
+
         uuid = str(uuid1())
         instance_name = f"gpu-test-{uuid}"
 
+        try:
+            with spans.span(LaunchPhase.IMAGE_LOOKUP):
+                image = self.get_image()
+        except Exception as e:
+            raise LaunchSkipped(f"Unable to resolve boot image: {e}") from e
 
         instance = compute_v1.Instance(
             name=instance_name,
-            machine_type=f"zones/{request.geography}/machineTypes/{self.machine_type}",
+            machine_type=f"zones/{request.geography}/machineTypes/{machine_type}",
             guest_accelerators=[
                 compute_v1.AcceleratorConfig(
                     accelerator_count=1,
-                    accelerator_type=f"/zones/{request.geography}/acceleratorTypes/{self.accelerator_type}",
+                    accelerator_type=f"/zones/{request.geography}/acceleratorTypes/{accelerator_type}",
                 )
             ],
             labels={
@@ -70,7 +169,7 @@ class GCPPlatform(PlatformBase):
                 auto_delete=True,
                 boot=True,
                 initialize_params=compute_v1.AttachedDiskInitializeParams(
-                    source_image=self.get_image().self_link,
+                    source_image=image.self_link,
                     disk_size_gb=10,
                     disk_type=f"/projects/{self.project_id}/zones/{request.geography}/diskTypes/pd-ssd"
                 )
@@ -107,33 +206,64 @@ class GCPPlatform(PlatformBase):
         # Wait for the create operation to complete.
         self.logger.info(f"Creating instance `{instance_name}`...")
 
-        start = time()
-        operation = self.instance_client.insert(request=create_request)
-        # Until the GCE Client Library is fixed, replace the "get" method with "wait", which is a hanging call that returns
-        # when the operation is complete.
-        # Original call site: https://github.com/googleapis/python-api-core/blob/9abc6f48f23c87b9771dca3c96b4f6af39620a50/google/api_core/extended_operation.py#L142
-        wait_func = partial(self.zone_operations_client.wait, operation=operation.name, zone=request.geography, project=self.project_id)
-        operation._refresh = wait_func
-        operation.result(timeout=self.create_timeout)
-        create_time = time() - start
+        # Registered before the insert so the instance is cleaned up even if we crash waiting
+        # on it. Inserts that never created one are dropped when their delete finds nothing.
+        self.instance_registry.add(instance_name, request.geography, launch=request.identifier)
+
+        with spans.span(LaunchPhase.THROTTLE):
+            self.rate_limiter.acquire(ApiFamily.MUTATE, self.region_for(request.geography))
 
-        self.log_operation_status(operation)
+        start = monotonic()
+        with spans.span(LaunchPhase.SUBMIT):
+            operation = self.instance_client.insert(request=create_request)
+        try:
+            with spans.span(LaunchPhase.PROVISIONING):
+                self.wait_for_operation(operation, request.geography, self.create_timeout)
+        except GoogleAPICallError as e:
+            # Failed operations raise once they're done, like ones that ran out of capacity
+            error, warnings = self.operation_status(operation)
+            self.record(
+                Stat(
+                    platform=self.platform_type,
+                    request=request,
+                    create_success=False,
+                    error=error or str(e),
+                    warnings=warnings,
+                    phase_seconds=spans.phase_seconds,
+                )
+            )
+            return
+        create_time = monotonic() - start
 
         self.logger.info(f"Finished creating instance `{instance_name}`")
-        created_instance = self.instance_client.get(project=self.project_id, zone=request.geography, instance=instance_name)
+        with spans.span(LaunchPhase.THROTTLE):
+            self.rate_limiter.acquire(ApiFamily.READ, self.region_for(request.geography))
+        with spans.span(LaunchPhase.STATUS):
+            created_instance = self.instance_client.get(project=self.project_id, zone=request.geography, instance=instance_name)
+        self.instance_registry.update(instance_name, created_instance.status)
 
-        # Check status
-        self.storage.write(
+        # The operation's warnings and the instance's final status make up a single stat
+        error, warnings = self.operation_status(operation)
+        if error is None and created_instance.status != "RUNNING":
+            error = created_instance.status
+
+        self.record(
             Stat(
                 platform=self.platform_type,
-                request=self.should_launch,
-                create_success=created_instance.status == "RUNNING",
+                request=request,
+                create_success=error is None,
                 create_seconds=create_time,
-                error=created_instance.status if created_instance.status != "RUNNING" else None,
+                error=error,
+                warnings=warnings,
+                phase_seconds=spans.phase_seconds,
             )
         )
 
-    def log_operation_status(self, operation):
+    def operation_status(self, operation) -> Tuple[Optional[str], List[str]]:
+        """
+        :return: The operation's error, if it failed, and its warnings
+
+        """
         error = None
         warnings = []
 
@@ -146,24 +276,51 @@ class GCPPlatform(PlatformBase):
                     f"[Code: {warning.code}]: {warning.message}"
                 )
 
-        self.storage.write(
-            Stat(
-                platform=self.platform_type,
-                request=self.should_launch,
-                create_success=error is None,
-                error=error,
-                warnings=warnings,
-            )
-        )
+        return error, warnings
+
+    def fetch_image(self, project: str, family: str) -> compute_v1.Image:
+        self.rate_limiter.acquire(ApiFamily.READ, GLOBAL_REGION)
+        return self.image_client.get_from_family(project=project, family=family)
 
-    def get_image(self) -> compute_v1.Image:
+    def get_image(self, project: str = "debian-cloud", family: str = "debian-11") -> compute_v1.Image:
         # List of public operating system (OS) images: https://cloud.google.com/compute/docs/images/os-details
-        newest_image = self.image_client.get_from_family(project="debian-cloud", family="debian-11")
-        return newest_image
+        return self.image_cache.get((project, family))
+
+    def wait_for_operation(self, operation, zone: str, timeout: int):
+        # Until the GCE Client Library is fixed, replace the "get" method with "wait", which is a hanging call that returns
+        # when the operation is complete.
+        # Original call site: https://github.com/googleapis/python-api-core/blob/9abc6f48f23c87b9771dca3c96b4f6af39620a50/google/api_core/extended_operation.py#L142
+        def wait_func(**kwargs):
+            # Called again whenever a wait returns before the operation is done
+            self.rate_limiter.acquire(ApiFamily.READ, self.region_for(zone))
+            return self.zone_operations_client.wait(operation=operation.name, zone=zone, project=self.project_id, **kwargs)
+
+        operation._refresh = wait_func
+        return operation.result(timeout=timeout)
+
+    def cleanup_resources(self, full_sweep: bool = False) -> Dict[str, float]:
+        """
+        :return: Seconds each leftover instance took to delete
+
+        """
+        if full_sweep or self.instance_registry.sweep_due():
+            return self.sweep_resources()
+
+        instances = [(instance.geography, instance.name) for instance in self.instance_registry.settled()]
+        return self.delete_instances(instances)
+
+    def sweep_resources(self) -> Dict[str, float]:
+        """
+        List every zone for labeled instances that are still running and delete them.
+
+        :return: Seconds each leftover instance took to delete
+
+        """
+        start = monotonic()
 
-    def cleanup_resources(self):
         # Search through all zones in case we have modified the request.geography paramter
         # and still have remaining instances in other zones.
+        self.rate_limiter.acquire(ApiFamily.READ, GLOBAL_REGION)
         active_instances = self.instance_client.aggregated_list(
             request=compute_v1.AggregatedListInstancesRequest(
                 filter=f"labels.{INSTANCE_TAG}={INSTANCE_TAG_VALUE}",
@@ -171,6 +328,7 @@ class GCPPlatform(PlatformBase):
             ),
         )
 
+        instances = []
         for zone_path, results in active_instances:
             zone = zone_path.split("/")[-1]
             if results.warning:
@@ -180,11 +338,64 @@ class GCPPlatform(PlatformBase):
                 # boxes that are still trying to bootstrap and/or have already started terminating.
                 if instance.status != "RUNNING":
                     continue
-                self.logger.info(f"Deleting `{instance.name}`...")
-                operation = self.instance_client.delete(project=self.project_id, zone=zone, instance=instance.name)
-                try:
-                    operation.result(timeout=self.delete_timeout)
-                except NotFound:
-                    # Expected error because once instances are deleted the API can't retrieve them
-                    pass
-                self.logger.info(f"Finished deleting `{instance.name}`")
+                # Launches still in flight clean up their instances once they finish
+                if self.instance_registry.in_flight(instance.name):
+                    continue
+                instances.append((zone, instance.name))
+
+        orphans = [name for _, name in instances if name not in self.instance_registry]
+        if orphans:
+            self.logger.warning(f"Found {len(orphans)} instances that this process didn't launch")
+            self.record_orphans(orphans)
+
+        self.instance_registry.swept()
+        delete_seconds = self.delete_instances(instances)
+        self.metrics.sweep_seconds.observe(monotonic() - start, platform=self.platform_type.value)
+        return delete_seconds
+
+    def delete_instances(self, instances: List[Tuple[str, str]]) -> Dict[str, float]:
+        """
+        Delete instances concurrently across zones, waiting on their operations in parallel.
+
+        :param instances: (zone, instance name) of each instance to delete
+        :return: Seconds each instance took to delete, for the deletions that succeeded. These
+            are no longer tracked by the instance registry.
+
+        """
+        futures = {
+            self.cleanup_executor.submit(self.delete_instance, zone, instance_name): instance_name
+            for zone, instance_name in instances
+        }
+
+        delete_seconds = {}
+        for future in as_completed(futures):
+            instance_name = futures[future]
+            try:
+                delete_seconds[instance_name] = future.result()
+            except Exception:
+                # Left registered so the next cleanup tries again
+                self.logger.exception(f"Unable to delete `{instance_name}`")
+                continue
+            self.instance_registry.remove(instance_name)
+        return self.record_deletes(delete_seconds)
+
+    def delete_instance(self, zone: str, instance_name: str) -> float:
+        self.logger.info(f"Deleting `{instance_name}`...")
+
+        start = monotonic()
+        self.rate_limiter.acquire(ApiFamily.MUTATE, self.region_for(zone))
+        try:
+            operation = self.instance_client.delete(project=self.project_id, zone=zone, instance=instance_name)
+            self.wait_for_operation(operation, zone, self.delete_timeout)
+        except NotFound:
+            # Expected error because once instances are deleted the API can't retrieve them. Also
+            # raised by the delete itself for launches whose insert never created an instance.
+            pass
+        delete_time = monotonic() - start
+
+        self.logger.info(f"Finished deleting `{instance_name}` in {delete_time:.1f}s")
+        return delete_time
+
+    def close(self):
+        super().close()
+        self.cleanup_executor.shutdown(wait=False, cancel_futures=True)
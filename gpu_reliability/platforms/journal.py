@@ -0,0 +1,163 @@
+"""
+Append-only journal of the instances we launched, so a process that restarts after a crash
+can tear down exactly what its predecessor left behind instead of searching every region.
+
+"""
+from dataclasses import dataclass
+from enum import Enum, unique
+from json import dumps, loads
+from os import replace
+from pathlib import Path
+from threading import Lock
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from gpu_reliability.logging import logger
+
+
+@unique
+class JournalEvent(Enum):
+    # An instance is about to be launched, or the cloud returned its id
+    LAUNCHED = "LAUNCHED"
+    # Instances were deleted, or found not to exist
+    DELETED = "DELETED"
+
+
+@dataclass
+class JournalEntry:
+    name: str
+    geography: str
+    instance_id: Optional[str] = None
+
+
+@logger
+class InstanceJournal:
+    """
+    Launches are journaled before the launch call is made, so an instance is never created
+    without a record of it. Deletions are appended as they happen and the file is compacted
+    down to the live instances once it's mostly dead entries.
+
+    Thread-safe, since every platform shares one journal.
+
+    """
+    def __init__(self, path: Union[str, Path], compact_after: int = 1000):
+        """
+        :param compact_after: Appended entries before the journal is considered for compaction
+
+        """
+        self.path = Path(path)
+        self.compact_after = compact_after
+
+        self.lock = Lock()
+        # (platform, instance name) -> entry
+        self.live: Dict[Tuple[str, str], JournalEntry] = {}
+        self.appended = 0
+
+        self.existed = self.path.exists()
+        if self.existed:
+            self.load()
+            self.logger.info(f"Recovered {len(self.live)} instances from `{self.path}`")
+
+        # Also truncates any partial line left by a crash mid-write
+        self.file = None
+        self.compact()
+
+    def load(self):
+        with open(self.path) as file:
+            for line in file:
+                try:
+                    payload = loads(line)
+                except ValueError:
+                    self.logger.warning(f"Skipping unreadable journal line: {line!r}")
+                    continue
+                self.apply(payload)
+
+    def apply(self, payload: dict):
+        event = JournalEvent(payload["event"])
+        if event == JournalEvent.LAUNCHED:
+            self.live[(payload["platform"], payload["name"])] = JournalEntry(
+                name=payload["name"],
+                geography=payload["geography"],
+                instance_id=payload.get("instance_id"),
+            )
+        else:
+            for name in payload["names"]:
+                self.live.pop((payload["platform"], name), None)
+
+    def recovered(self, platform: str) -> List[JournalEntry]:
+        """
+        Instances of `platform` that were launched and never deleted.
+
+        """
+        with self.lock:
+            return [entry for (owner, _), entry in self.live.items() if owner == platform]
+
+    def launched(self, platform: str, instance):
+        """
+        :param instance: Anything with the fields of a JournalEntry
+
+        """
+        self.append(launched_payload(platform, instance))
+
+    def deleted(self, platform: str, names: Iterable[str]):
+        self.append(
+            {
+                "event": JournalEvent.DELETED.value,
+                "platform": platform,
+                "names": list(names),
+            }
+        )
+
+    def append(self, payload: dict):
+        with self.lock:
+            if self.file is None:
+                return
+            self.apply(payload)
+            self.file.write(dumps(payload) + "\n")
+            # Surviving a crash of the process is enough, so flushing to the OS will do
+            self.file.flush()
+            self.appended += 1
+
+            if self.appended >= self.compact_after and self.appended > 2 * len(self.live):
+                self.rewrite()
+
+    def compact(self):
+        with self.lock:
+            self.rewrite()
+
+    def rewrite(self):
+        if self.file is not None:
+            self.file.close()
+
+        # Write then rename so a crash mid-compaction leaves the old journal intact
+        temporary_path = self.path.with_name(self.path.name + ".tmp")
+        with open(temporary_path, "w") as file:
+            for (platform, _), entry in self.live.items():
+                file.write(dumps(launched_payload(platform, entry)) + "\n")
+        replace(temporary_path, self.path)
+
+        self.file = open(self.path, "a")
+        self.appended = len(self.live)
+
+    def close(self):
+        with self.lock:
+            if self.file is not None:
+                self.file.close()
+                self.file = None
+
+
+def launched_payload(platform: str, instance) -> dict:
+    return {
+        "event": JournalEvent.LAUNCHED.value,
+        "platform": platform,
+        "name": instance.name,
+        "geography": instance.geography,
+        "instance_id": instance.instance_id,
+    }
+
+
+def journal_path(stats_path: Union[str, Path]) -> Path:
+    """
+    Default location of the instance journal for a given stats output.
+
+    """
+    stats_path = Path(stats_path)
+    return stats_path.with_name(stats_path.name + ".instances.jsonl")
@@ -0,0 +1,159 @@
+from collections import Counter, deque
+from dataclasses import dataclass, field
+from enum import Enum
+from time import monotonic
+from typing import Callable, Deque, Optional, Tuple
+from gpu_reliability.models import LaunchRequest
+from gpu_reliability.sketch import LatencySketch
+from gpu_reliability.stats_logger import QUEUE_FULL_CODE
+
+
+class DropPolicy(Enum):
+    # Keep only the newest waiting request for each target; older ones are replaced without a record
+    COALESCE = "COALESCE"
+    # Wait in FIFO order for a free launch slot, rejecting once the queue is full
+    QUEUE = "QUEUE"
+    # Never wait: reject whenever every launch slot is busy
+    REJECT = "REJECT"
+
+
+def launch_target(request: LaunchRequest) -> tuple:
+    """
+    Requests for the same target probe the same capacity, so coalescing one into the other
+    loses nothing.
+
+    """
+    return (request.geography, request.machine_type, request.accelerator_type, request.spot)
+
+
+@dataclass
+class QueuedLaunch:
+    request: LaunchRequest
+    # Monotonic time the launch was requested
+    queued_at: float = field(default_factory=monotonic)
+
+
+@dataclass
+class LaunchQueueMetrics:
+    submitted: int = 0
+    started: int = 0
+    coalesced: int = 0
+    rejected: int = 0
+    max_depth: int = 0
+    # Seconds between a launch being requested and it starting
+    wait_seconds: LatencySketch = field(default_factory=LatencySketch)
+
+
+class LaunchQueue:
+    """
+    Launch requests that are waiting for one of a platform's launch slots. Not thread-safe
+    on its own: the owning platform calls it while holding its runloop condition.
+
+    """
+    def __init__(self, policy: DropPolicy = DropPolicy.QUEUE, max_size: int = 4):
+        """
+        :param max_size: Requests that may wait at once under the QUEUE policy
+
+        """
+        self.policy = policy
+        self.max_size = max_size
+
+        self.pending: Deque[QueuedLaunch] = deque()
+        self.metrics = LaunchQueueMetrics()
+
+    def __len__(self):
+        return len(self.pending)
+
+    @property
+    def depth(self) -> int:
+        return len(self.pending)
+
+    def put(self, request: LaunchRequest, has_capacity: bool) -> Tuple[bool, Optional[LaunchRequest]]:
+        """
+        :param has_capacity: Whether a launch slot is free to start this request right away
+        :return: Whether the request was accepted, and the request that was dropped to make
+            room for it under the COALESCE policy
+
+        """
+        self.metrics.submitted += 1
+
+        dropped = None
+        if self.policy == DropPolicy.COALESCE:
+            target = launch_target(request)
+            for queued in self.pending:
+                if launch_target(queued.request) == target:
+                    self.pending.remove(queued)
+                    dropped = queued.request
+                    self.metrics.coalesced += 1
+                    break
+        elif self.policy == DropPolicy.REJECT:
+            if not has_capacity:
+                self.metrics.rejected += 1
+                return False, None
+        elif len(self.pending) >= self.max_size:
+            self.metrics.rejected += 1
+            return False, None
+
+        self.pending.append(QueuedLaunch(request))
+        self.metrics.max_depth = max(self.metrics.max_depth, len(self.pending))
+        return True, dropped
+
+    def ready(self, eligible: Callable[[LaunchRequest], bool]) -> bool:
+        return any(eligible(queued.request) for queued in self.pending)
+
+    def pop(self, eligible: Optional[Callable[[LaunchRequest], bool]] = None) -> Optional[QueuedLaunch]:
+        """
+        :param eligible: Only pop the oldest request that passes this check, like one whose
+            region has a free launch slot
+        :return: None if no waiting request is eligible
+
+        """
+        for queued in self.pending:
+            if eligible is None or eligible(queued.request):
+                break
+        else:
+            return None
+
+        self.pending.remove(queued)
+        self.metrics.started += 1
+        self.metrics.wait_seconds.add(monotonic() - queued.queued_at)
+        return queued
+
+    def clear(self) -> int:
+        dropped = len(self.pending)
+        self.pending.clear()
+        return dropped
+
+
+class LaunchSlots:
+    """
+    Launches in flight on a platform, in total and by region. Like LaunchQueue, callers
+    synchronize access themselves.
+
+    """
+    def __init__(self, max_total: int, max_per_region: Optional[int] = None):
+        self.max_total = max_total
+        self.max_per_region = max_per_region
+
+        self.total = 0
+        self.by_region: Counter = Counter()
+
+    def available(self, region: str, queued_total: int = 0, queued_in_region: int = 0) -> bool:
+        """
+        :param queued_total: Launches that will take a slot before this one
+        :param queued_in_region: Launches in the same region that will take a slot before this one
+
+        """
+        if self.total + queued_total >= self.max_total:
+            return False
+        return self.max_per_region is None or self.by_region[region] + queued_in_region < self.max_per_region
+
+    def acquire(self, region: str):
+        self.total += 1
+        self.by_region[region] += 1
+
+    def release(self, region: str):
+        self.total -= 1
+        self.by_region[region] -= 1
+        if not self.by_region[region]:
+            del self.by_region[region]
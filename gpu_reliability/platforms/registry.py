@@ -0,0 +1,145 @@
+from dataclasses import dataclass, field
+from threading import Lock
+from time import monotonic
+from typing import Dict, List, Optional
+from uuid import UUID
+from gpu_reliability.platforms.journal import InstanceJournal
+
+
+@dataclass
+class TrackedInstance:
+    # Unique name we gave the instance, known before the launch call is made
+    name: str
+    geography: str
+    # Id the cloud assigned, on clouds that address instances by one. None until the launch
+    # call returns it.
+    instance_id: Optional[str] = None
+    # Last state we observed, in the platform's own vocabulary. None until the launch reports one.
+    state: Optional[str] = None
+    # Monotonic time the state was last observed
+    updated_at: float = field(default_factory=monotonic)
+    # Identifier of the launch request that's still creating this instance. Cleanup leaves
+    # these alone until the launch has recorded its outcome.
+    launch: Optional[UUID] = None
+
+
+class InstanceRegistry:
+    """
+    Instances this process launched and hasn't deleted yet, so routine cleanup can address
+    them directly instead of searching the whole account. Searching is still needed as a
+    safety net for instances leaked by crashed runs, but only every `sweep_interval` seconds.
+
+    Thread-safe, since launches register their instances from the launch slots.
+
+    """
+    def __init__(self, sweep_interval: float, journal: Optional[InstanceJournal] = None, owner: str = ""):
+        """
+        :param journal: Persists launches and deletions so a restarted process can recover the
+            instances this one leaves behind. Instances journaled by a previous run are
+            registered right away.
+        :param owner: Platform the instances belong to, since platforms share a journal
+
+        """
+        self.sweep_interval = sweep_interval
+        self.journal = journal
+        self.owner = owner
+
+        self.lock = Lock()
+        self.instances: Dict[str, TrackedInstance] = {}
+        # Monotonic time of the last full sweep, None until the first one
+        self.last_sweep: Optional[float] = None
+
+        if journal is not None:
+            self.instances = {
+                entry.name: TrackedInstance(entry.name, entry.geography, entry.instance_id)
+                for entry in journal.recovered(owner)
+            }
+            # The startup sweep still runs: a crash between a launch call and its journal entry
+            # leaves instances that only a search can find
+
+    def __len__(self):
+        return len(self.instances)
+
+    def __contains__(self, name: str):
+        return name in self.instances
+
+    def add(
+        self,
+        name: str,
+        geography: str,
+        instance_id: Optional[str] = None,
+        state: Optional[str] = None,
+        launch: Optional[UUID] = None,
+    ):
+        """
+        :param launch: Identifier of the in-flight launch creating this instance, until `landed`
+
+        """
+        instance = TrackedInstance(name, geography, instance_id, state, launch=launch)
+        with self.lock:
+            self.instances[name] = instance
+        if self.journal is not None:
+            self.journal.launched(self.owner, instance)
+
+    def resolve(self, name: str, instance_id: str, state: Optional[str] = None):
+        """
+        Attach the id the cloud assigned once the launch call returns.
+
+        """
+        with self.lock:
+            instance = self.instances.get(name)
+            if instance is None:
+                return
+            instance.instance_id = instance_id
+            if state is not None:
+                instance.state = state
+                instance.updated_at = monotonic()
+        if self.journal is not None:
+            self.journal.launched(self.owner, instance)
+
+    def update(self, name: str, state: str):
+        with self.lock:
+            instance = self.instances.get(name)
+            if instance is not None:
+                instance.state = state
+                instance.updated_at = monotonic()
+
+    def remove(self, *names: str):
+        with self.lock:
+            removed = [name for name in names if self.instances.pop(name, None) is not None]
+        if self.journal is not None and removed:
+            self.journal.deleted(self.owner, removed)
+
+    def landed(self, launch: UUID):
+        """
+        Hand the instances of a finished launch over to cleanup, whatever its outcome.
+
+        """
+        with self.lock:
+            for instance in self.instances.values():
+                if instance.launch == launch:
+                    instance.launch = None
+
+    def in_flight(self, name: str) -> bool:
+        with self.lock:
+            instance = self.instances.get(name)
+            return instance is not None and instance.launch is not None
+
+    def snapshot(self) -> List[TrackedInstance]:
+        with self.lock:
+            return list(self.instances.values())
+
+    def settled(self) -> List[TrackedInstance]:
+        """
+        Instances whose launches have finished, which cleanup can delete without cutting short
+        a launch that's still being measured.
+
+        """
+        with self.lock:
+            return [instance for instance in self.instances.values() if instance.launch is None]
+
+    def sweep_due(self) -> bool:
+        return self.last_sweep is None or monotonic() - self.last_sweep >= self.sweep_interval
+
+    def swept(self):
+        self.last_sweep = monotonic()
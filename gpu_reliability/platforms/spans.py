@@ -0,0 +1,25 @@
+from contextlib import contextmanager
+from time import monotonic
+from typing import Dict
+from gpu_reliability.models import LaunchPhase
+
+
+class LaunchSpans:
+    """
+    Times the phases of a single launch. Phases that are entered more than once, like
+    throttling before each call, accumulate.
+
+    """
+    def __init__(self):
+        self.phase_seconds: Dict[str, float] = {}
+
+    @contextmanager
+    def span(self, phase: LaunchPhase):
+        start = monotonic()
+        try:
+            yield
+        finally:
+            self.add(phase, monotonic() - start)
+
+    def add(self, phase: LaunchPhase, seconds: float):
+        self.phase_seconds[phase.value] = self.phase_seconds.get(phase.value, 0.0) + seconds
@@ -0,0 +1,204 @@
+"""
+Coordination for the calls we make against cloud APIs: token buckets that keep every thread
+of a platform under its API quotas, and circuit breakers that stop probing targets which are
+known to be out of capacity.
+
+"""
+from dataclasses import dataclass
+from enum import Enum, unique
+from threading import Lock
+from time import monotonic, sleep
+from typing import Dict, Hashable, Optional, Tuple
+from gpu_reliability.logging import logger
+
+
+# Region used for calls that aren't scoped to one, like listing instances across every zone
+GLOBAL_REGION = "global"
+
+
+@unique
+class ApiFamily(Enum):
+    # Calls that only read state, like describing instances or polling operations. Clouds
+    # throttle these separately from (and more generously than) mutating calls.
+    READ = "READ"
+    # Calls that create or delete resources
+    MUTATE = "MUTATE"
+
+
+@dataclass(frozen=True)
+class RateLimit:
+    # Tokens added per second
+    rate: float
+    # Tokens the bucket holds when full, which is how many calls can burst at once
+    burst: float
+
+
+class TokenBucket:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+
+        self.lock = Lock()
+        self.tokens = burst
+        self.updated_at = monotonic()
+        # Seconds callers spent waiting for tokens, to tell when the limits are too tight
+        self.waited_seconds = 0.0
+
+    def refill(self, now: float):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def try_acquire(self, tokens: float = 1) -> float:
+        """
+        :return: 0 if the tokens were taken, otherwise the seconds until they will be available
+
+        """
+        with self.lock:
+            self.refill(monotonic())
+            if self.tokens >= tokens:
+                self.tokens -= tokens
+                return 0
+            return (tokens - self.tokens) / self.rate
+
+    def acquire(self, tokens: float = 1, timeout: Optional[float] = None) -> bool:
+        """
+        Block until `tokens` are available and take them.
+
+        :return: False if they wouldn't be available within `timeout` seconds
+
+        """
+        deadline = None if timeout is None else monotonic() + timeout
+        while True:
+            wait = self.try_acquire(tokens)
+            if not wait:
+                return True
+            if deadline is not None and monotonic() + wait > deadline:
+                return False
+            sleep(wait)
+            with self.lock:
+                self.waited_seconds += wait
+
+
+class RateLimiter:
+    """
+    Token buckets for one cloud: a bucket per API family and region, and optionally one that
+    every call of the cloud shares.
+
+    """
+    def __init__(self, limits: Dict[ApiFamily, RateLimit], total: Optional[RateLimit] = None):
+        """
+        :param limits: Limit of each API family within a region
+        :param total: Limit across every family and region
+
+        """
+        self.limits = limits
+        self.total = TokenBucket(total.rate, total.burst) if total is not None else None
+
+        self.lock = Lock()
+        self.buckets: Dict[Tuple[ApiFamily, str], TokenBucket] = {}
+
+    def bucket(self, family: ApiFamily, region: str) -> TokenBucket:
+        key = (family, region)
+        bucket = self.buckets.get(key)
+        if bucket is None:
+            with self.lock:
+                if key not in self.buckets:
+                    limit = self.limits[family]
+                    self.buckets[key] = TokenBucket(limit.rate, limit.burst)
+                bucket = self.buckets[key]
+        return bucket
+
+    def acquire(self, family: ApiFamily, region: str = GLOBAL_REGION):
+        """
+        Wait until a call of `family` may be made in `region`.
+
+        """
+        # The regional bucket goes first, so calls waiting on a throttled region don't hold
+        # shared tokens that calls to other regions could be using
+        self.bucket(family, region).acquire()
+        if self.total is not None:
+            self.total.acquire()
+
+    def waited_seconds(self, family: ApiFamily) -> float:
+        """
+        Seconds that calls of `family` spent waiting on their per-region buckets.
+
+        """
+        return sum(bucket.waited_seconds for (bucket_family, _), bucket in list(self.buckets.items()) if bucket_family == family)
+
+
+@unique
+class CircuitState(Enum):
+    # Probing normally
+    CLOSED = "CLOSED"
+    # Probing is paused until the cool-down passes
+    OPEN = "OPEN"
+    # A single trial probe is allowed through to test whether capacity is back
+    HALF_OPEN = "HALF_OPEN"
+
+
+@dataclass
+class Circuit:
+    state: CircuitState = CircuitState.CLOSED
+    # Consecutive exhausted launches while closed
+    failures: int = 0
+    # Monotonic time the circuit last opened, or its trial probe started
+    changed_at: float = 0.0
+
+
+@logger
+class CircuitBreaker:
+    """
+    Stops probing a target after `failure_threshold` consecutive launches fail for lack of
+    capacity. Once `cooldown` seconds pass, one trial launch goes through: success closes the
+    circuit again, another exhausted launch reopens it for a further cool-down.
+
+    """
+    def __init__(self, failure_threshold: int = 3, cooldown: float = 30 * 60):
+        """
+        :param cooldown: Seconds to stop probing an exhausted target. Also bounds how long a
+            trial launch may go without an outcome before another one is allowed.
+
+        """
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+
+        self.lock = Lock()
+        self.circuits: Dict[Hashable, Circuit] = {}
+
+    def state(self, key: Hashable) -> CircuitState:
+        circuit = self.circuits.get(key)
+        return circuit.state if circuit is not None else CircuitState.CLOSED
+
+    def allow(self, key: Hashable) -> bool:
+        with self.lock:
+            circuit = self.circuits.get(key)
+            if circuit is None or circuit.state == CircuitState.CLOSED:
+                return True
+
+            now = monotonic()
+            # Also lets another trial through if the last one never reported back
+            if now - circuit.changed_at < self.cooldown:
+                return False
+
+            circuit.state = CircuitState.HALF_OPEN
+            circuit.changed_at = now
+            self.logger.info(f"Sending a trial launch to `{key}`")
+            return True
+
+    def record_success(self, key: Hashable):
+        with self.lock:
+            circuit = self.circuits.pop(key, None)
+        if circuit is not None and circuit.state != CircuitState.CLOSED:
+            self.logger.info(f"Capacity is back for `{key}`, resuming launches")
+
+    def record_failure(self, key: Hashable):
+        with self.lock:
+            circuit = self.circuits.setdefault(key, Circuit())
+            circuit.failures += 1
+            if circuit.state == CircuitState.CLOSED and circuit.failures < self.failure_threshold:
+                return
+
+            circuit.state = CircuitState.OPEN
+            circuit.changed_at = monotonic()
+        self.logger.warning(f"`{key}` is out of capacity, pausing launches for {self.cooldown:.0f}s")
@@ -0,0 +1,265 @@
+"""
+Streaming aggregation over a stats jsonl file. The file is processed in chunks of lines so
+memory stays bounded by the number of (platform, geography, spot, hardware) groups rather than the
+number of launches, and large files are split at line boundaries across processes.
+
+"""
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from json import loads, JSONDecodeError
+from os import cpu_count
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple, Union
+from gpu_reliability.models import LaunchPhase
+from gpu_reliability.sketch import LatencySketch
+from gpu_reliability.stats_logger import is_harness_error, parse_error_code
+import numpy as np
+
+
+# (platform, geography, spot, machine type, accelerator type); the hardware is None for
+# launches that predate per-launch hardware
+GroupKey = Tuple[str, str, bool, Optional[str], Optional[str]]
+
+HOURS = 24
+QUANTILES = (0.5, 0.9, 0.99)
+
+
+@dataclass
+class GroupReport:
+    launches: int = 0
+    successes: int = 0
+    latency: LatencySketch = field(default_factory=LatencySketch)
+    errors: Counter = field(default_factory=Counter)
+    # Launch and success counts by hour of the day the launch was triggered
+    hourly_launches: np.ndarray = field(default_factory=lambda: np.zeros(HOURS, dtype=np.int64))
+    hourly_successes: np.ndarray = field(default_factory=lambda: np.zeros(HOURS, dtype=np.int64))
+    # Durations of each launch phase, keyed by LaunchPhase value
+    phases: Dict[str, LatencySketch] = field(default_factory=dict)
+    # Launches the harness dropped without attempting, which aren't part of `launches`
+    dropped: int = 0
+
+    @property
+    def success_rate(self) -> Optional[float]:
+        return self.successes / self.launches if self.launches else None
+
+    def merge(self, other: "GroupReport"):
+        self.launches += other.launches
+        self.successes += other.successes
+        self.latency.merge(other.latency)
+        self.errors.update(other.errors)
+        self.hourly_launches += other.hourly_launches
+        self.hourly_successes += other.hourly_successes
+        self.dropped += other.dropped
+        for phase, sketch in other.phases.items():
+            self.phase(phase).merge(sketch)
+
+    def phase(self, phase: str) -> LatencySketch:
+        if phase not in self.phases:
+            self.phases[phase] = LatencySketch()
+        return self.phases[phase]
+
+    def to_dict(self):
+        with np.errstate(divide="ignore", invalid="ignore"):
+            hourly_rates = self.hourly_successes / self.hourly_launches
+        return {
+            "launches": self.launches,
+            "successes": self.successes,
+            "success_rate": self.success_rate,
+            "create_seconds": {f"p{int(quantile * 100)}": self.latency.quantile(quantile) for quantile in QUANTILES},
+            "phase_seconds": {
+                phase.value: {f"p{int(quantile * 100)}": self.phases[phase.value].quantile(quantile) for quantile in QUANTILES}
+                for phase in LaunchPhase
+                if phase.value in self.phases
+            },
+            "errors": dict(self.errors.most_common()),
+            "hourly_success_rate": [None if np.isnan(rate) else float(rate) for rate in hourly_rates],
+            "dropped": self.dropped,
+        }
+
+
+@dataclass
+class Report:
+    groups: Dict[GroupKey, GroupReport] = field(default_factory=dict)
+    # Lines that couldn't be parsed as a launch
+    skipped: int = 0
+
+    def group(self, key: GroupKey) -> GroupReport:
+        if key not in self.groups:
+            self.groups[key] = GroupReport()
+        return self.groups[key]
+
+    def merge(self, other: "Report"):
+        for key, group in other.groups.items():
+            self.group(key).merge(group)
+        self.skipped += other.skipped
+
+    def to_dict(self):
+        return {
+            "groups": [
+                {
+                    "platform": platform,
+                    "geography": geography,
+                    "spot": spot,
+                    "machine_type": machine_type,
+                    "accelerator_type": accelerator_type,
+                    **self.groups[(platform, geography, spot, machine_type, accelerator_type)].to_dict(),
+                }
+                for platform, geography, spot, machine_type, accelerator_type in sorted(self.groups, key=sort_key)
+            ],
+            "skipped": self.skipped,
+        }
+
+
+def sort_key(key: GroupKey):
+    # None sorts before any hardware name
+    return tuple((value is not None, value) for value in key)
+
+
+def aggregate_lines(lines: List[bytes], report: Report):
+    """
+    Parse a chunk of lines into flat columns and fold them into the report with vectorized
+    group-by operations.
+
+    """
+    group_codes: Dict[GroupKey, int] = {}
+    codes = []
+    successes = []
+    seconds = []
+    hours = []
+    failures = []
+    # (group code, phase) -> durations
+    phase_seconds: Dict[Tuple[int, str], List[float]] = {}
+
+    for line in lines:
+        try:
+            payload = loads(line)
+            request = payload["request"]
+            key = (
+                payload["platform"],
+                request["geography"],
+                request["spot"],
+                request.get("machine_type"),
+                request.get("accelerator_type"),
+            )
+            success = bool(payload["create_success"])
+            create_seconds = payload.get("create_seconds")
+            # isoformat: YYYY-MM-DDTHH:...
+            hour = int(payload["timestamp"][11:13])
+            # Absent from stats that predate per-phase timing
+            phases = payload.get("phase_seconds") or {}
+        except (JSONDecodeError, KeyError, TypeError, ValueError):
+            report.skipped += 1
+            continue
+
+        if not success and is_harness_error(payload.get("error")):
+            report.group(key).dropped += 1
+            continue
+
+        code = group_codes.setdefault(key, len(group_codes))
+        codes.append(code)
+        successes.append(success)
+        seconds.append(np.nan if create_seconds is None else create_seconds)
+        hours.append(hour)
+        if not success:
+            failures.append((code, parse_error_code(payload.get("error"))))
+        for phase, value in phases.items():
+            phase_seconds.setdefault((code, phase), []).append(value)
+
+    if not codes:
+        return
+
+    groups = len(group_codes)
+    codes = np.array(codes, dtype=np.int64)
+    successes = np.array(successes, dtype=np.int64)
+    seconds = np.array(seconds, dtype=np.float64)
+    hour_slots = codes * HOURS + np.array(hours, dtype=np.int64)
+
+    launches = np.bincount(codes, minlength=groups)
+    success_counts = np.bincount(codes, weights=successes, minlength=groups).astype(np.int64)
+    hourly_launches = np.bincount(hour_slots, minlength=groups * HOURS).reshape(groups, HOURS)
+    hourly_successes = np.bincount(hour_slots, weights=successes, minlength=groups * HOURS).astype(np.int64).reshape(groups, HOURS)
+
+    # Sort once so every group's durations are a contiguous slice
+    grouped_seconds = np.split(seconds[np.argsort(codes, kind="stable")], np.cumsum(launches)[:-1])
+
+    keys = {code: key for key, code in group_codes.items()}
+    errors = [Counter() for _ in range(groups)]
+    for code, error in failures:
+        errors[code][error] += 1
+
+    for key, code in group_codes.items():
+        group = report.group(key)
+        group.launches += int(launches[code])
+        group.successes += int(success_counts[code])
+        group.hourly_launches += hourly_launches[code]
+        group.hourly_successes += hourly_successes[code]
+        group.latency.add_many(grouped_seconds[code])
+        group.errors.update(errors[code])
+
+    for (code, phase), values in phase_seconds.items():
+        report.group(keys[code]).phase(phase).add_many(values)
+
+
+def aggregate_range(path: Union[str, Path], start: int, end: int, chunk_lines: int = 50_000) -> Report:
+    """
+    Aggregate every line that begins within the byte range [start, end).
+
+    """
+    report = Report()
+
+    with open(path, "rb") as file:
+        position = start
+        if start > 0:
+            # Skip the line that straddles the boundary; the previous range owns it
+            file.seek(start - 1)
+            position = start - 1 + len(file.readline())
+
+        chunk = []
+        while position < end:
+            line = file.readline()
+            if not line:
+                break
+            position += len(line)
+            chunk.append(line)
+
+            if len(chunk) >= chunk_lines:
+                aggregate_lines(chunk, report)
+                chunk = []
+
+        aggregate_lines(chunk, report)
+
+    return report
+
+
+def split_ranges(size: int, parts: int) -> List[Tuple[int, int]]:
+    step = max(-(-size // parts), 1)
+    return [(start, min(start + step, size)) for start in range(0, size, step)]
+
+
+def build_report(
+    path: Union[str, Path],
+    workers: Optional[int] = None,
+    chunk_lines: int = 50_000,
+    min_split_bytes: int = 64 * 1024 * 1024,
+) -> Report:
+    """
+    :param workers: Processes to aggregate with; defaults to the number of CPUs
+    :param min_split_bytes: Files smaller than this are aggregated in-process, since forking
+        costs more than it saves
+
+    """
+    size = Path(path).stat().st_size
+    workers = workers or cpu_count() or 1
+
+    if workers == 1 or size < min_split_bytes:
+        return aggregate_range(path, 0, size, chunk_lines)
+
+    # More ranges than workers evens out the load when the files are uneven
+    ranges = split_ranges(size, workers * 4)
+    report = Report()
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = [executor.submit(aggregate_range, path, start, end, chunk_lines) for start, end in ranges]
+        for future in futures:
+            report.merge(future.result())
+    return report
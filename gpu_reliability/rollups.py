@@ -0,0 +1,295 @@
+from collections import Counter
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from enum import Enum, unique
+from json import dumps, loads
+from os import replace
+from pathlib import Path
+from threading import Lock
+from time import monotonic
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+from gpu_reliability.logging import logger
+from gpu_reliability.sketch import LatencySketch
+from gpu_reliability.stats_logger import Stat, is_harness_error, parse_error_code
+
+
+@unique
+class Granularity(Enum):
+    HOUR = "HOUR"
+    DAY = "DAY"
+
+
+def bucket_start(timestamp: datetime, granularity: Granularity) -> datetime:
+    if granularity == Granularity.HOUR:
+        return timestamp.replace(minute=0, second=0, microsecond=0)
+    return timestamp.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+# (granularity, bucket start, platform, geography, spot, machine type, accelerator type); the
+# hardware is None for launches that predate per-launch hardware
+RollupKey = Tuple[Granularity, datetime, str, str, bool, Optional[str], Optional[str]]
+
+# Bumped whenever the buckets change meaning, so sidecars written by older versions are rebuilt
+# from the raw log instead of being merged into
+SIDECAR_VERSION = 2
+
+
+@dataclass
+class RollupBucket:
+    launches: int = 0
+    successes: int = 0
+    errors: Counter = field(default_factory=Counter)
+    latency: LatencySketch = field(default_factory=LatencySketch)
+    # Launches the harness dropped without attempting, which aren't part of `launches`
+    dropped: int = 0
+
+    @property
+    def success_rate(self) -> Optional[float]:
+        return self.successes / self.launches if self.launches else None
+
+    def add(self, stat: Stat):
+        if not stat.create_success and is_harness_error(stat.error):
+            self.dropped += 1
+            return
+
+        self.launches += 1
+        if stat.create_success:
+            self.successes += 1
+        else:
+            # JSON keys can't be null, so failures without an error are keyed by ""
+            self.errors[parse_error_code(stat.error) or ""] += 1
+        self.latency.add(stat.create_seconds)
+
+    def merge(self, other: "RollupBucket"):
+        self.launches += other.launches
+        self.successes += other.successes
+        self.errors.update(other.errors)
+        self.latency.merge(other.latency)
+        self.dropped += other.dropped
+
+    def to_dict(self):
+        return {
+            "launches": self.launches,
+            "successes": self.successes,
+            "errors": dict(self.errors),
+            "latency": self.latency.to_dict(),
+            "dropped": self.dropped,
+        }
+
+    @classmethod
+    def from_dict(cls, payload) -> "RollupBucket":
+        return cls(
+            launches=payload["launches"],
+            successes=payload["successes"],
+            errors=Counter(payload["errors"]),
+            latency=LatencySketch.from_dict(payload["latency"]),
+            dropped=payload.get("dropped", 0),
+        )
+
+
+@logger
+class Rollups:
+    """
+    Hourly and daily aggregates per (platform, geography, spot, hardware), maintained
+    incrementally as stats are written. Queries read O(buckets) instead of rescanning the raw
+    launch log.
+
+    """
+    def __init__(
+        self,
+        path: Optional[Union[str, Path]] = None,
+        persist_interval: float = 60,
+        hourly_retention: Optional[timedelta] = timedelta(days=90),
+    ):
+        """
+        :param path: Sidecar file the rollups are persisted to, if any
+        :param persist_interval: Minimum seconds between rewrites of the sidecar file
+        :param hourly_retention: Hourly buckets older than this are dropped when persisting
+            to keep the sidecar small; daily buckets are kept forever
+
+        """
+        self.path = Path(path) if path is not None else None
+        self.persist_interval = persist_interval
+        self.hourly_retention = hourly_retention
+
+        self.lock = Lock()
+        # Serializes rewrites of the sidecar separately from the cheap in-memory updates
+        self.persist_lock = Lock()
+        self.buckets: Dict[RollupKey, RollupBucket] = {}
+        self.dirty = False
+        self.last_persist = monotonic()
+        # Set when the sidecar was written in an older format and has to be rebuilt
+        self.stale = False
+
+        if self.path is not None and self.path.exists():
+            self.load()
+
+    def add(self, stat: Stat):
+        self.add_many([stat])
+
+    def add_many(self, stats: Iterable[Stat]):
+        with self.lock:
+            for stat in stats:
+                for granularity in Granularity:
+                    key = (
+                        granularity,
+                        bucket_start(stat.timestamp, granularity),
+                        stat.platform.name,
+                        stat.request.geography,
+                        stat.request.spot,
+                        stat.request.machine_type,
+                        stat.request.accelerator_type,
+                    )
+                    bucket = self.buckets.get(key)
+                    if bucket is None:
+                        bucket = self.buckets[key] = RollupBucket()
+                    bucket.add(stat)
+                self.dirty = True
+
+    def query(
+        self,
+        granularity: Granularity = Granularity.HOUR,
+        platform: Optional[str] = None,
+        geography: Optional[str] = None,
+        spot: Optional[bool] = None,
+        machine_type: Optional[str] = None,
+        accelerator_type: Optional[str] = None,
+        start: Optional[datetime] = None,
+        end: Optional[datetime] = None,
+    ) -> List[Tuple[RollupKey, RollupBucket]]:
+        """
+        Buckets that match every provided filter, sorted by time. `start` is inclusive
+        and `end` is exclusive, both compared against the start of each bucket.
+
+        """
+        with self.lock:
+            matches = [
+                (key, bucket)
+                for key, bucket in self.buckets.items()
+                if key[0] == granularity
+                and (platform is None or key[2] == platform)
+                and (geography is None or key[3] == geography)
+                and (spot is None or key[4] == spot)
+                and (machine_type is None or key[5] == machine_type)
+                and (accelerator_type is None or key[6] == accelerator_type)
+                and (start is None or key[1] >= start)
+                and (end is None or key[1] < end)
+            ]
+        # None sorts before any hardware name
+        return sorted(
+            matches,
+            key=lambda match: (match[0][1], tuple((value is not None, value) for value in match[0][2:])),
+        )
+
+    def availability(self, **filters) -> RollupBucket:
+        """
+        Merge every bucket matching the `query` filters into a single total.
+
+        """
+        total = RollupBucket()
+        for _, bucket in self.query(**filters):
+            total.merge(bucket)
+        return total
+
+    def prune(self):
+        if self.hourly_retention is None or not self.buckets:
+            return
+        cutoff = max(key[1] for key in self.buckets) - self.hourly_retention
+        self.buckets = {
+            key: bucket
+            for key, bucket in self.buckets.items()
+            if key[0] != Granularity.HOUR or key[1] >= cutoff
+        }
+
+    def persist(self):
+        if self.path is None:
+            return
+
+        with self.persist_lock:
+            self.write_sidecar()
+
+    def write_sidecar(self):
+        with self.lock:
+            self.prune()
+            payload = dumps(
+                {
+                    "version": SIDECAR_VERSION,
+                    "buckets": [
+                        {
+                            "granularity": granularity.value,
+                            "start": start.isoformat(),
+                            "platform": platform,
+                            "geography": geography,
+                            "spot": spot,
+                            "machine_type": machine_type,
+                            "accelerator_type": accelerator_type,
+                            **bucket.to_dict(),
+                        }
+                        for (
+                            granularity,
+                            start,
+                            platform,
+                            geography,
+                            spot,
+                            machine_type,
+                            accelerator_type,
+                        ), bucket in self.buckets.items()
+                    ]
+                }
+            )
+            self.dirty = False
+            self.last_persist = monotonic()
+
+        # Write then rename so readers never see a partial sidecar
+        temporary_path = self.path.with_name(self.path.name + ".tmp")
+        with open(temporary_path, "w") as file:
+            file.write(payload)
+        replace(temporary_path, self.path)
+
+    def maybe_persist(self):
+        if self.dirty and monotonic() - self.last_persist >= self.persist_interval:
+            self.persist()
+
+    def load(self):
+        with open(self.path) as file:
+            payload = loads(file.read())
+
+        if payload.get("version") != SIDECAR_VERSION:
+            self.logger.warning(f"Rollups in `{self.path}` were written in an older format and need a rebuild")
+            self.stale = True
+            return
+
+        with self.lock:
+            self.buckets = {
+                (
+                    Granularity(bucket["granularity"]),
+                    datetime.fromisoformat(bucket["start"]),
+                    bucket["platform"],
+                    bucket["geography"],
+                    bucket["spot"],
+                    bucket["machine_type"],
+                    bucket["accelerator_type"],
+                ): RollupBucket.from_dict(bucket)
+                for bucket in payload["buckets"]
+            }
+
+    def rebuild(self, stats: Iterable[Stat]):
+        """
+        Replace the current rollups with ones computed from the raw launch log.
+
+        """
+        with self.lock:
+            self.buckets = {}
+            self.stale = False
+        self.add_many(stats)
+        self.persist()
+        self.logger.info(f"Rebuilt {len(self.buckets)} rollup buckets")
+
+
+def rollups_path(stats_path: Union[str, Path]) -> Path:
+    """
+    Default location of the rollups sidecar for a given stats output.
+
+    """
+    stats_path = Path(stats_path)
+    return stats_path.with_name(stats_path.name + ".rollups.json")
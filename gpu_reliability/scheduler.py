@@ -0,0 +1,130 @@
+"""
+Trigger times for random search probing. Each period's times are drawn up front from a seed,
+so every period gets exactly the requested number of samples and a run can be reproduced.
+
+"""
+from enum import Enum, unique
+from heapq import heappop, heappush
+from itertools import count
+from random import Random
+from threading import Event
+from time import monotonic
+from typing import Callable, Dict, Iterator, List, Optional, Tuple
+
+
+@unique
+class ScheduleKind(Enum):
+    # Times drawn uniformly over the whole period, which is a Poisson process conditioned on
+    # the number of samples. Gaps vary, so bursts and lulls both get probed.
+    POISSON = "POISSON"
+    # One time drawn uniformly within each of `samples` equal slices of the period, which
+    # covers the time of day evenly while keeping the exact times random
+    STRATIFIED = "STRATIFIED"
+
+
+def period_offsets(samples: int, kind: ScheduleKind, rng: Random, period: float) -> List[float]:
+    """
+    :return: Sorted seconds from the start of the period at which to trigger
+
+    """
+    if kind == ScheduleKind.POISSON:
+        return sorted(rng.uniform(0, period) for _ in range(samples))
+
+    stratum = period / samples
+    return [(index + rng.random()) * stratum for index in range(samples)]
+
+
+class TriggerScheduler:
+    """
+    Several named schedules served by a single timer. Deadlines are anchored to the
+    scheduler's start on a monotonic clock, so they don't drift by however long the caller
+    takes to act on each one.
+
+    """
+    def __init__(
+        self,
+        period: float = 60 * 60 * 24,
+        seed: Optional[int] = None,
+        clock: Callable[[], float] = monotonic,
+    ):
+        """
+        :param seed: Seeds every schedule's times, each from its own stream so adding a
+            schedule doesn't change the times of the others. None draws a fresh seed.
+
+        """
+        self.period = period
+        self.seed = seed if seed is not None else Random().getrandbits(32)
+        self.clock = clock
+        self.start = clock()
+
+        # (deadline, insertion order, schedule name), with one deadline per schedule at a time
+        self.deadlines: List[Tuple[float, int, str]] = []
+        self.schedules: Dict[str, Iterator[float]] = {}
+        self.order = count()
+        self.stopped = Event()
+
+    def add(self, name: str, samples: int, kind: ScheduleKind = ScheduleKind.STRATIFIED):
+        """
+        :param samples: Triggers per period
+
+        """
+        if samples <= 0:
+            return
+        self.schedules[name] = self.generate(name, samples, kind)
+        self.push(name)
+
+    def generate(self, name: str, samples: int, kind: ScheduleKind) -> Iterator[float]:
+        rng = Random(f"{self.seed}:{name}")
+        period_index = 0
+        while True:
+            period_start = self.start + period_index * self.period
+            for offset in period_offsets(samples, kind, rng, self.period):
+                yield period_start + offset
+            period_index += 1
+
+    def push(self, name: str):
+        heappush(self.deadlines, (next(self.schedules[name]), next(self.order), name))
+
+    def peek(self) -> Optional[Tuple[float, str]]:
+        if not self.deadlines:
+            return None
+        deadline, _, name = self.deadlines[0]
+        return deadline, name
+
+    def pop(self) -> Tuple[float, str]:
+        """
+        Take the next deadline, whether or not it's due, and schedule the one after it.
+
+        """
+        deadline, _, name = heappop(self.deadlines)
+        self.push(name)
+        return deadline, name
+
+    def wait(self, timeout: Optional[float] = None) -> Optional[str]:
+        """
+        Sleep until the next deadline. Deadlines that passed while the caller was busy are
+        returned right away, so no trigger is lost.
+
+        :param timeout: Seconds to wait at most, to let the caller do other periodic work
+        :return: Name of the schedule that is due, or None if the timeout passed or the
+            scheduler was stopped first
+
+        """
+        upcoming = self.peek()
+        if upcoming is None:
+            self.stopped.wait(timeout)
+            return None
+
+        remaining = upcoming[0] - self.clock()
+        if timeout is not None and remaining > timeout:
+            self.stopped.wait(timeout)
+            return None
+        if remaining > 0 and self.stopped.wait(remaining):
+            return None
+        if self.stopped.is_set():
+            return None
+
+        return self.pop()[1]
+
+    def stop(self):
+        self.stopped.set()
@@ -1,13 +1,19 @@
 from pydantic import BaseSettings
 from base64 import b64decode
+from gpu_reliability.models import PlatformType
 
 
-class Settings(BaseSettings):
+class AWSSettings(BaseSettings):
     # IAM credentials for an individual who has access to EC2 launching
     # permissions in your account
     aws_access_key_id: str
     aws_access_secret_key: str
 
+    class Config:
+        env_prefix = "BENCHMARK__"
+
+
+class GCPSettings(BaseSettings):
     gcp_project: str
 
     # Base64 encoded json of the service key
@@ -19,3 +25,10 @@ class Settings(BaseSettings):
 
     class Config:
         env_prefix = "BENCHMARK__"
+
+
+# Credentials each platform needs, so only the selected platforms' are required
+PLATFORM_SETTINGS = {
+    PlatformType.AWS: AWSSettings,
+    PlatformType.GCP: GCPSettings,
+}
@@ -0,0 +1,107 @@
+from math import ceil, log
+from typing import Dict, Iterable, Optional
+import numpy as np
+
+
+class LatencySketch:
+    """
+    Mergeable quantile sketch for durations. Values are counted in logarithmically sized
+    buckets, so any quantile is estimated within `relative_accuracy` of the true value while
+    memory only grows with the range of observed values, not with their count.
+
+    """
+    # Durations at or below this are counted as zero; they can't be placed on a log scale
+    MIN_VALUE = 1e-6
+
+    def __init__(self, relative_accuracy: float = 0.01):
+        self.relative_accuracy = relative_accuracy
+        self.gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self.log_gamma = log(self.gamma)
+
+        self.buckets: Dict[int, int] = {}
+        self.zero_count = 0
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, value: Optional[float]):
+        # Launches that never reported a duration are excluded
+        if value is None or value != value:
+            return
+
+        if value <= self.MIN_VALUE:
+            self.zero_count += 1
+        else:
+            index = ceil(log(value) / self.log_gamma)
+            self.buckets[index] = self.buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+
+    def add_many(self, values: Iterable[float]):
+        """
+        Vectorized equivalent of calling `add` for every value.
+
+        """
+        values = np.asarray(values, dtype=np.float64)
+        values = values[~np.isnan(values)]
+        if not len(values):
+            return
+
+        positive = values[values > self.MIN_VALUE]
+        indices, counts = np.unique(np.ceil(np.log(positive) / self.log_gamma).astype(np.int64), return_counts=True)
+        for index, count in zip(indices.tolist(), counts.tolist()):
+            self.buckets[index] = self.buckets.get(index, 0) + count
+
+        self.zero_count += len(values) - len(positive)
+        self.count += len(values)
+        self.total += float(values.sum())
+
+    def merge(self, other: "LatencySketch"):
+        if other.relative_accuracy != self.relative_accuracy:
+            raise ValueError("Can only merge sketches with the same relative accuracy")
+
+        for index, count in other.buckets.items():
+            self.buckets[index] = self.buckets.get(index, 0) + count
+        self.zero_count += other.zero_count
+        self.count += other.count
+        self.total += other.total
+
+    def quantile(self, quantile: float) -> Optional[float]:
+        if not self.count:
+            return None
+
+        rank = quantile * (self.count - 1)
+        seen = self.zero_count
+        if rank < seen:
+            return 0.0
+
+        for index in sorted(self.buckets):
+            seen += self.buckets[index]
+            if rank < seen:
+                # Midpoint of the bucket, in the relative sense
+                return 2 * self.gamma ** index / (self.gamma + 1)
+        return 2 * self.gamma ** max(self.buckets) / (self.gamma + 1)
+
+    @property
+    def mean(self) -> Optional[float]:
+        return self.total / self.count if self.count else None
+
+    def __eq__(self, other):
+        return isinstance(other, LatencySketch) and self.to_dict() == other.to_dict()
+
+    def to_dict(self):
+        return {
+            "relative_accuracy": self.relative_accuracy,
+            "zero_count": self.zero_count,
+            "count": self.count,
+            "total": self.total,
+            "buckets": {str(index): count for index, count in self.buckets.items()},
+        }
+
+    @classmethod
+    def from_dict(cls, payload) -> "LatencySketch":
+        sketch = cls(relative_accuracy=payload["relative_accuracy"])
+        sketch.zero_count = payload["zero_count"]
+        sketch.count = payload["count"]
+        sketch.total = payload["total"]
+        sketch.buckets = {int(index): count for index, count in payload["buckets"].items()}
+        return sketch
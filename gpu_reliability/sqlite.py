@@ -0,0 +1,405 @@
+"""
+SQLite storage for launch stats, for answering narrow questions about a long trial without
+scanning the whole history. The database runs in WAL mode so any number of reader processes
+can query it while the harness keeps writing:
+
+    requests            one row per LaunchRequest: spot, hardware and trigger
+    launches            one row per launch, indexed by (platform, geography, timestamp) and error code
+    warnings            the launch's warnings, in order
+    launch_phases       seconds the launch spent in each LaunchPhase
+
+Timestamps are stored as microseconds since the epoch in the same (naive, local) clock that
+Stat.timestamp uses, like the columnar store.
+
+"""
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from json import JSONDecodeError, loads
+from pathlib import Path
+from sqlite3 import Connection, connect
+from typing import Dict, Iterable, Iterator, List, Optional, Tuple, Union
+from uuid import UUID
+from gpu_reliability.columnar import EPOCH, timestamp_micros
+from gpu_reliability.models import LaunchRequest, PlatformType
+from gpu_reliability.stats_logger import HARNESS_ERROR_CODES, BufferedStatsLogger, FsyncPolicy, Stat, decode_stat, parse_error_code
+
+
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS requests (
+    id INTEGER PRIMARY KEY,
+    identifier TEXT NOT NULL UNIQUE,
+    spot INTEGER NOT NULL,
+    machine_type TEXT,
+    accelerator_type TEXT,
+    trigger_id TEXT
+);
+
+CREATE TABLE IF NOT EXISTS launches (
+    id INTEGER PRIMARY KEY,
+    request_id INTEGER NOT NULL REFERENCES requests (id),
+    platform TEXT NOT NULL,
+    geography TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    create_success INTEGER NOT NULL,
+    create_seconds REAL,
+    error TEXT,
+    error_code TEXT
+);
+
+CREATE TABLE IF NOT EXISTS warnings (
+    launch_id INTEGER NOT NULL REFERENCES launches (id),
+    position INTEGER NOT NULL,
+    warning TEXT NOT NULL,
+    PRIMARY KEY (launch_id, position)
+) WITHOUT ROWID;
+
+CREATE TABLE IF NOT EXISTS launch_phases (
+    launch_id INTEGER NOT NULL REFERENCES launches (id),
+    phase TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    PRIMARY KEY (launch_id, phase)
+) WITHOUT ROWID;
+
+CREATE INDEX IF NOT EXISTS launches_target ON launches (platform, geography, timestamp);
+CREATE INDEX IF NOT EXISTS launches_error_code ON launches (error_code, timestamp);
+"""
+
+MICROS_PER_HOUR = 60 * 60 * 1_000_000
+
+
+def open_database(path: Union[str, Path], readonly: bool = False) -> Connection:
+    # Transactions are managed explicitly rather than by the sqlite3 module
+    connection = connect(path, isolation_level=None)
+    # Writers wait on each other, like the harness and a concurrent `convert`, instead of failing
+    connection.execute("PRAGMA busy_timeout = 5000")
+    if readonly:
+        connection.execute("PRAGMA query_only = ON")
+    return connection
+
+
+class SqliteStatsWriter:
+    """
+    Insert stats into a database in batches, one transaction per batch. Like a sqlite3
+    connection, only usable from the thread that created it.
+
+    """
+    def __init__(self, path: Union[str, Path], fsync_policy: FsyncPolicy = FsyncPolicy.BATCH):
+        """
+        :param fsync_policy: With `FsyncPolicy.BATCH` every transaction is synced as it
+            commits; otherwise only `sync` forces the write-ahead log to disk
+
+        """
+        self.path = Path(path)
+        self.fsync_policy = fsync_policy
+        self.connection = open_database(self.path)
+        self.connection.execute("PRAGMA journal_mode = WAL")
+        self.connection.execute(f"PRAGMA synchronous = {'FULL' if fsync_policy == FsyncPolicy.BATCH else 'NORMAL'}")
+
+        version = self.connection.execute("PRAGMA user_version").fetchone()[0]
+        if version > SCHEMA_VERSION:
+            raise ValueError(f"`{self.path}` was written by a newer schema (version {version})")
+        self.connection.executescript(SCHEMA)
+        self.connection.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def request_id(self, request: LaunchRequest) -> int:
+        identifier = str(request.identifier)
+        self.connection.execute(
+            "INSERT INTO requests (identifier, spot, machine_type, accelerator_type, trigger_id) "
+            "VALUES (?, ?, ?, ?, ?) ON CONFLICT (identifier) DO NOTHING",
+            (
+                identifier,
+                request.spot,
+                request.machine_type,
+                request.accelerator_type,
+                None if request.trigger_id is None else str(request.trigger_id),
+            ),
+        )
+        return self.connection.execute("SELECT id FROM requests WHERE identifier = ?", (identifier,)).fetchone()[0]
+
+    def append_many(self, stats: Iterable[Stat]):
+        cursor = self.connection.cursor()
+        cursor.execute("BEGIN IMMEDIATE")
+        try:
+            for stat in stats:
+                cursor.execute(
+                    "INSERT INTO launches "
+                    "(request_id, platform, geography, timestamp, create_success, create_seconds, error, error_code) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                    (
+                        self.request_id(stat.request),
+                        stat.platform.value,
+                        stat.request.geography,
+                        timestamp_micros(stat.timestamp),
+                        stat.create_success,
+                        stat.create_seconds,
+                        stat.error,
+                        parse_error_code(stat.error),
+                    ),
+                )
+                launch_id = cursor.lastrowid
+                cursor.executemany(
+                    "INSERT INTO warnings (launch_id, position, warning) VALUES (?, ?, ?)",
+                    [(launch_id, position, warning) for position, warning in enumerate(stat.warnings)],
+                )
+                cursor.executemany(
+                    "INSERT INTO launch_phases (launch_id, phase, seconds) VALUES (?, ?, ?)",
+                    [(launch_id, phase, seconds) for phase, seconds in stat.phase_seconds.items()],
+                )
+        except BaseException:
+            cursor.execute("ROLLBACK")
+            raise
+        cursor.execute("COMMIT")
+
+    def append(self, stat: Stat):
+        self.append_many([stat])
+
+    def sync(self):
+        if self.fsync_policy == FsyncPolicy.BATCH:
+            # Every commit was already synced
+            return
+        # Copies the log into the database, syncing both, without blocking readers
+        self.connection.execute("PRAGMA wal_checkpoint(PASSIVE)")
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+class SqliteStatsLogger(BufferedStatsLogger):
+    """
+    Drop-in StatsLogger that inserts into a SQLite database instead of appending to a jsonl file.
+
+    """
+    def open_output(self):
+        return SqliteStatsWriter(self.path, self.fsync_policy)
+
+    def write_batch(self, output: SqliteStatsWriter, batch: List[Stat]):
+        output.append_many(batch)
+
+    def sync_output(self, output: SqliteStatsWriter):
+        output.sync()
+
+
+@dataclass
+class LaunchFilter:
+    """
+    Narrows a query to matching launches; fields left as None match everything. Queries are
+    index lookups when they name the platform and geography, or an error code.
+
+    """
+    platform: Optional[PlatformType] = None
+    geography: Optional[str] = None
+    spot: Optional[bool] = None
+    machine_type: Optional[str] = None
+    accelerator_type: Optional[str] = None
+    error_code: Optional[str] = None
+    # Launches at or after `since`, and before `until`
+    since: Optional[datetime] = None
+    until: Optional[datetime] = None
+    # Hours of the day as [start, end); wraps around midnight when start > end, like (22, 2)
+    hours: Optional[Tuple[int, int]] = None
+
+    def where(self) -> Tuple[str, list]:
+        clauses = []
+        params = []
+
+        for column, value in [
+            ("launches.platform", None if self.platform is None else self.platform.value),
+            ("launches.geography", self.geography),
+            ("launches.error_code", self.error_code),
+            ("requests.spot", self.spot),
+            ("requests.machine_type", self.machine_type),
+            ("requests.accelerator_type", self.accelerator_type),
+        ]:
+            if value is not None:
+                clauses.append(f"{column} = ?")
+                params.append(value)
+
+        if self.since is not None:
+            clauses.append("launches.timestamp >= ?")
+            params.append(timestamp_micros(self.since))
+        if self.until is not None:
+            clauses.append("launches.timestamp < ?")
+            params.append(timestamp_micros(self.until))
+
+        if self.hours is not None:
+            start, end = self.hours
+            hour = f"(launches.timestamp / {MICROS_PER_HOUR}) % 24"
+            joiner = "AND" if start <= end else "OR"
+            clauses.append(f"({hour} >= ? {joiner} {hour} < ?)")
+            params.extend([start, end])
+
+        return " AND ".join(clauses) or "1", params
+
+
+@dataclass
+class LaunchSummary:
+    launches: int
+    successes: int
+    errors: Dict[str, int]
+    # Launches the harness dropped without attempting, which aren't part of `launches`
+    dropped: int = 0
+
+    @property
+    def success_rate(self) -> Optional[float]:
+        return self.successes / self.launches if self.launches else None
+
+
+class SqliteStatsReader:
+    """
+    Query helpers over a stats database. Safe to use from other processes while the
+    harness is writing to it.
+
+    """
+    def __init__(self, path: Union[str, Path]):
+        self.path = Path(path)
+        self.connection = open_database(self.path, readonly=True)
+
+    def query(self, select: str, launch_filter: LaunchFilter, suffix: str = "", suffix_params: tuple = ()) -> List[tuple]:
+        where, params = launch_filter.where()
+        return self.connection.execute(
+            f"SELECT {select} FROM launches JOIN requests ON requests.id = launches.request_id WHERE {where} {suffix}",
+            [*params, *suffix_params],
+        ).fetchall()
+
+    def summary(self, launch_filter: Optional[LaunchFilter] = None) -> LaunchSummary:
+        """
+        Launches, successes and failures by error code, like the success rate of spot T4s in
+        us-central1-b between 2 and 4am over the last 30 days:
+
+            reader.summary(LaunchFilter(
+                platform=PlatformType.GCP,
+                geography="us-central1-b",
+                spot=True,
+                accelerator_type="nvidia-tesla-t4",
+                since=datetime.now() - timedelta(days=30),
+                hours=(2, 4),
+            ))
+
+        """
+        launch_filter = launch_filter or LaunchFilter()
+
+        # Launches the harness dropped itself are counted apart from the ones the cloud answered
+        harness_codes = tuple(sorted(HARNESS_ERROR_CODES))
+        is_harness = (
+            "(NOT launches.create_success AND COALESCE(launches.error_code, '') "
+            f"IN ({', '.join('?' for _ in harness_codes)}))"
+        )
+
+        ((launches, successes),) = self.query(
+            "COUNT(*), COALESCE(SUM(launches.create_success), 0)",
+            launch_filter,
+            f"AND NOT {is_harness}",
+            harness_codes,
+        )
+        ((dropped,),) = self.query("COUNT(*)", launch_filter, f"AND {is_harness}", harness_codes)
+        errors = self.query(
+            "COALESCE(launches.error_code, ''), COUNT(*)",
+            launch_filter,
+            f"AND NOT launches.create_success AND NOT {is_harness} GROUP BY launches.error_code ORDER BY COUNT(*) DESC",
+            harness_codes,
+        )
+        return LaunchSummary(launches=launches, successes=successes, errors=dict(errors), dropped=dropped)
+
+    def stats(self, launch_filter: Optional[LaunchFilter] = None) -> Iterator[Stat]:
+        """
+        Rebuild the matching launches, oldest first.
+
+        """
+        rows = self.query(
+            "launches.id, launches.platform, launches.geography, launches.timestamp, launches.create_success, "
+            "launches.create_seconds, launches.error, requests.identifier, requests.spot, requests.machine_type, "
+            "requests.accelerator_type, requests.trigger_id",
+            launch_filter or LaunchFilter(),
+            "ORDER BY launches.timestamp, launches.id",
+        )
+
+        for (
+            launch_id, platform, geography, timestamp, create_success, create_seconds, error,
+            identifier, spot, machine_type, accelerator_type, trigger_id,
+        ) in rows:
+            warnings = self.connection.execute(
+                "SELECT warning FROM warnings WHERE launch_id = ? ORDER BY position", (launch_id,)
+            ).fetchall()
+            phases = self.connection.execute(
+                "SELECT phase, seconds FROM launch_phases WHERE launch_id = ?", (launch_id,)
+            ).fetchall()
+
+            yield Stat(
+                platform=PlatformType(platform),
+                create_success=bool(create_success),
+                request=LaunchRequest(
+                    spot=bool(spot),
+                    geography=geography,
+                    identifier=UUID(identifier),
+                    machine_type=machine_type,
+                    accelerator_type=accelerator_type,
+                    trigger_id=None if trigger_id is None else UUID(trigger_id),
+                ),
+                create_seconds=create_seconds,
+                error=error,
+                timestamp=EPOCH + timedelta(microseconds=timestamp),
+                warnings=[warning for (warning,) in warnings],
+                phase_seconds=dict(phases),
+            )
+
+    def query_plan(self, launch_filter: LaunchFilter) -> str:
+        """
+        SQLite's plan for the summary query, to check which index it uses.
+
+        """
+        where, params = launch_filter.where()
+        rows = self.connection.execute(
+            "EXPLAIN QUERY PLAN SELECT COUNT(*) FROM launches JOIN requests ON requests.id = launches.request_id "
+            f"WHERE {where}",
+            params,
+        ).fetchall()
+        return "\n".join(row[-1] for row in rows)
+
+    def close(self):
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+
+def convert_jsonl(jsonl_path: Union[str, Path], database_path: Union[str, Path], batch_size: int = 10_000) -> Tuple[int, int]:
+    """
+    Insert every launch in an existing stats.jsonl file into a database.
+
+    :return: Count of converted launches, and count of lines skipped because they don't
+        describe a launch
+
+    """
+    converted = 0
+    skipped = 0
+
+    with SqliteStatsWriter(database_path, FsyncPolicy.NONE) as writer, open(jsonl_path) as file:
+        batch = []
+        for line in file:
+            try:
+                batch.append(decode_stat(loads(line)))
+            except (JSONDecodeError, KeyError, TypeError, ValueError):
+                skipped += 1
+                continue
+
+            if len(batch) >= batch_size:
+                writer.append_many(batch)
+                converted += len(batch)
+                batch = []
+
+        writer.append_many(batch)
+        converted += len(batch)
+        writer.sync()
+
+    return converted, skipped
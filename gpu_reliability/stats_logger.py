@@ -1,13 +1,22 @@
-from typing import Union
+from typing import Union, Iterator, TYPE_CHECKING
 from pathlib import Path
 from dataclasses import dataclass, asdict, field
-from json import dumps, JSONEncoder
+from json import dumps, loads, JSONEncoder, JSONDecodeError
+from json.encoder import encode_basestring_ascii
 from datetime import datetime
 from gpu_reliability.models import PlatformType, LaunchRequest
-from threading import Lock
+from threading import Lock, Thread, Event
+from queue import Queue, Empty
+from time import monotonic
+from os import fsync
 from uuid import UUID
-from typing import Optional, List
-from enum import Enum
+from typing import Dict, Optional, List
+from enum import Enum, unique
+from re import match
+from gpu_reliability.logging import logger
+
+if TYPE_CHECKING:
+    from gpu_reliability.rollups import Rollups
 
 
 class StatsEncoder(JSONEncoder):
@@ -21,7 +30,7 @@ class StatsEncoder(JSONEncoder):
         return JSONEncoder.default(self, obj)
 
 
-@dataclass
+@dataclass(slots=True)
 class Stat:
     platform: PlatformType
     create_success: bool
@@ -31,6 +40,169 @@ class Stat:
     error: Optional[str] = None
     timestamp: datetime = field(default_factory=datetime.now)
     warnings: List[str] = field(default_factory=list)
+    # Seconds spent in each LaunchPhase, keyed by its value; only the phases the launch reached
+    phase_seconds: Dict[str, float] = field(default_factory=dict)
+
+
+# Platforms format API failures as `[Code: CODE]: message`
+ERROR_CODE_PATTERN = r"^\[Code: ([^\]]+)\]"
+
+
+def parse_error_code(error: Optional[str]) -> Optional[str]:
+    """
+    Reduce a recorded error to a stable code that launches can be grouped by. Errors that
+    weren't formatted by a platform, like crash messages, are truncated to their first line.
+
+    """
+    if not error:
+        return error
+    code = match(ERROR_CODE_PATTERN, error)
+    if code:
+        return code.group(1)
+    return error.splitlines()[0][:120]
+
+
+# Error code of the stat recorded for a launch that the harness dropped because the platform
+# was saturated. Never returned by a cloud provider.
+QUEUE_FULL_CODE = "HarnessQueueFull"
+
+# Error code of the stat recorded for a launch that was skipped because its target's circuit
+# breaker is open after running out of capacity
+CIRCUIT_OPEN_CODE = "HarnessCircuitOpen"
+
+# Codes of launches the harness gave up on without asking the cloud. They're recorded so gaps
+# in the samples stay visible, but say nothing about capacity, so aggregates count them apart
+# from launches and success rates.
+HARNESS_ERROR_CODES = frozenset({QUEUE_FULL_CODE, CIRCUIT_OPEN_CODE})
+
+
+def is_harness_error(error: Optional[str]) -> bool:
+    return parse_error_code(error) in HARNESS_ERROR_CODES
+
+
+def _encode_float(value: float) -> str:
+    # Mirrors the stdlib encoder, including its non-standard tokens for special values
+    if value != value:
+        return "NaN"
+    if value == float("inf"):
+        return "Infinity"
+    if value == -float("inf"):
+        return "-Infinity"
+    return float.__repr__(value)
+
+
+# Exact-type dispatch for the values that show up in a Stat; anything else falls back to the
+# stdlib encoder so the output is always identical to `dumps(asdict(stat), cls=StatsEncoder)`
+_VALUE_ENCODERS = {
+    str: encode_basestring_ascii,
+    bool: lambda value: "true" if value else "false",
+    int: int.__repr__,
+    float: _encode_float,
+    type(None): lambda _: "null",
+}
+
+
+def _encode_value(value) -> str:
+    encoder = _VALUE_ENCODERS.get(type(value))
+    if encoder is not None:
+        return encoder(value)
+    # The stdlib encodes str/int/float subclasses (including mixed-in enums) by their base type
+    if isinstance(value, str):
+        return encode_basestring_ascii(value)
+    if isinstance(value, int):
+        return int.__repr__(value)
+    if isinstance(value, float):
+        return _encode_float(value)
+    if isinstance(value, Enum):
+        return encode_basestring_ascii(value.name)
+    if isinstance(value, UUID):
+        return f'"{value}"'
+    if isinstance(value, datetime):
+        return f'"{value.isoformat()}"'
+    return dumps(value, cls=StatsEncoder)
+
+
+def encode_stat(stat: Stat) -> str:
+    """
+    Serialize a stat to its JSON line without building the intermediate dictionary that
+    `dataclasses.asdict` deep copies. Output is byte-compatible with the StatsEncoder path.
+
+    """
+    request = stat.request
+    if type(request) is not LaunchRequest:
+        return dumps(asdict(stat), cls=StatsEncoder)
+
+    return "".join(
+        [
+            '{"platform": ', _encode_value(stat.platform),
+            ', "create_success": ', _encode_value(stat.create_success),
+            ', "request": {"spot": ', _encode_value(request.spot),
+            ', "geography": ', _encode_value(request.geography),
+            ', "identifier": ', _encode_value(request.identifier),
+            ', "machine_type": ', _encode_value(request.machine_type),
+            ', "accelerator_type": ', _encode_value(request.accelerator_type),
+            ', "trigger_id": ', _encode_value(request.trigger_id),
+            '}, "create_seconds": ', _encode_value(stat.create_seconds),
+            ', "error": ', _encode_value(stat.error),
+            ', "timestamp": ', _encode_value(stat.timestamp),
+            ', "warnings": [', ", ".join([_encode_value(warning) for warning in stat.warnings]),
+            '], "phase_seconds": {',
+            ", ".join([f"{_encode_value(phase)}: {_encode_value(seconds)}" for phase, seconds in stat.phase_seconds.items()]),
+            "}}",
+        ]
+    )
+
+
+def decode_stat(payload: dict) -> Stat:
+    """
+    Rebuild a Stat from one parsed line of a stats file. Raises KeyError, TypeError or
+    ValueError for lines that don't describe a launch.
+
+    """
+    request = payload["request"]
+    return Stat(
+        platform=PlatformType[payload["platform"]],
+        create_success=payload["create_success"],
+        request=LaunchRequest(
+            spot=request["spot"],
+            geography=request["geography"],
+            identifier=UUID(request["identifier"]),
+            # Absent from stats that predate per-launch hardware and trigger ids
+            machine_type=request.get("machine_type"),
+            accelerator_type=request.get("accelerator_type"),
+            trigger_id=UUID(request["trigger_id"]) if request.get("trigger_id") else None,
+        ),
+        create_seconds=payload.get("create_seconds"),
+        error=payload.get("error"),
+        timestamp=datetime.fromisoformat(payload["timestamp"]),
+        warnings=payload.get("warnings", []),
+        # Absent from stats that predate per-phase timing
+        phase_seconds=payload.get("phase_seconds") or {},
+    )
+
+
+def read_stats(path: Union[str, Path]) -> Iterator[Stat]:
+    """
+    Iterate over the launches recorded in a stats jsonl file, skipping lines that don't
+    describe a launch.
+
+    """
+    with open(path) as file:
+        for line in file:
+            try:
+                yield decode_stat(loads(line))
+            except (JSONDecodeError, KeyError, TypeError, ValueError):
+                continue
+
+
+@unique
+class FsyncPolicy(Enum):
+    # Leave durability up to the OS page cache
+    NONE = "NONE"
+    # fsync after every batch that is written to disk
+    BATCH = "BATCH"
+    # fsync at most once every `fsync_interval` seconds
+    INTERVAL = "INTERVAL"
 
 
 class StatsLogger:
@@ -38,9 +210,14 @@ class StatsLogger:
     Log simple statistics about our launches in a jsonl file
 
     """
-    def __init__(self, path: Union[str, Path]):
+    def __init__(self, path: Union[str, Path], rollups: Optional["Rollups"] = None):
+        """
+        :param rollups: Time-bucketed aggregates to keep up to date as stats are written
+
+        """
         self.path = Path(path)
         self.lock = Lock()
+        self.rollups = rollups
 
         if not self.path.exists():
             self.path.touch()
@@ -48,4 +225,152 @@ class StatsLogger:
     def write(self, stat: Stat):
         with self.lock:
             with open(self.path, "a") as file:
-                file.write(dumps(asdict(stat), cls=StatsEncoder) + "\n")
+                file.write(self.encode(stat) + "\n")
+
+        if self.rollups is not None:
+            self.rollups.add(stat)
+            self.rollups.maybe_persist()
+
+    def encode(self, stat: Stat) -> str:
+        return encode_stat(stat)
+
+    def flush(self):
+        """
+        Block until all previously written stats are persisted to disk. Writes are
+        synchronous by default so only the rollups need to be written out.
+
+        """
+        if self.rollups is not None:
+            self.rollups.persist()
+
+    def close(self):
+        self.flush()
+
+
+@logger
+class BufferedStatsLogger(StatsLogger):
+    """
+    Group-commit variant of the StatsLogger. Callers only place stats on a queue; a
+    dedicated writer thread owns the file handle and writes records in batches, so
+    platform threads never block on disk IO or on each other.
+
+    """
+    def __init__(
+        self,
+        path: Union[str, Path],
+        max_batch_size: int = 256,
+        flush_interval: float = 1.0,
+        fsync_policy: FsyncPolicy = FsyncPolicy.BATCH,
+        fsync_interval: float = 30.0,
+        rollups: Optional["Rollups"] = None,
+    ):
+        """
+        :param max_batch_size: Write a batch as soon as this many stats are pending
+        :param flush_interval: Maximum seconds a stat sits in the queue before it's written
+        :param fsync_policy: When to force written batches to stable storage
+        :param fsync_interval: Minimum seconds between fsyncs under `FsyncPolicy.INTERVAL`
+
+        """
+        super().__init__(path, rollups=rollups)
+        self.max_batch_size = max_batch_size
+        self.flush_interval = flush_interval
+        self.fsync_policy = fsync_policy
+        self.fsync_interval = fsync_interval
+
+        self.queue: Queue = Queue()
+        self.closed = False
+
+        self.thread = Thread(target=self.do_work, name="stats-writer", daemon=True)
+        self.thread.start()
+
+    def write(self, stat: Stat):
+        if self.closed:
+            raise ValueError("Stats logger has already been closed")
+        self.queue.put(stat)
+
+    def flush(self):
+        if self.thread.is_alive():
+            flushed = Event()
+            self.queue.put(flushed)
+            flushed.wait()
+        super().flush()
+
+    def close(self):
+        if self.closed:
+            return
+        self.closed = True
+        # The writer drains everything queued ahead of the sentinel before it exits
+        self.queue.put(None)
+        self.thread.join()
+        super().flush()
+
+    def open_output(self):
+        """
+        Open the handle the writer thread keeps for its lifetime. Subclasses that store
+        stats in a different format override this along with `write_batch` and `sync_output`.
+
+        """
+        return open(self.path, "a")
+
+    def write_batch(self, output, batch: List[Stat]):
+        output.write("".join(self.encode(stat) + "\n" for stat in batch))
+        output.flush()
+
+    def sync_output(self, output):
+        fsync(output.fileno())
+
+    def do_work(self):
+        last_fsync = monotonic()
+
+        with self.open_output() as output:
+            while True:
+                batch: List[Stat] = []
+                # Events that are waiting on this batch to hit the disk
+                waiters: List[Event] = []
+                should_quit = False
+
+                deadline = None
+                while len(batch) < self.max_batch_size:
+                    timeout = None if deadline is None else max(deadline - monotonic(), 0)
+                    try:
+                        item = self.queue.get(timeout=timeout)
+                    except Empty:
+                        break
+
+                    if item is None:
+                        should_quit = True
+                        break
+                    if isinstance(item, Event):
+                        waiters.append(item)
+                        break
+
+                    batch.append(item)
+                    # Start the flush timer once the first record of the batch arrives
+                    if deadline is None:
+                        deadline = monotonic() + self.flush_interval
+
+                if batch:
+                    try:
+                        self.write_batch(output, batch)
+                        if self.rollups is not None:
+                            self.rollups.add_many(batch)
+                            self.rollups.maybe_persist()
+
+                        if self.fsync_policy == FsyncPolicy.BATCH or (
+                            self.fsync_policy == FsyncPolicy.INTERVAL
+                            and monotonic() - last_fsync >= self.fsync_interval
+                        ):
+                            self.sync_output(output)
+                            last_fsync = monotonic()
+                    except Exception:
+                        # Losing a batch is preferable to losing the writer thread, which would
+                        # stall every subsequent flush
+                        self.logger.exception(f"Unable to write {len(batch)} stats")
+
+                for waiter in waiters:
+                    waiter.set()
+
+                if should_quit:
+                    if self.fsync_policy != FsyncPolicy.NONE:
+                        self.sync_output(output)
+                    return
@@ -0,0 +1,155 @@
+from gpu_reliability.platforms.aws import AWSPlatform
+from gpu_reliability.platforms.aws_waiter import AWSInstanceCodes
+from gpu_reliability.stats_logger import StatsLogger
+from unittest.mock import patch, MagicMock
+from time import sleep, monotonic
+import pytest
+
+REGIONS = ["us-east-1", "us-west-2", "eu-west-1", "ap-south-1"]
+
+
+def describe_pages(instances, state=AWSInstanceCodes.RUNNING):
+    return [
+        {
+            "Reservations": [
+                {
+                    "Instances": [
+                        {
+                            "InstanceId": instance_id,
+                            "State": {"Code": state.value},
+                            "Tags": [{"Key": "Name", "Value": f"gpu-test-{instance_id}"}],
+                        }
+                        for instance_id in instances
+                    ]
+                }
+            ]
+        }
+    ]
+
+
+@pytest.fixture
+def clients():
+    clients = {region: MagicMock() for region in REGIONS}
+    for client in clients.values():
+        client.get_paginator.return_value.paginate.return_value = describe_pages([])
+    clients["us-east-1"].describe_regions.return_value = {
+        "Regions": [{"RegionName": region} for region in REGIONS],
+    }
+    return clients
+
+
+@pytest.fixture
+def platform(stats_path, clients):
+    with patch("gpu_reliability.platforms.aws.Session") as session_factory:
+        session = MagicMock()
+        session.client.side_effect = lambda _, region_name: clients[region_name]
+        session_factory.return_value = session
+
+        yield AWSPlatform(
+            access_key_id="",
+            secret_key="",
+            machine_type="g4dn.xlarge",
+            storage=StatsLogger(stats_path),
+            cleanup_concurrency=4,
+            cleanup_deadline=1,
+        )
+
+
+def slow_describe(seconds):
+    def paginate(**_):
+        sleep(seconds)
+        return describe_pages([])
+    return paginate
+
+
+def test_cleanup_regions_in_parallel(platform, clients):
+    for client in clients.values():
+        client.get_paginator.return_value.paginate.side_effect = slow_describe(0.5)
+
+    start = monotonic()
+    region_seconds = platform.cleanup_resources()
+
+    assert monotonic() - start < 0.5 * len(REGIONS)
+    assert sorted(region_seconds) == sorted(REGIONS)
+    assert all(seconds >= 0.5 for seconds in region_seconds.values())
+
+
+def test_cleanup_deadline(platform, clients):
+    clients["ap-south-1"].get_paginator.return_value.paginate.side_effect = slow_describe(2)
+
+    start = monotonic()
+    region_seconds = platform.cleanup_resources()
+
+    assert monotonic() - start < 1.5
+    assert sorted(region_seconds) == sorted(set(REGIONS) - {"ap-south-1"})
+
+
+def test_bulk_terminate(platform, clients):
+    client = clients["us-west-2"]
+    instance_ids = [f"i-{index}" for index in range(5)]
+    terminated_at = {}
+
+    def paginate(Filters):
+        if Filters[0]["Name"] == "tag:gpu-reliability-test":
+            return describe_pages([] if terminated_at else instance_ids)
+        # Each instance takes a little longer to terminate than the one before it
+        elapsed = monotonic() - terminated_at["start"]
+        return [
+            page
+            for instance_id in Filters[0]["Values"]
+            for page in describe_pages(
+                [instance_id],
+                AWSInstanceCodes.TERMINATED if elapsed > 0.1 * int(instance_id[2:]) else AWSInstanceCodes.SHUTTING_DOWN,
+            )
+        ]
+
+    def terminate_instances(InstanceIds):
+        terminated_at["start"] = monotonic()
+
+    client.get_paginator.return_value.paginate.side_effect = paginate
+    client.terminate_instances.side_effect = terminate_instances
+
+    start = monotonic()
+    platform.cleanup_region("us-west-2")
+
+    # Waits overlap, so the region takes as long as the slowest instance rather than the sum
+    assert monotonic() - start < 1.0
+    client.terminate_instances.assert_called_once_with(InstanceIds=instance_ids)
+
+
+def test_client_pool_reuses_clients(platform, clients):
+    for _ in range(3):
+        platform.clients.client("us-east-1")
+        platform.clients.resource("us-east-1")
+        platform.clients.regions()
+
+    # One client for the region, plus the resources built for this thread
+    assert platform.session.client.call_count == 1
+    assert platform.session.resource.call_count == 1
+    assert clients["us-east-1"].describe_regions.call_count == 1
+
+    platform.close()
+    clients["us-east-1"].close.assert_called()
+
+
+def test_cleanup_targets_launched_instances(platform, clients):
+    platform.instance_registry.swept()
+    platform.instance_registry.add("gpu-test-1", "us-west-2", "i-1")
+    platform.instance_registry.add("gpu-test-2", "us-west-2", "i-2")
+
+    client = clients["us-west-2"]
+    client.get_paginator.return_value.paginate.return_value = describe_pages(["i-1", "i-2"], AWSInstanceCodes.TERMINATED)
+
+    delete_seconds = platform.cleanup_resources()
+
+    assert sorted(delete_seconds) == ["i-1", "i-2"]
+    client.terminate_instances.assert_called_once_with(InstanceIds=["i-1", "i-2"])
+    # No region was searched for tagged instances
+    assert not clients["us-east-1"].terminate_instances.called
+    assert not clients["us-east-1"].get_paginator.return_value.paginate.called
+    assert len(platform.instance_registry) == 0
+
+    # Nothing left to clean up, so no more API calls
+    client.reset_mock()
+    assert platform.cleanup_resources() == {}
+    assert not client.method_calls
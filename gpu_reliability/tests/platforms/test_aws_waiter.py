@@ -0,0 +1,81 @@
+from gpu_reliability.platforms.aws_waiter import AWSInstanceCodes, InstanceStateWaiter
+from time import monotonic
+import pytest
+
+
+class StubPaginator:
+    def __init__(self, client):
+        self.client = client
+
+    def paginate(self, Filters):
+        self.client.calls.append(Filters[0]["Values"])
+        elapsed = monotonic() - self.client.start
+        instances = [
+            {
+                "InstanceId": instance_id,
+                "State": {"Code": (AWSInstanceCodes.RUNNING if elapsed >= ready_after else AWSInstanceCodes.PENDING).value},
+                "Tags": [{"Key": "Name", "Value": f"name-{instance_id}"}],
+            }
+            for instance_id, ready_after in self.client.ready_after.items()
+            if instance_id in Filters[0]["Values"]
+        ]
+        return [{"Reservations": [{"Instances": instances}]}]
+
+
+class StubClient:
+    def __init__(self, ready_after):
+        self.ready_after = ready_after
+        self.calls = []
+        self.start = monotonic()
+
+    def get_paginator(self, _):
+        return StubPaginator(self)
+
+
+def test_batched_waits():
+    client = StubClient({"i-1": 0.3, "i-2": 0.6, "i-3": 0.6})
+    waiter = InstanceStateWaiter(client, "us-east-1", min_interval=0.05, max_interval=0.1)
+
+    futures = {
+        instance_id: waiter.wait(instance_id, lambda code: code == AWSInstanceCodes.RUNNING, timeout=5)
+        for instance_id in client.ready_after
+    }
+    states = {instance_id: future.result() for instance_id, future in futures.items()}
+
+    assert all(state.code == AWSInstanceCodes.RUNNING for state in states.values())
+    assert states["i-1"].name == "name-i-1"
+
+    # Transitions are resolved to within a polling interval of when they happened
+    for instance_id, state in states.items():
+        assert state.transition_at - client.start == pytest.approx(client.ready_after[instance_id], abs=0.15)
+        assert state.transition_at <= state.observed_at
+
+    # Every poll covers all outstanding instances in one call
+    assert len(client.calls) < 30
+    assert sorted(client.calls[0]) == ["i-1", "i-2", "i-3"]
+    assert sorted(client.calls[-1]) == ["i-2", "i-3"]
+
+    # The polling thread exits once nothing is outstanding
+    assert waiter.thread is None
+
+
+def test_wait_timeout():
+    client = StubClient({"i-1": 60})
+    waiter = InstanceStateWaiter(client, "us-east-1", min_interval=0.05, max_interval=0.1)
+
+    future = waiter.wait("i-1", lambda code: code == AWSInstanceCodes.RUNNING, timeout=0.3)
+    with pytest.raises(TimeoutError):
+        future.result()
+
+
+def test_cancelled_wait():
+    client = StubClient({"i-1": 0.2, "i-2": 0.4})
+    waiter = InstanceStateWaiter(client, "us-east-1", min_interval=0.05, max_interval=0.1)
+
+    abandoned = waiter.wait("i-1", lambda code: code == AWSInstanceCodes.RUNNING, timeout=5)
+    assert abandoned.cancel()
+    future = waiter.wait("i-2", lambda code: code == AWSInstanceCodes.RUNNING, timeout=5)
+
+    # The poll thread survives the cancelled wait and keeps resolving the others
+    assert future.result(timeout=2).code == AWSInstanceCodes.RUNNING
+    assert waiter.wait("i-1", lambda code: code == AWSInstanceCodes.RUNNING, timeout=5).result(timeout=2)
@@ -1,6 +1,10 @@
-from gpu_reliability.platforms.base import PlatformBase
+from gpu_reliability.platforms.base import PlatformBase, LaunchSkipped
+from gpu_reliability.platforms.launch_queue import LaunchQueue, DropPolicy
+from gpu_reliability.stats_logger import read_stats, parse_error_code
+from gpu_reliability.ratelimit import CircuitBreaker
 from gpu_reliability.models import PlatformType, LaunchRequest
-from time import sleep
+from time import sleep, monotonic
+from threading import Event
 from gpu_reliability.stats_logger import StatsLogger, Stat
 from json import loads
 import pytest
@@ -15,18 +19,84 @@ class CrashingPlatform(PlatformBase):
     def platform_type(self) -> PlatformType:
         return PlatformType.GCP
 
-    def launch_instance(self, _):
+    def launch_instance(self, *_):
         raise FakeException("I crashed")
 
     def cleanup_resources(self):
         pass
 
+class SkippingPlatform(PlatformBase):
+    @property
+    def platform_type(self) -> PlatformType:
+        return PlatformType.GCP
+
+    def launch_instance(self, *_):
+        raise LaunchSkipped("Image lookup failed")
+
+    def cleanup_resources(self):
+        pass
+
+class RecordingPlatform(PlatformBase):
+    def __init__(self, storage):
+        super().__init__(storage)
+        self.launched = Event()
+        self.launched_at = None
+
+    @property
+    def platform_type(self) -> PlatformType:
+        return PlatformType.GCP
+
+    def launch_instance(self, *_):
+        self.launched_at = monotonic()
+        self.launched.set()
+
+    def cleanup_resources(self):
+        pass
+
+class BlockingPlatform(PlatformBase):
+    def __init__(self, storage, **kwargs):
+        super().__init__(storage, **kwargs)
+        self.release = Event()
+        self.started = []
+        self.cleanups = 0
+
+    @property
+    def platform_type(self) -> PlatformType:
+        return PlatformType.GCP
+
+    def launch_instance(self, request, spans):
+        self.started.append(request)
+        self.release.wait(5)
+
+    def cleanup_resources(self):
+        self.cleanups += 1
+
+class ExhaustedPlatform(PlatformBase):
+    CAPACITY_ERROR_CODES = {"ZONE_RESOURCE_POOL_EXHAUSTED"}
+
+    @property
+    def platform_type(self) -> PlatformType:
+        return PlatformType.GCP
+
+    def launch_instance(self, request, spans):
+        self.record(
+            Stat(
+                platform=self.platform_type,
+                request=request,
+                create_success=False,
+                error="[Code: ZONE_RESOURCE_POOL_EXHAUSTED]: Out of capacity",
+            )
+        )
+
+    def cleanup_resources(self):
+        pass
+
 class SuccessfulPlatform(PlatformBase):
     @property
     def platform_type(self) -> PlatformType:
         return PlatformType.GCP
 
-    def launch_instance(self, request):
+    def launch_instance(self, request, spans):
         sleep(WORK_TIME)
         self.storage.write(
             Stat(
@@ -50,7 +120,7 @@ def test_keepalive_threads(stats_path):
     successful = SuccessfulPlatform(logger)
 
     for platform in [crashing, successful]:
-        platform.set_should_launch(True)
+        platform.set_should_launch(LaunchRequest(spot=False, geography="test-zone"))
         platform.spawn()
 
     # Give them sufficient time to do work
@@ -68,3 +138,128 @@ def test_keepalive_threads(stats_path):
 
     # Cleanup the running resources
     successful.quit()
+
+
+def test_skipped_launch_not_recorded(stats_path):
+    platform = SkippingPlatform(StatsLogger(stats_path))
+    platform.set_should_launch(LaunchRequest(spot=False, geography="test-zone"))
+    platform.spawn()
+
+    sleep(0.5)
+    assert platform.is_spawned
+    assert stats_path.read_text() == ""
+
+    platform.quit()
+    platform.join()
+
+
+def test_trigger_wakes_worker(stats_path):
+    platform = RecordingPlatform(StatsLogger(stats_path))
+    platform.spawn()
+
+    # Let the worker go idle before triggering it
+    sleep(0.2)
+    triggered_at = monotonic()
+    platform.set_should_launch(LaunchRequest(spot=False, geography="test-zone"))
+
+    assert platform.launched.wait(1)
+    assert platform.launched_at - triggered_at < 0.05
+
+    start = monotonic()
+    platform.quit()
+    platform.join()
+    assert monotonic() - start < 0.05
+
+
+def test_concurrent_launches(stats_path):
+    platform = BlockingPlatform(StatsLogger(stats_path), max_concurrent_launches=2)
+    platform.spawn()
+
+    requests = [LaunchRequest(spot=False, geography=f"zone-{index}") for index in range(3)]
+    assert all(platform.set_should_launch(request) for request in requests)
+
+    # Two launches start right away and the third waits for a free slot
+    sleep(0.1)
+    assert platform.started == requests[:2]
+    assert len(platform.launch_queue) == 1
+    assert platform.cleanups == 0
+
+    platform.release.set()
+    sleep(0.1)
+    assert platform.started == requests
+    # Cleaned up as launches finish, whether or not others are still waiting
+    assert platform.cleanups >= 1
+
+    platform.quit()
+    platform.join()
+    assert platform.launch_queue.metrics.wait_seconds.count == 3
+
+
+def test_cleanup_runs_with_backlog(stats_path):
+    platform = BlockingPlatform(StatsLogger(stats_path), max_concurrent_launches=1, cleanup_interval=0.2)
+    platform.spawn()
+
+    for index in range(2):
+        platform.set_should_launch(LaunchRequest(spot=False, geography=f"zone-{index}"))
+
+    # The periodic cleanup isn't held back by the launch in flight or the one queued behind it
+    sleep(0.5)
+    assert len(platform.launch_queue) == 1
+    assert platform.cleanups >= 1
+
+    platform.release.set()
+    platform.quit()
+    platform.join()
+
+
+def test_rejected_launch_is_recorded(stats_path):
+    platform = BlockingPlatform(StatsLogger(stats_path), launch_queue=LaunchQueue(DropPolicy.REJECT))
+    platform.spawn()
+
+    first, second = [LaunchRequest(spot=False, geography="test-zone") for _ in range(2)]
+    assert platform.set_should_launch(first)
+    assert not platform.set_should_launch(second)
+
+    platform.release.set()
+    platform.quit()
+    platform.join()
+
+    stats = list(read_stats(stats_path))
+    assert len(stats) == 1
+    assert stats[0].request == second
+    assert parse_error_code(stats[0].error) == "HarnessQueueFull"
+
+
+def test_launches_limited_per_region(stats_path):
+    platform = BlockingPlatform(StatsLogger(stats_path), max_concurrent_launches=3, max_launches_per_region=1)
+    platform.spawn()
+
+    requests = [LaunchRequest(spot=False, geography=geography) for geography in ["zone-a", "zone-a", "zone-b"]]
+    for request in requests:
+        platform.set_should_launch(request)
+
+    # The second launch in `zone-a` waits even though a slot is free; `zone-b` doesn't
+    sleep(0.1)
+    assert platform.started == [requests[0], requests[2]]
+
+    platform.release.set()
+    sleep(0.1)
+    assert platform.started == [requests[0], requests[2], requests[1]]
+
+    platform.quit()
+    platform.join()
+
+
+def test_exhausted_target_is_paused(stats_path):
+    platform = ExhaustedPlatform(StatsLogger(stats_path), circuit_breaker=CircuitBreaker(failure_threshold=2))
+    exhausted = LaunchRequest(spot=False, geography="us-central1-b")
+
+    for _ in range(4):
+        platform.run_launch(exhausted)
+    platform.run_launch(LaunchRequest(spot=False, geography="europe-west4-a"))
+
+    # Launches stop once the breaker opens, and other zones are still probed
+    stats = list(read_stats(stats_path))
+    assert [stat.request.geography for stat in stats] == ["us-central1-b"] * 4 + ["europe-west4-a"]
+    # Paused launches are recorded with their own code rather than as capacity failures
+    assert [parse_error_code(stat.error) for stat in stats[2:4]] == ["HarnessCircuitOpen"] * 2
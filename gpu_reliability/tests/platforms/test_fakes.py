@@ -0,0 +1,113 @@
+from gpu_reliability.platforms.aws import AWSPlatform
+from gpu_reliability.platforms.gcp import GCPPlatform
+from gpu_reliability.platforms.fake_cloud import FakeCloudBehavior, LatencyDistribution
+from gpu_reliability.platforms.fake_ec2 import FakeEC2Session
+from gpu_reliability.platforms.fake_gce import fake_compute_clients
+from gpu_reliability.models import LaunchRequest
+from gpu_reliability.ratelimit import RateLimit
+from gpu_reliability.stats_logger import StatsLogger, read_stats, parse_error_code
+import pytest
+
+BEHAVIOR = FakeCloudBehavior(
+    create_latency=LatencyDistribution(0.05),
+    delete_latency=LatencyDistribution(0.05),
+    exhausted_geographies=frozenset({"ap-south-1", "asia-east1-a"}),
+    seed=42,
+)
+
+
+@pytest.fixture
+def aws(stats_path):
+    platform = AWSPlatform(
+        access_key_id="",
+        secret_key="",
+        machine_type="g4dn.xlarge",
+        storage=StatsLogger(stats_path),
+        session=FakeEC2Session(BEHAVIOR),
+    )
+    yield platform
+    platform.close()
+
+
+@pytest.fixture
+def gcp(stats_path):
+    platform = GCPPlatform(
+        project_id="fake-project",
+        service_account="",
+        machine_type="n1-standard-4",
+        accelerator_type="nvidia-tesla-t4",
+        storage=StatsLogger(stats_path),
+        compute_clients=fake_compute_clients(BEHAVIOR),
+    )
+    yield platform
+    platform.close()
+
+
+def test_fake_ec2_launch_and_cleanup(aws, stats_path):
+    for geography in ["us-east-1", "us-west-2", "ap-south-1"]:
+        aws.run_launch(LaunchRequest(spot=False, geography=geography))
+
+    stats = list(read_stats(stats_path))
+    assert [stat.create_success for stat in stats] == [True, True, False]
+    assert parse_error_code(stats[2].error) == "InsufficientInstanceCapacity"
+    # Timed from before the request, so it covers the whole simulated latency. The provisioning
+    # phase alone starts once the request returns and may see less of it.
+    assert all(stat.create_seconds >= 0.05 for stat in stats[:2])
+    assert "provisioning" not in stats[2].phase_seconds
+
+    assert len(aws.session.live_instances()) == 2
+    aws.cleanup_resources(full_sweep=True)
+    assert not aws.session.live_instances()
+
+
+def test_stale_instance_id_does_not_block_cleanup(aws):
+    aws.run_launch(LaunchRequest(spot=False, geography="us-east-1"))
+    aws.instance_registry.swept()
+    # Journaled by a previous run, and since deleted
+    aws.instance_registry.add("gpu-test-stale", "us-east-1", "i-0000000000000dead")
+
+    aws.cleanup_resources()
+    assert not aws.session.live_instances()
+    assert len(aws.instance_registry) == 0
+
+
+def test_fake_gce_launch_and_cleanup(gcp, stats_path):
+    gcp.run_launch(LaunchRequest(spot=False, geography="us-central1-b"))
+    gcp.run_launch(LaunchRequest(spot=False, geography="asia-east1-a"))
+
+    # One stat per launch, timed by phase
+    stats = list(read_stats(stats_path))
+    assert [stat.create_success for stat in stats] == [True, False]
+    assert parse_error_code(stats[1].error) == "ZONE_RESOURCE_POOL_EXHAUSTED"
+    assert stats[1].create_seconds is None
+    assert set(stats[0].phase_seconds) == {"image_lookup", "throttle", "submit", "provisioning", "status"}
+    assert set(stats[1].phase_seconds) == {"image_lookup", "throttle", "submit", "provisioning"}
+    assert stats[0].create_seconds >= 0.05
+
+    # Both launches waited on their operations until the fake finished them
+    compute = gcp.instance_client.compute
+    assert all(operation.done for operation in compute.operations.values())
+    assert len(compute.live_instances()) == 1
+    assert len(gcp.instance_registry) == 2
+
+    # The startup sweep only finds the instance that exists
+    gcp.cleanup_resources()
+    assert not compute.live_instances()
+    assert len(gcp.instance_registry) == 1
+
+    # The exhausted launch never created an instance, so its delete finds nothing
+    gcp.cleanup_resources()
+    assert len(gcp.instance_registry) == 0
+    assert compute.cloud.calls["aggregated_list"] == 1
+
+
+def test_fake_throttling():
+    session = FakeEC2Session(FakeCloudBehavior(throttle=RateLimit(rate=1, burst=2)))
+    client = session.client("ec2", region_name="us-east-1")
+
+    client.describe_regions()
+    client.describe_regions()
+    with pytest.raises(Exception, match="RequestLimitExceeded"):
+        client.describe_regions()
+    # Other regions have their own quota
+    session.client("ec2", region_name="us-west-2").describe_regions()
@@ -0,0 +1,105 @@
+from gpu_reliability.platforms.gcp import GCPPlatform
+from gpu_reliability.platforms.base import LaunchSkipped
+from gpu_reliability.platforms.spans import LaunchSpans
+from gpu_reliability.models import LaunchRequest
+from gpu_reliability.stats_logger import StatsLogger
+from unittest.mock import patch, MagicMock
+from types import SimpleNamespace
+from time import sleep, monotonic
+import pytest
+
+
+@pytest.fixture
+def platform(stats_path):
+    with patch("gpu_reliability.platforms.gcp.Credentials"), patch("gpu_reliability.platforms.gcp.compute_v1") as compute_v1:
+        yield GCPPlatform(
+            project_id="test-project",
+            service_account="{}",
+            machine_type="n1-standard-4",
+            accelerator_type="nvidia-tesla-t4",
+            storage=StatsLogger(stats_path),
+        )
+
+
+def test_image_lookup_is_cached(platform):
+    for _ in range(3):
+        platform.get_image()
+
+    platform.image_client.get_from_family.assert_called_once_with(project="debian-cloud", family="debian-11")
+
+
+def test_image_lookup_failure_skips_launch(platform):
+    platform.image_client.get_from_family.side_effect = ConnectionError("Unavailable")
+
+    with pytest.raises(LaunchSkipped):
+        platform.launch_instance(LaunchRequest(spot=False, geography="us-central1-b"), LaunchSpans())
+
+    platform.instance_client.insert.assert_not_called()
+
+
+def test_parallel_cleanup(platform):
+    def zone_results(zone, statuses):
+        return (
+            f"zones/{zone}",
+            SimpleNamespace(
+                warning=None,
+                instances=[
+                    SimpleNamespace(name=f"gpu-test-{zone}-{index}", status=status)
+                    for index, status in enumerate(statuses)
+                ],
+            ),
+        )
+
+    platform.instance_client.aggregated_list.return_value = [
+        zone_results("us-central1-b", ["RUNNING", "RUNNING", "STOPPING"]),
+        zone_results("europe-west4-a", ["RUNNING", "PROVISIONING"]),
+        ("zones/asia-east1-a", SimpleNamespace(warning="No results", instances=[])),
+    ]
+
+    def delete(project, zone, instance):
+        operation = MagicMock()
+        operation.result.side_effect = lambda timeout: sleep(0.3)
+        return operation
+
+    platform.instance_client.delete.side_effect = delete
+
+    start = monotonic()
+    delete_seconds = platform.cleanup_resources()
+
+    assert monotonic() - start < 0.6
+    assert sorted(delete_seconds) == [
+        "gpu-test-europe-west4-a-0",
+        "gpu-test-us-central1-b-0",
+        "gpu-test-us-central1-b-1",
+    ]
+    assert all(seconds >= 0.3 for seconds in delete_seconds.values())
+
+
+def test_cleanup_targets_launched_instances(platform):
+    platform.instance_registry.swept()
+    platform.instance_registry.add("gpu-test-1", "us-central1-b")
+
+    delete_seconds = platform.cleanup_resources()
+
+    assert list(delete_seconds) == ["gpu-test-1"]
+    platform.instance_client.delete.assert_called_once_with(project="test-project", zone="us-central1-b", instance="gpu-test-1")
+    platform.instance_client.aggregated_list.assert_not_called()
+    assert len(platform.instance_registry) == 0
+
+    # Sweeps still run once they are due
+    platform.instance_client.aggregated_list.return_value = []
+    platform.cleanup_resources(full_sweep=True)
+    platform.instance_client.aggregated_list.assert_called_once()
+
+
+def test_cleanup_skips_launches_in_flight(platform):
+    request = LaunchRequest(spot=False, geography="us-central1-b")
+    platform.instance_registry.swept()
+    platform.instance_registry.add("gpu-test-1", "us-central1-b", launch=request.identifier)
+
+    assert platform.cleanup_resources() == {}
+    platform.instance_client.delete.assert_not_called()
+
+    # Handed over to cleanup once its launch has recorded its outcome
+    platform.instance_registry.landed(request.identifier)
+    assert list(platform.cleanup_resources()) == ["gpu-test-1"]
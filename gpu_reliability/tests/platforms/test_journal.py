@@ -0,0 +1,45 @@
+from gpu_reliability.platforms.journal import InstanceJournal
+from gpu_reliability.platforms.registry import InstanceRegistry
+
+
+def test_replay_after_crash(output_dir):
+    path = output_dir / "stats.jsonl.instances.jsonl"
+
+    journal = InstanceJournal(path)
+    registry = InstanceRegistry(60, journal, owner="AWS")
+    # A fresh journal knows nothing about earlier runs, so the first cleanup still sweeps
+    assert registry.sweep_due()
+
+    registry.add("gpu-test-1", "us-east-1")
+    registry.resolve("gpu-test-1", "i-1")
+    registry.add("gpu-test-2", "us-east-1")
+    registry.add("gpu-test-3", "us-west-2", "i-3")
+    registry.remove("gpu-test-3")
+    InstanceRegistry(60, journal, owner="GCP").add("gpu-test-4", "us-central1-b")
+
+    # Simulate the process dying halfway through an append
+    with open(path, "a") as file:
+        file.write('{"event": "LAUNCHED", "platf')
+
+    recovered = InstanceRegistry(60, InstanceJournal(path), owner="AWS")
+    assert {instance.name: instance.instance_id for instance in recovered.snapshot()} == {
+        "gpu-test-1": "i-1",
+        "gpu-test-2": None,
+    }
+    # Recovered instances add to the startup sweep rather than replace it
+    assert recovered.sweep_due()
+
+
+def test_compaction(output_dir):
+    path = output_dir / "instances.jsonl"
+    journal = InstanceJournal(path, compact_after=10)
+    registry = InstanceRegistry(60, journal, owner="GCP")
+
+    registry.add("gpu-test-live", "us-central1-b")
+    for index in range(20):
+        registry.add(f"gpu-test-{index}", "us-central1-b")
+        registry.remove(f"gpu-test-{index}")
+
+    assert len(path.read_text().splitlines()) < 10
+    journal.close()
+    assert [entry.name for entry in InstanceJournal(path).recovered("GCP")] == ["gpu-test-live"]
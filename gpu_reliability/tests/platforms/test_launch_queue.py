@@ -0,0 +1,55 @@
+from gpu_reliability.platforms.launch_queue import LaunchQueue, DropPolicy
+from gpu_reliability.models import LaunchRequest
+
+
+def make_requests(count):
+    return [LaunchRequest(spot=False, geography=f"zone-{index}") for index in range(count)]
+
+
+def test_queue_policy_rejects_when_full():
+    queue = LaunchQueue(DropPolicy.QUEUE, max_size=2)
+    first, second, third = make_requests(3)
+
+    assert queue.put(first, has_capacity=False) == (True, None)
+    assert queue.put(second, has_capacity=False) == (True, None)
+    assert queue.put(third, has_capacity=False) == (False, None)
+
+    assert queue.pop().request == first
+    assert queue.metrics.rejected == 1
+    assert queue.metrics.max_depth == 2
+    assert queue.metrics.wait_seconds.count == 1
+
+
+def test_coalesce_policy_keeps_newest_per_target():
+    queue = LaunchQueue(DropPolicy.COALESCE)
+    first, other_zone = make_requests(2)
+    second = LaunchRequest(spot=False, geography=first.geography)
+
+    queue.put(first, has_capacity=False)
+    assert queue.put(other_zone, has_capacity=False) == (True, None)
+    assert queue.put(second, has_capacity=False) == (True, first)
+
+    assert len(queue) == 2
+    assert queue.pop().request == other_zone
+    assert queue.pop().request == second
+    assert queue.metrics.coalesced == 1
+
+
+def test_pop_skips_ineligible_requests():
+    queue = LaunchQueue()
+    first, second = make_requests(2)
+    queue.put(first, has_capacity=False)
+    queue.put(second, has_capacity=False)
+
+    assert queue.pop(lambda request: request.geography == "zone-1").request == second
+    assert queue.pop(lambda request: request.geography == "zone-1") is None
+    assert len(queue) == 1
+
+
+def test_reject_policy_only_accepts_with_capacity():
+    queue = LaunchQueue(DropPolicy.REJECT)
+    first, second = make_requests(2)
+
+    assert queue.put(first, has_capacity=True) == (True, None)
+    assert queue.put(second, has_capacity=False) == (False, None)
+    assert queue.metrics.rejected == 1
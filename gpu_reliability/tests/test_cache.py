@@ -0,0 +1,84 @@
+from gpu_reliability.cache import ExpiringCache
+from threading import Thread
+from time import sleep
+from unittest.mock import patch
+import pytest
+
+
+def test_expiring_cache():
+    loads = []
+
+    def loader(key):
+        loads.append(key)
+        return f"value-{key}"
+
+    with patch("gpu_reliability.cache.monotonic") as mock_monotonic:
+        mock_monotonic.return_value = 0
+        cache = ExpiringCache(loader, ttl=10)
+
+        assert cache.get("a") == "value-a"
+        assert cache.get("a") == "value-a"
+        assert cache.get("b") == "value-b"
+        assert loads == ["a", "b"]
+
+        mock_monotonic.return_value = 11
+        assert cache.get("a") == "value-a"
+        assert loads == ["a", "b", "a"]
+
+        cache.invalidate("a")
+        cache.get("a")
+        assert loads == ["a", "b", "a", "a"]
+
+
+def test_concurrent_misses_share_load():
+    loads = []
+
+    def loader(key):
+        loads.append(key)
+        sleep(0.1)
+        return key
+
+    cache = ExpiringCache(loader, ttl=60)
+    threads = [Thread(target=cache.get, args=("a",)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert loads == ["a"]
+
+
+def test_background_refresh():
+    values = iter(["first", "second"])
+
+    with patch("gpu_reliability.cache.monotonic") as mock_monotonic:
+        mock_monotonic.return_value = 0
+        cache = ExpiringCache(lambda _: next(values), ttl=100, refresh_after=10)
+        assert cache.get("a") == "first"
+
+        # Past the refresh age the cached value is served while the reload happens
+        mock_monotonic.return_value = 20
+        assert cache.get("a") == "first"
+        for _ in range(100):
+            if cache.values["a"][0] == "second":
+                break
+            sleep(0.01)
+        assert cache.get("a") == "second"
+
+
+def test_serve_stale_on_failure():
+    def failing_loader(_):
+        raise ConnectionError("Unavailable")
+
+    with patch("gpu_reliability.cache.monotonic") as mock_monotonic:
+        mock_monotonic.return_value = 0
+        cache = ExpiringCache(lambda _: "cached", ttl=10, max_stale=50)
+        assert cache.get("a") == "cached"
+
+        cache.loader = failing_loader
+        mock_monotonic.return_value = 30
+        assert cache.get("a") == "cached"
+
+        mock_monotonic.return_value = 70
+        with pytest.raises(ConnectionError):
+            cache.get("a")
@@ -1,27 +1,40 @@
-from random import seed
-from gpu_reliability.cli import sample_timing
-from unittest.mock import patch
-import pytest
-
-# Don't actually sleep the runtime
-@patch("gpu_reliability.cli.sleep")
-@pytest.mark.parametrize(
-    "samples,sleep_interval,total_time",
-    [
-        # 10x a minute example
-        (10, 2, 60),
-        # 48x a day
-        (48, 60, 60*60*24),
-    ]
-)
-def test_sample_timing(mock_sleep, samples, sleep_interval, total_time):
-    seed(42)
-
-    coinflips = []
-
-    # This is the amount of times we'll actually run the timing function
-    for _ in range(int(total_time / sleep_interval)):
-        with sample_timing(samples=samples, sleep_interval_seconds=sleep_interval, total_time_seconds=total_time) as flip:
-            coinflips.append(flip)
-
-    assert sum(coinflips) == pytest.approx(samples, abs=3)
+from gpu_reliability.cli import cli
+from gpu_reliability.models import PlatformType
+from gpu_reliability.platforms.backends import load_platform
+from click.testing import CliRunner
+from subprocess import run
+from sys import executable
+
+
+def test_cli_doesnt_import_cloud_sdks():
+    # Run in a fresh interpreter, since the tests themselves import every platform
+    modules = run(
+        [
+            executable,
+            "-c",
+            "import sys, gpu_reliability.cli; print(' '.join(sorted(sys.modules)))",
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout.split()
+
+    assert not [module for module in modules if module.startswith(("boto3", "botocore", "google.cloud", "grpc"))]
+    assert "gpu_reliability.platforms.aws" not in modules
+
+
+def test_load_platform():
+    for platform_type in PlatformType:
+        assert load_platform(platform_type).__name__ == f"{platform_type.value}Platform"
+
+
+def test_only_selected_settings_are_required(monkeypatch, tmp_path):
+    for name in ["AWS_ACCESS_KEY_ID", "AWS_ACCESS_SECRET_KEY", "GCP_PROJECT", "GCP_SERVICE_ACCOUNT_BASE64"]:
+        monkeypatch.delenv(f"BENCHMARK__{name}", raising=False)
+    monkeypatch.setenv("BENCHMARK__AWS_ACCESS_KEY_ID", "key")
+    monkeypatch.setenv("BENCHMARK__AWS_ACCESS_SECRET_KEY", "secret")
+
+    result = CliRunner().invoke(cli, ["run", "--platforms", "gcp", "--output-path", str(tmp_path / "stats.jsonl")])
+    assert result.exit_code != 0
+    assert "gcp_project" in result.output
+    assert "aws_access_key_id" not in result.output
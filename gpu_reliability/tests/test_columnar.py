@@ -0,0 +1,161 @@
+from gpu_reliability.columnar import (
+    ColumnarStatsLogger,
+    ColumnarStatsReader,
+    ColumnarStatsWriter,
+    PHASE_COLUMNS,
+    PLATFORM_CODES,
+    column_path,
+    convert_jsonl,
+)
+from gpu_reliability.stats_logger import StatsLogger, Stat
+from gpu_reliability.models import LaunchPhase, PlatformType, LaunchRequest
+from json import dumps
+from uuid import uuid4
+import numpy as np
+import pytest
+
+
+def make_stats():
+    return [
+        Stat(
+            platform=PlatformType.GCP,
+            request=LaunchRequest(spot=False, geography="us-central1-b"),
+            create_success=True,
+            create_seconds=31.5,
+        ),
+        Stat(
+            platform=PlatformType.AWS,
+            request=LaunchRequest(spot=True, geography="us-east-1"),
+            create_success=False,
+            error="[Code: InsufficientInstanceCapacity]: No capacity",
+            warnings=["first warning", "second warning"],
+        ),
+        Stat(
+            platform=PlatformType.GCP,
+            request=LaunchRequest(
+                spot=True,
+                geography="us-central1-b",
+                machine_type="n1-standard-4",
+                accelerator_type="nvidia-tesla-t4",
+                trigger_id=uuid4(),
+            ),
+            create_success=False,
+            create_seconds=4.0,
+            error="[Code: InsufficientInstanceCapacity]: No capacity",
+            warnings=["first warning"],
+            phase_seconds={"image_lookup": 0.5, "submit": 1.0, "provisioning": 3.0},
+        ),
+    ]
+
+
+def test_roundtrip(output_dir):
+    store_path = output_dir / "store"
+    stats = make_stats()
+
+    stats_logger = ColumnarStatsLogger(store_path)
+    for stat in stats:
+        stats_logger.write(stat)
+    stats_logger.close()
+
+    reader = ColumnarStatsReader(store_path)
+    assert len(reader) == 3
+    assert [reader.stat(row) for row in range(len(reader))] == stats
+
+    # Columns are views on the mapped files rather than copies
+    assert isinstance(reader.create_success.base, np.memmap)
+    assert reader.create_success.tolist() == [True, False, False]
+    assert reader.platform.tolist() == [PLATFORM_CODES[PlatformType.GCP], PLATFORM_CODES[PlatformType.AWS], PLATFORM_CODES[PlatformType.GCP]]
+    assert np.isnan(reader.create_seconds[1])
+    assert reader.timestamp.dtype == np.dtype("datetime64[us]")
+
+    zone_mask = reader.geography == reader.string_id("us-central1-b")
+    assert zone_mask.sum() == 2
+    assert (reader.geography == reader.string_id("unknown-zone")).sum() == 0
+
+
+def test_append_after_reopen(output_dir):
+    store_path = output_dir / "store"
+    stats = make_stats()
+
+    with ColumnarStatsWriter(store_path) as writer:
+        writer.append_many(stats[:2])
+    with ColumnarStatsWriter(store_path) as writer:
+        writer.append(stats[2])
+
+    reader = ColumnarStatsReader(store_path)
+    assert [reader.stat(row) for row in range(len(reader))] == stats
+    # Strings are deduplicated across sessions
+    assert len(reader.strings) == 7
+
+
+def test_repair_torn_write(output_dir):
+    store_path = output_dir / "store"
+    stats = make_stats()
+
+    with ColumnarStatsWriter(store_path) as writer:
+        writer.append_many(stats)
+
+    # Simulate a crash that only persisted part of the final row
+    with open(column_path(store_path, "create_seconds"), "r+b") as file:
+        file.truncate(2 * 8 + 3)
+
+    assert len(ColumnarStatsReader(store_path)) == 2
+
+    with ColumnarStatsWriter(store_path) as writer:
+        writer.append(stats[2])
+
+    reader = ColumnarStatsReader(store_path)
+    assert [reader.stat(row) for row in range(len(reader))] == stats
+
+
+def test_failed_batch_leaves_counters(output_dir):
+    store_path = output_dir / "store"
+    stats = make_stats()
+    # Packs its warnings before failing on the missing request
+    broken = Stat(platform=PlatformType.AWS, create_success=False, request=None, warnings=["lost warning"])
+
+    with ColumnarStatsWriter(store_path) as writer:
+        writer.append(stats[0])
+        with pytest.raises(AttributeError):
+            writer.append_many([stats[1], broken])
+        writer.append_many(stats[1:])
+
+    reader = ColumnarStatsReader(store_path)
+    assert [reader.stat(row) for row in range(len(reader))] == stats
+
+
+def test_backfill_added_columns(output_dir):
+    store_path = output_dir / "store"
+    stats = make_stats()
+
+    with ColumnarStatsWriter(store_path) as writer:
+        writer.append_many(stats[:2])
+    # Store written before the hardware, trigger and phase columns existed
+    for name in ["machine_type", "accelerator_type", "trigger_id", *PHASE_COLUMNS.values()]:
+        column_path(store_path, name).unlink()
+
+    assert [ColumnarStatsReader(store_path).stat(row) for row in range(2)] == stats[:2]
+
+    with ColumnarStatsWriter(store_path) as writer:
+        writer.append(stats[2])
+
+    reader = ColumnarStatsReader(store_path)
+    assert [reader.stat(row) for row in range(len(reader))] == stats
+    assert reader.machine_type.tolist() == [-1, -1, reader.string_id("n1-standard-4")]
+    assert np.isnan(reader.phase_seconds(LaunchPhase.SUBMIT)[:2]).all()
+
+
+def test_convert_jsonl(output_dir, stats_path):
+    stats = make_stats()
+
+    with open(stats_path, "w") as file:
+        file.write(dumps({"test": True}) + "\n")
+    stats_logger = StatsLogger(stats_path)
+    for stat in stats:
+        stats_logger.write(stat)
+
+    converted, skipped = convert_jsonl(stats_path, output_dir / "store")
+    assert (converted, skipped) == (3, 1)
+
+    reader = ColumnarStatsReader(output_dir / "store")
+    assert [reader.stat(row) for row in range(len(reader))] == stats
@@ -0,0 +1,89 @@
+from gpu_reliability.engine import ProbeEngine
+from gpu_reliability.platforms.base import PlatformBase
+from gpu_reliability.models import PlatformType, LaunchRequest
+from gpu_reliability.stats_logger import StatsLogger, Stat, read_stats
+from time import sleep, monotonic
+import pytest
+
+
+class SleepingPlatform(PlatformBase):
+    def __init__(self, storage, launch_seconds, **kwargs):
+        super().__init__(storage, **kwargs)
+        self.launch_seconds = launch_seconds
+        self.cleanups = 0
+
+    @property
+    def platform_type(self) -> PlatformType:
+        return PlatformType.AWS
+
+    def launch_instance(self, request, spans):
+        sleep(self.launch_seconds)
+        self.storage.write(
+            Stat(
+                platform=self.platform_type,
+                request=request,
+                create_success=True,
+            )
+        )
+
+    def cleanup_resources(self):
+        self.cleanups += 1
+
+
+class CrashingPlatform(SleepingPlatform):
+    def launch_instance(self, request, spans):
+        raise ValueError("I crashed")
+
+
+@pytest.fixture
+def storage(stats_path):
+    return StatsLogger(stats_path)
+
+
+def wait_until(condition, timeout=5):
+    deadline = monotonic() + timeout
+    while not condition() and monotonic() < deadline:
+        sleep(0.01)
+    return condition()
+
+
+def test_probes_many_platforms(storage, stats_path):
+    platforms = [SleepingPlatform(storage, launch_seconds=0.3) for _ in range(50)]
+    engine = ProbeEngine(platforms, max_workers=64)
+
+    start = monotonic()
+    for platform in platforms:
+        assert engine.submit(platform, LaunchRequest(spot=False, geography="us-east-1")).result()
+
+    assert wait_until(lambda: all(platform.cleanups == 1 for platform in platforms))
+    assert monotonic() - start < 2
+    assert len(list(read_stats(stats_path))) == 50
+
+    engine.close()
+
+
+def test_crash_frees_the_slot_and_timeout_keeps_it(storage, stats_path):
+    crashing = CrashingPlatform(storage, launch_seconds=0)
+    slow = SleepingPlatform(storage, launch_seconds=1, max_concurrent_launches=1)
+    engine = ProbeEngine([crashing, slow], probe_timeout=0.2)
+
+    for platform in [crashing, crashing, slow, slow]:
+        engine.submit(platform, LaunchRequest(spot=False, geography="us-east-1"))
+    assert wait_until(lambda: crashing.launch_queue.metrics.started == 2)
+
+    # A timed out launch keeps its slot until the blocking call returns, and isn't cleaned up
+    # from under it
+    sleep(0.5)
+    assert slow.launch_queue.metrics.started == 1
+    assert slow.launch_slots.total == 1
+    assert slow.cleanups == 0
+    assert wait_until(lambda: slow.launch_queue.metrics.started == 2)
+    assert wait_until(lambda: not slow.launch_slots.total)
+
+    engine.close(timeout=2)
+    stats = list(read_stats(stats_path))
+    assert [stat.error for stat in stats].count("I crashed") == 2
+    assert len(stats) == 4
+
+    with pytest.raises(ValueError):
+        engine.submit(slow, LaunchRequest(spot=False, geography="us-east-1"))
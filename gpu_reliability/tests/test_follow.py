@@ -0,0 +1,111 @@
+from gpu_reliability.follow import FileFollower, RollingAvailability, StatsFollower, find_offset
+from gpu_reliability.stats_logger import Stat, encode_stat
+from gpu_reliability.models import PlatformType, LaunchRequest
+from datetime import datetime, timedelta
+from os import rename
+
+
+def make_stat(timestamp, success=True, geography="us-east-1"):
+    return Stat(
+        platform=PlatformType.AWS,
+        request=LaunchRequest(spot=False, geography=geography),
+        create_success=success,
+        create_seconds=30.0 if success else None,
+        error=None if success else "[Code: InsufficientInstanceCapacity]: No capacity",
+        timestamp=timestamp,
+    )
+
+
+def test_file_follower_appends(stats_path):
+    follower = FileFollower(stats_path)
+    assert follower.poll() == []
+
+    with open(stats_path, "wb") as file:
+        file.write(b"first\nsec")
+        file.flush()
+        assert follower.poll() == [b"first"]
+        assert follower.offset == len(b"first\n")
+
+        file.write(b"ond\n")
+        file.flush()
+        assert follower.poll() == [b"second"]
+        assert follower.poll() == []
+
+    # Truncated and rewritten shorter than what was already read
+    with open(stats_path, "wb") as file:
+        file.write(b"new\n")
+    assert follower.poll() == [b"new"]
+
+    # Rotated: the rest of the old file comes first
+    with open(stats_path, "ab") as file:
+        file.write(b"last\n")
+    rename(stats_path, stats_path.with_suffix(".1"))
+    with open(stats_path, "wb") as file:
+        file.write(b"rotated\n")
+    assert follower.poll() == [b"last", b"rotated"]
+    assert follower.offset == len(b"rotated\n")
+    follower.close()
+
+
+def test_rolling_windows():
+    now = datetime(2022, 8, 8, 12)
+    availability = RollingAvailability()
+    availability.add(make_stat(now - timedelta(days=3), success=False))
+    availability.add(make_stat(now - timedelta(hours=3)))
+    availability.add(make_stat(now - timedelta(minutes=5)))
+    availability.add(make_stat(now - timedelta(minutes=1), success=False, geography="us-west-2"))
+
+    windows = availability.summaries(now)
+    assert list(windows) == [("AWS", "us-east-1"), ("AWS", "us-west-2")]
+
+    east = windows[("AWS", "us-east-1")]
+    assert (east["hour"].launches, east["hour"].successes) == (1, 1)
+    assert (east["day"].launches, east["day"].successes) == (2, 2)
+    assert (east["week"].launches, east["week"].successes) == (3, 2)
+    assert east["week"].latency.count == 2
+    assert windows[("AWS", "us-west-2")]["hour"].success_rate == 0.0
+
+    # A week later every launch has aged out
+    later = availability.summaries(now + timedelta(days=7))[("AWS", "us-east-1")]
+    assert later["hour"].launches == later["day"].launches == 0
+    assert later["week"].launches == 0
+
+    # A launch older than what its slot now holds is dropped rather than mixed in
+    availability.add(make_stat(now + timedelta(days=7, minutes=-1)))
+    availability.add(make_stat(now + timedelta(days=7, minutes=-61)))
+    later = availability.summaries(now + timedelta(days=7))[("AWS", "us-east-1")]
+    assert (later["hour"].launches, later["day"].launches) == (1, 2)
+
+
+def test_stats_follower_history(stats_path):
+    now = datetime.now()
+    with open(stats_path, "w") as file:
+        file.write("not json\n")
+        for minutes in range(14 * 24 * 60 - 5, 0, -10):
+            file.write(encode_stat(make_stat(now - timedelta(minutes=minutes))) + "\n")
+
+    offset = find_offset(stats_path, now - timedelta(days=7))
+    with open(stats_path, "rb") as file:
+        file.seek(offset)
+        lines = file.read().splitlines()
+    assert len(lines) == 7 * 24 * 6
+
+    follower = StatsFollower(stats_path)
+    assert follower.poll() == 7 * 24 * 6
+    assert follower.skipped == 0
+
+    with open(stats_path, "a") as file:
+        file.write(encode_stat(make_stat(now, success=False)) + "\n")
+        file.write("{}\n")
+    assert follower.poll() == 1
+    assert follower.skipped == 1
+
+    hour = follower.availability.summaries()[("AWS", "us-east-1")]["hour"]
+    assert hour.launches in (6, 7)
+    assert hour.launches - hour.successes == 1
+    follower.close()
+
+    # Without history, only launches written from now on are read
+    follower = StatsFollower(stats_path, history=False)
+    assert follower.poll() == 0
+    follower.close()
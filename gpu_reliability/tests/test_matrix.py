@@ -0,0 +1,44 @@
+from gpu_reliability.matrix import ProbeMatrix, ProbeTarget, expand_targets
+from gpu_reliability.models import PlatformType
+
+
+def make_matrix():
+    return ProbeMatrix(
+        expand_targets(
+            PlatformType.GCP,
+            ["us-central1-b", "europe-west4-a"],
+            ["n1-standard-4"],
+            ["nvidia-tesla-t4", "nvidia-tesla-v100"],
+        )
+        + expand_targets(PlatformType.AWS, ["us-east-1", "us-west-2"], ["g4dn.xlarge"])
+    )
+
+
+def test_expand_targets():
+    targets = expand_targets(PlatformType.AWS, ["us-east-1", "us-west-2"], ["g4dn.xlarge", "p3.2xlarge"], spot=[False, True])
+
+    assert len(targets) == 8
+    assert len(set(targets)) == 8
+    assert ProbeTarget(PlatformType.AWS, "us-west-2", "p3.2xlarge", spot=True) in targets
+
+
+def test_fan_out_shares_trigger():
+    requests = make_matrix().fan_out()
+
+    assert len(requests[PlatformType.GCP]) == 4
+    assert len(requests[PlatformType.AWS]) == 2
+
+    all_requests = requests[PlatformType.GCP] + requests[PlatformType.AWS]
+    assert len({request.trigger_id for request in all_requests}) == 1
+    assert len({request.identifier for request in all_requests}) == 6
+    assert {request.accelerator_type for request in requests[PlatformType.GCP]} == {"nvidia-tesla-t4", "nvidia-tesla-v100"}
+
+
+def test_sample_one_per_platform():
+    requests = make_matrix().sample()
+
+    assert {platform_type: len(platform_requests) for platform_type, platform_requests in requests.items()} == {
+        PlatformType.GCP: 1,
+        PlatformType.AWS: 1,
+    }
+    assert requests[PlatformType.GCP][0].trigger_id == requests[PlatformType.AWS][0].trigger_id
@@ -0,0 +1,112 @@
+from gpu_reliability.metrics import MetricsRegistry, MetricsServer, PlatformMetrics
+from gpu_reliability.models import LaunchRequest, PlatformType
+from gpu_reliability.platforms.aws import AWSPlatform
+from gpu_reliability.platforms.base import PlatformBase
+from gpu_reliability.platforms.fake_cloud import FakeCloudBehavior, LatencyDistribution
+from gpu_reliability.platforms.fake_ec2 import FakeEC2Session
+from gpu_reliability.stats_logger import StatsLogger
+from urllib.error import HTTPError
+from urllib.request import urlopen
+import pytest
+
+
+def test_render_text_format():
+    registry = MetricsRegistry()
+    launches = registry.counter("launches_total", "Launches", ["platform", "outcome"])
+    latency = registry.histogram("create_seconds", "Create latency", ["platform"], buckets=[1, 10])
+
+    launches.inc(platform="AWS", outcome="success")
+    launches.inc(2, platform="AWS", outcome="success")
+    latency.observe(0.5, platform="GCP")
+    latency.observe(5, platform="GCP")
+    latency.observe(50, platform="GCP")
+
+    assert registry.render() == (
+        "# HELP launches_total Launches\n"
+        "# TYPE launches_total counter\n"
+        'launches_total{platform="AWS",outcome="success"} 3.0\n'
+        "# HELP create_seconds Create latency\n"
+        "# TYPE create_seconds histogram\n"
+        'create_seconds_bucket{platform="GCP",le="1.0"} 1\n'
+        'create_seconds_bucket{platform="GCP",le="10.0"} 2\n'
+        'create_seconds_bucket{platform="GCP",le="+Inf"} 3\n'
+        'create_seconds_sum{platform="GCP"} 55.5\n'
+        'create_seconds_count{platform="GCP"} 3\n'
+    )
+
+    with pytest.raises(ValueError):
+        launches.inc(platform="AWS")
+    with pytest.raises(ValueError):
+        registry.gauge("launches_total", "Launches", ["platform", "outcome"])
+
+
+def test_platform_metrics(stats_path):
+    metrics = PlatformMetrics()
+    platform = AWSPlatform(
+        access_key_id="",
+        secret_key="",
+        machine_type="g4dn.xlarge",
+        storage=StatsLogger(stats_path),
+        session=FakeEC2Session(
+            FakeCloudBehavior(
+                create_latency=LatencyDistribution(0.01),
+                delete_latency=LatencyDistribution(0.01),
+                exhausted_geographies=frozenset({"ap-south-1"}),
+            )
+        ),
+        metrics=metrics,
+    )
+
+    platform.run_launch(LaunchRequest(spot=False, geography="us-east-1"))
+    platform.run_launch(LaunchRequest(spot=False, geography="ap-south-1"))
+    assert metrics.launches.value(platform="AWS", geography="us-east-1", outcome="success") == 1
+    assert metrics.launches.value(platform="AWS", geography="ap-south-1", outcome="capacity") == 1
+    assert 'gpu_reliability_tracked_instances{platform="AWS"} 1' in metrics.registry.render()
+
+    # Left behind by another run
+    platform.session.add_instance("us-west-2", {"gpu-reliability-test": "true", "Name": "gpu-test-other"})
+    platform.cleanup_resources(full_sweep=True)
+    platform.close()
+
+    assert metrics.orphans.value(platform="AWS") == 1
+    assert metrics.sweep_seconds.count(platform="AWS") == 1
+    assert metrics.delete_seconds.count(platform="AWS") == 2
+    assert 'gpu_reliability_tracked_instances{platform="AWS"} 0' in metrics.registry.render()
+
+
+class UnthrottledPlatform(PlatformBase):
+    @property
+    def platform_type(self) -> PlatformType:
+        return PlatformType.GCP
+
+    def launch_instance(self, *_):
+        pass
+
+    def cleanup_resources(self, full_sweep: bool = False):
+        pass
+
+
+def test_platform_without_rate_limiter(stats_path):
+    metrics = PlatformMetrics()
+    platform = UnthrottledPlatform(StatsLogger(stats_path), metrics=metrics)
+
+    rendered = metrics.registry.render()
+    assert 'gpu_reliability_tracked_instances{platform="GCP"} 0' in rendered
+    assert "gpu_reliability_rate_limit_wait_seconds_total{" not in rendered
+    platform.close()
+
+
+def test_metrics_server():
+    registry = MetricsRegistry()
+    registry.counter("probes_total", "Probes").inc()
+
+    server = MetricsServer(registry, port=0).start()
+    try:
+        with urlopen(f"http://127.0.0.1:{server.port}/metrics") as response:
+            assert response.headers["Content-Type"].startswith("text/plain")
+            assert b"probes_total 1.0" in response.read()
+
+        with pytest.raises(HTTPError):
+            urlopen(f"http://127.0.0.1:{server.port}/other")
+    finally:
+        server.close()
@@ -0,0 +1,80 @@
+from gpu_reliability.ratelimit import (
+    ApiFamily,
+    CircuitBreaker,
+    CircuitState,
+    RateLimit,
+    RateLimiter,
+    TokenBucket,
+)
+from threading import Thread
+from time import monotonic, sleep
+
+
+def test_token_bucket_bursts_then_throttles():
+    bucket = TokenBucket(rate=20, burst=5)
+
+    start = monotonic()
+    for _ in range(5):
+        bucket.acquire()
+    assert monotonic() - start < 0.05
+
+    # Each further token takes 1/20th of a second to refill
+    for _ in range(4):
+        bucket.acquire()
+    assert monotonic() - start >= 0.15
+
+    assert not TokenBucket(rate=1, burst=1).acquire(2, timeout=0.1)
+
+
+def test_rate_limiter_buckets_by_family_and_region():
+    limiter = RateLimiter({
+        ApiFamily.READ: RateLimit(rate=1, burst=1),
+        ApiFamily.MUTATE: RateLimit(rate=1, burst=1),
+    })
+
+    start = monotonic()
+    limiter.acquire(ApiFamily.READ, "us-east-1")
+    limiter.acquire(ApiFamily.READ, "us-west-2")
+    limiter.acquire(ApiFamily.MUTATE, "us-east-1")
+    assert monotonic() - start < 0.05
+    assert limiter.waited_seconds(ApiFamily.READ) == 0
+
+    assert limiter.bucket(ApiFamily.READ, "us-east-1").try_acquire() > 0
+
+
+def test_throttled_region_does_not_hold_total():
+    limiter = RateLimiter({ApiFamily.READ: RateLimit(rate=2, burst=1)}, total=RateLimit(rate=2, burst=2))
+    limiter.acquire(ApiFamily.READ, "us-east-1")
+
+    # Waits on its region before taking a shared token, leaving one for `us-west-2`
+    waiter = Thread(target=limiter.acquire, args=(ApiFamily.READ, "us-east-1"))
+    waiter.start()
+    sleep(0.1)
+    start = monotonic()
+    limiter.acquire(ApiFamily.READ, "us-west-2")
+    assert monotonic() - start < 0.05
+    waiter.join()
+
+
+def test_circuit_breaker_cooldown():
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=0.1)
+
+    breaker.record_failure("us-central1-b")
+    assert breaker.allow("us-central1-b")
+    breaker.record_failure("us-central1-b")
+    assert breaker.state("us-central1-b") == CircuitState.OPEN
+    assert not breaker.allow("us-central1-b")
+    assert breaker.allow("europe-west4-a")
+
+    # One trial launch once the cool-down passes; its failure reopens the circuit
+    sleep(0.1)
+    assert breaker.allow("us-central1-b")
+    assert not breaker.allow("us-central1-b")
+    breaker.record_failure("us-central1-b")
+    assert breaker.state("us-central1-b") == CircuitState.OPEN
+
+    sleep(0.1)
+    assert breaker.allow("us-central1-b")
+    breaker.record_success("us-central1-b")
+    assert breaker.state("us-central1-b") == CircuitState.CLOSED
+    assert breaker.allow("us-central1-b")
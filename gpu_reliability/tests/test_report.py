@@ -0,0 +1,91 @@
+from gpu_reliability.report import build_report, aggregate_range, split_ranges
+from gpu_reliability.stats_logger import StatsLogger, Stat
+from gpu_reliability.models import PlatformType, LaunchRequest
+from datetime import datetime
+from json import dumps
+import pytest
+
+
+@pytest.fixture
+def populated_stats(stats_path):
+    with open(stats_path, "w") as file:
+        file.write(dumps({"test": True}) + "\n")
+
+    stats_logger = StatsLogger(stats_path)
+    for index in range(200):
+        success = index % 4 != 0
+        stats_logger.write(
+            Stat(
+                platform=PlatformType.GCP if index % 2 else PlatformType.AWS,
+                request=LaunchRequest(spot=False, geography="zone-a" if index % 2 else "region-a"),
+                create_success=success,
+                create_seconds=float(index % 50 + 1),
+                error=None if success else "[Code: ZONE_RESOURCE_POOL_EXHAUSTED]: No resources",
+                timestamp=datetime(2022, 8, 1, index % 24, 30),
+                phase_seconds={"submit": 1.0, "provisioning": float(index % 50)} if index % 2 else {},
+            )
+        )
+    return stats_path
+
+
+def test_build_report(populated_stats):
+    summary = build_report(populated_stats, workers=1).to_dict()
+
+    assert summary["skipped"] == 1
+    assert [(group["platform"], group["geography"]) for group in summary["groups"]] == [
+        ("AWS", "region-a"),
+        ("GCP", "zone-a"),
+    ]
+
+    aws, gcp = summary["groups"]
+    assert aws["launches"] == 100
+    assert aws["success_rate"] == 0.5
+    assert aws["errors"] == {"ZONE_RESOURCE_POOL_EXHAUSTED": 50}
+    assert gcp["success_rate"] == 1.0
+    assert gcp["errors"] == {}
+    assert gcp["create_seconds"]["p50"] == pytest.approx(26, rel=0.05)
+    assert list(gcp["phase_seconds"]) == ["submit", "provisioning"]
+    assert gcp["phase_seconds"]["provisioning"]["p50"] == pytest.approx(25, rel=0.05)
+    assert aws["phase_seconds"] == {}
+
+    # AWS launches happen on even indexes, so only even hours are populated
+    assert aws["hourly_success_rate"][1] is None
+    assert aws["hourly_success_rate"][2] is not None
+
+
+def test_split_ranges_cover_every_line_once(populated_stats):
+    size = populated_stats.stat().st_size
+    whole = aggregate_range(populated_stats, 0, size).to_dict()
+
+    for parts in [2, 7, 31]:
+        report = None
+        for start, end in split_ranges(size, parts):
+            partial = aggregate_range(populated_stats, start, end)
+            if report is None:
+                report = partial
+            else:
+                report.merge(partial)
+        assert report.to_dict() == whole
+
+
+def test_multiprocess_report(populated_stats):
+    single = build_report(populated_stats, workers=1).to_dict()
+    parallel = build_report(populated_stats, workers=2, chunk_lines=16, min_split_bytes=0).to_dict()
+    assert parallel == single
+
+
+def test_harness_drops_are_not_launches(stats_path):
+    stats_logger = StatsLogger(stats_path)
+    for error in [None, "[Code: HarnessQueueFull]: All 1 launch slots were busy"]:
+        stats_logger.write(
+            Stat(
+                platform=PlatformType.GCP,
+                request=LaunchRequest(spot=False, geography="zone-a"),
+                create_success=error is None,
+                error=error,
+            )
+        )
+
+    (group,) = build_report(stats_path, workers=1).to_dict()["groups"]
+    assert (group["launches"], group["success_rate"], group["dropped"]) == (1, 1.0, 1)
+    assert group["errors"] == {}
@@ -0,0 +1,95 @@
+from gpu_reliability.rollups import Rollups, Granularity, rollups_path
+from gpu_reliability.stats_logger import BufferedStatsLogger, Stat, read_stats
+from gpu_reliability.models import PlatformType, LaunchRequest
+from datetime import datetime, timedelta
+from json import dumps
+import pytest
+
+
+def make_stat(timestamp, success, geography="us-central1-b", spot=False, accelerator_type=None):
+    return Stat(
+        platform=PlatformType.GCP,
+        request=LaunchRequest(spot=spot, geography=geography, accelerator_type=accelerator_type),
+        create_success=success,
+        create_seconds=10.0 if success else None,
+        error=None if success else "[Code: ZONE_RESOURCE_POOL_EXHAUSTED]: No resources",
+        timestamp=timestamp,
+    )
+
+
+def test_incremental_rollups(stats_path):
+    rollups = Rollups(rollups_path(stats_path))
+    stats_logger = BufferedStatsLogger(stats_path, rollups=rollups)
+
+    start = datetime(2022, 8, 1, 2, 0)
+    for minutes in range(0, 180, 15):
+        stats_logger.write(make_stat(start + timedelta(minutes=minutes), success=minutes % 30 == 0))
+    stats_logger.write(make_stat(start, success=True, geography="us-east1-c", spot=True))
+    stats_logger.close()
+
+    hourly = rollups.query(Granularity.HOUR, geography="us-central1-b")
+    assert [key[1].hour for key, _ in hourly] == [2, 3, 4]
+    assert [bucket.launches for _, bucket in hourly] == [4, 4, 4]
+
+    between_two_and_four = rollups.availability(
+        granularity=Granularity.HOUR,
+        geography="us-central1-b",
+        spot=False,
+        start=datetime(2022, 8, 1, 2),
+        end=datetime(2022, 8, 1, 4),
+    )
+    assert between_two_and_four.launches == 8
+    assert between_two_and_four.success_rate == 0.5
+    assert between_two_and_four.errors == {"ZONE_RESOURCE_POOL_EXHAUSTED": 4}
+    assert between_two_and_four.latency.quantile(0.5) == pytest.approx(10.0, rel=0.01)
+
+    daily = rollups.availability(granularity=Granularity.DAY)
+    assert daily.launches == 13
+
+    # Closing the logger persists the sidecar, which matches a rebuild from the raw log
+    persisted = Rollups(rollups.path)
+    rebuilt = Rollups()
+    rebuilt.rebuild(read_stats(stats_path))
+    assert persisted.buckets == rollups.buckets == rebuilt.buckets
+
+
+def test_hourly_retention(output_dir):
+    rollups = Rollups(output_dir / "rollups.json", hourly_retention=timedelta(days=1))
+    rollups.add_many([
+        make_stat(datetime(2022, 8, 1, 2), success=True),
+        make_stat(datetime(2022, 8, 5, 2), success=True),
+    ])
+    rollups.persist()
+
+    assert len(rollups.query(Granularity.HOUR)) == 1
+    assert len(rollups.query(Granularity.DAY)) == 2
+
+
+def test_hardware_buckets(output_dir):
+    rollups = Rollups(output_dir / "rollups.json")
+    rollups.add_many([
+        make_stat(datetime(2022, 8, 1, 2), success=True, accelerator_type="nvidia-tesla-t4"),
+        make_stat(datetime(2022, 8, 1, 2), success=False, accelerator_type="nvidia-tesla-v100"),
+    ])
+    rollups.persist()
+
+    persisted = Rollups(rollups.path)
+    assert not persisted.stale
+    for current in [rollups, persisted]:
+        assert current.availability(granularity=Granularity.HOUR, accelerator_type="nvidia-tesla-t4").success_rate == 1.0
+        assert current.availability(granularity=Granularity.HOUR, accelerator_type="nvidia-tesla-v100").success_rate == 0.0
+        assert current.availability(granularity=Granularity.HOUR).launches == 2
+
+
+def test_stale_sidecar_is_rebuilt(output_dir):
+    path = output_dir / "rollups.json"
+    # Sidecars written before the hardware split have no version and mix hardware in one bucket
+    path.write_text(dumps({"buckets": [{"granularity": "hour", "start": "2022-08-01T02:00:00"}]}))
+
+    rollups = Rollups(path)
+    assert rollups.stale
+    assert rollups.buckets == {}
+
+    rollups.rebuild([make_stat(datetime(2022, 8, 1, 2), success=True, accelerator_type="nvidia-tesla-t4")])
+    assert not rollups.stale
+    assert not Rollups(path).stale
@@ -0,0 +1,77 @@
+from gpu_reliability.scheduler import ScheduleKind, TriggerScheduler
+from time import monotonic
+import pytest
+
+DAY = 60 * 60 * 24
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def drain(scheduler, until):
+    triggers = []
+    while scheduler.peek()[0] < until:
+        triggers.append(scheduler.pop())
+    return triggers
+
+
+@pytest.mark.parametrize("kind", list(ScheduleKind))
+def test_exact_daily_samples(kind):
+    scheduler = TriggerScheduler(seed=42, clock=FakeClock())
+    scheduler.add("trigger", 48, kind)
+
+    deadlines = [deadline for deadline, _ in drain(scheduler, 3 * DAY)]
+    for day in range(3):
+        assert sum(day * DAY <= deadline < (day + 1) * DAY for deadline in deadlines) == 48
+    assert deadlines == sorted(deadlines)
+
+
+def test_stratified_covers_the_day():
+    scheduler = TriggerScheduler(seed=42, clock=FakeClock())
+    scheduler.add("trigger", 24, ScheduleKind.STRATIFIED)
+
+    hours = [int(deadline // 3600) for deadline, _ in drain(scheduler, DAY)]
+    assert hours == list(range(24))
+
+
+def test_seed_reproduces_schedule():
+    def schedule(seed, names):
+        scheduler = TriggerScheduler(seed=seed, clock=FakeClock())
+        for name in names:
+            scheduler.add(name, 10, ScheduleKind.POISSON)
+        return [trigger for trigger in drain(scheduler, DAY) if trigger[1] == "gcp"]
+
+    assert schedule(1, ["gcp"]) == schedule(1, ["gcp"])
+    # Each schedule draws from its own stream, so adding one leaves the others unchanged
+    assert schedule(1, ["gcp"]) == schedule(1, ["aws", "gcp"])
+    assert schedule(1, ["gcp"]) != schedule(2, ["gcp"])
+
+
+def test_wait_sleeps_until_deadline():
+    clock = FakeClock()
+    scheduler = TriggerScheduler(period=1, seed=42, clock=clock)
+    scheduler.add("trigger", 4)
+    deadline, _ = scheduler.peek()
+
+    # Further away than the timeout, so the trigger stays queued
+    clock.now = deadline - 0.5
+    assert scheduler.wait(timeout=0.01) is None
+    assert scheduler.peek()[0] == deadline
+
+    # Sleeps out the rest of the way
+    clock.now = deadline - 0.02
+    start = monotonic()
+    assert scheduler.wait(timeout=1) == "trigger"
+    assert monotonic() - start >= 0.02
+
+    # Deadlines that already passed are returned right away
+    clock.now = scheduler.peek()[0] + 10
+    assert scheduler.wait(timeout=0) == "trigger"
+
+    scheduler.stop()
+    assert scheduler.wait(timeout=1) is None
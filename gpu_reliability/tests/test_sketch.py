@@ -0,0 +1,47 @@
+from gpu_reliability.sketch import LatencySketch
+from random import Random
+import pytest
+
+
+def test_quantile_accuracy():
+    random = Random(42)
+    values = sorted(random.lognormvariate(3, 1) for _ in range(10_000))
+
+    sketch = LatencySketch(relative_accuracy=0.01)
+    for value in values:
+        sketch.add(value)
+
+    for quantile in [0.5, 0.9, 0.99]:
+        expected = values[int(quantile * (len(values) - 1))]
+        assert sketch.quantile(quantile) == pytest.approx(expected, rel=0.02)
+
+
+def test_add_many_matches_add():
+    values = [0.0, 0.5, 1.5, 1.5, 30.0, float("nan"), 250.0]
+
+    single = LatencySketch()
+    for value in values:
+        single.add(value)
+
+    vectorized = LatencySketch()
+    vectorized.add_many(values)
+
+    assert vectorized.to_dict() == single.to_dict()
+    assert single.count == 6
+
+
+def test_merge_and_serialize():
+    first = LatencySketch()
+    first.add_many([1.0, 2.0, 3.0])
+    second = LatencySketch()
+    second.add_many([4.0, 5.0])
+
+    first.merge(second)
+    restored = LatencySketch.from_dict(first.to_dict())
+
+    assert restored.count == 5
+    assert restored.quantile(0.5) == pytest.approx(3.0, rel=0.01)
+    assert LatencySketch().quantile(0.5) is None
+
+    with pytest.raises(ValueError):
+        first.merge(LatencySketch(relative_accuracy=0.05))
@@ -0,0 +1,143 @@
+from gpu_reliability.sqlite import LaunchFilter, SqliteStatsLogger, SqliteStatsReader, convert_jsonl
+from gpu_reliability.stats_logger import StatsLogger, Stat
+from gpu_reliability.models import PlatformType, LaunchRequest
+from datetime import datetime, timedelta
+from subprocess import run
+from sys import executable
+from uuid import uuid4
+
+
+def make_stats():
+    stats = []
+    start = datetime(2023, 3, 1)
+    for index in range(96):
+        success = index % 5 != 0
+        stats.append(
+            Stat(
+                platform=PlatformType.GCP if index % 2 else PlatformType.AWS,
+                request=LaunchRequest(
+                    spot=index // 24 != 1,
+                    geography="us-central1-b" if index % 2 else "us-east-1",
+                    accelerator_type="nvidia-tesla-t4" if index % 2 else None,
+                    trigger_id=uuid4() if index % 5 == 0 else None,
+                ),
+                create_success=success,
+                create_seconds=float(index) if success else None,
+                error=None if success else "[Code: ZONE_RESOURCE_POOL_EXHAUSTED]: No resources",
+                # Every hour of the day, over four days
+                timestamp=start + timedelta(hours=index, minutes=30),
+                warnings=["[Code: WARNING]: Slow"] if index % 7 == 0 else [],
+                phase_seconds={"submit": 0.5, "provisioning": float(index)} if success else {},
+            )
+        )
+    return stats
+
+
+def test_roundtrip(output_dir):
+    database_path = output_dir / "stats.db"
+    stats = make_stats()
+
+    stats_logger = SqliteStatsLogger(database_path, max_batch_size=10)
+    for stat in stats:
+        stats_logger.write(stat)
+    stats_logger.close()
+
+    with SqliteStatsReader(database_path) as reader:
+        assert list(reader.stats()) == stats
+        gcp = list(reader.stats(LaunchFilter(platform=PlatformType.GCP)))
+        assert gcp == [stat for stat in stats if stat.platform == PlatformType.GCP]
+
+
+def test_summary_filters(output_dir):
+    database_path = output_dir / "stats.db"
+    stats = make_stats()
+
+    stats_logger = SqliteStatsLogger(database_path)
+    for stat in stats:
+        stats_logger.write(stat)
+    # Dropped by the harness, so not part of the availability numbers
+    stats_logger.write(
+        Stat(
+            platform=PlatformType.GCP,
+            request=LaunchRequest(spot=True, geography="us-central1-b", accelerator_type="nvidia-tesla-t4"),
+            create_success=False,
+            error="[Code: HarnessQueueFull]: All 1 launch slots were busy",
+            timestamp=datetime(2023, 3, 3, 3),
+        )
+    )
+    stats_logger.close()
+
+    launch_filter = LaunchFilter(
+        platform=PlatformType.GCP,
+        geography="us-central1-b",
+        spot=True,
+        accelerator_type="nvidia-tesla-t4",
+        since=datetime(2023, 3, 2),
+        hours=(2, 4),
+    )
+    expected = [
+        stat
+        for stat in stats
+        if stat.platform == PlatformType.GCP
+        and stat.request.spot
+        and stat.timestamp >= datetime(2023, 3, 2)
+        and 2 <= stat.timestamp.hour < 4
+    ]
+
+    with SqliteStatsReader(database_path) as reader:
+        summary = reader.summary(launch_filter)
+        assert summary.launches == len(expected) > 0
+        assert summary.successes == sum(stat.create_success for stat in expected)
+        assert summary.errors == {"ZONE_RESOURCE_POOL_EXHAUSTED": len(expected) - summary.successes}
+        assert summary.dropped == 1
+
+        # Hours wrap around midnight
+        overnight = reader.summary(LaunchFilter(hours=(22, 2)))
+        assert overnight.launches == sum(stat.timestamp.hour in (22, 23, 0, 1) for stat in stats)
+
+        assert "launches_target" in reader.query_plan(launch_filter)
+        assert "launches_error_code" in reader.query_plan(LaunchFilter(error_code="ZONE_RESOURCE_POOL_EXHAUSTED"))
+
+
+def test_read_while_writing(output_dir):
+    database_path = output_dir / "stats.db"
+    stats = make_stats()
+
+    stats_logger = SqliteStatsLogger(database_path)
+    for stat in stats[:10]:
+        stats_logger.write(stat)
+    stats_logger.flush()
+
+    # Another process reads while the writer thread keeps its connection open
+    launches = run(
+        [
+            executable,
+            "-c",
+            "import sys; from gpu_reliability.sqlite import SqliteStatsReader; "
+            "print(SqliteStatsReader(sys.argv[1]).summary().launches)",
+            str(database_path),
+        ],
+        capture_output=True,
+        text=True,
+        check=True,
+    ).stdout
+    assert int(launches) == 10
+
+    for stat in stats[10:]:
+        stats_logger.write(stat)
+    stats_logger.close()
+    with SqliteStatsReader(database_path) as reader:
+        assert reader.summary().launches == len(stats)
+
+
+def test_convert_jsonl(output_dir, stats_path):
+    stats = make_stats()
+    stats_logger = StatsLogger(stats_path)
+    for stat in stats:
+        stats_logger.write(stat)
+    with open(stats_path, "a") as file:
+        file.write("not json\n")
+
+    assert convert_jsonl(stats_path, output_dir / "stats.db") == (len(stats), 1)
+    with SqliteStatsReader(output_dir / "stats.db") as reader:
+        assert list(reader.stats()) == stats
@@ -1,5 +1,9 @@
-from gpu_reliability.stats_logger import StatsLogger, Stat
+from gpu_reliability.stats_logger import StatsLogger, BufferedStatsLogger, FsyncPolicy, Stat, StatsEncoder, encode_stat
 from json import dumps, loads
+from dataclasses import asdict
+from threading import Thread
+from uuid import uuid4
+import pytest
 from gpu_reliability.platforms.base import PlatformType
 from gpu_reliability.models import LaunchRequest
 
@@ -24,3 +28,97 @@ def test_extend_existing_file(stats_path):
     with open(stats_path) as file:
         lines = [loads(line) for line in file]
     assert len(lines) == 2
+
+
+@pytest.mark.parametrize("fsync_policy", list(FsyncPolicy))
+def test_buffered_writes(stats_path, fsync_policy):
+    stats_logger = BufferedStatsLogger(stats_path, max_batch_size=8, fsync_policy=fsync_policy, fsync_interval=0)
+
+    def write_stats():
+        for _ in range(50):
+            stats_logger.write(
+                Stat(
+                    platform=PlatformType.AWS,
+                    request=LaunchRequest(spot=True, geography="test-region"),
+                    create_success=False,
+                )
+            )
+
+    threads = [Thread(target=write_stats) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    stats_logger.flush()
+    with open(stats_path) as file:
+        assert len([loads(line) for line in file]) == 200
+
+    stats_logger.close()
+    assert not stats_logger.thread.is_alive()
+
+
+def test_buffered_close_drains_queue(stats_path):
+    # A long flush interval means records are only persisted by the shutdown path
+    stats_logger = BufferedStatsLogger(stats_path, flush_interval=60)
+    stats_logger.write(
+        Stat(
+            platform=PlatformType.GCP,
+            request=LaunchRequest(spot=False, geography="test-zone"),
+            create_success=True,
+        )
+    )
+    stats_logger.close()
+
+    with open(stats_path) as file:
+        assert [loads(line)["create_success"] for line in file] == [True]
+
+    with pytest.raises(ValueError):
+        stats_logger.write(
+            Stat(
+                platform=PlatformType.GCP,
+                request=LaunchRequest(spot=False, geography="test-zone"),
+                create_success=True,
+            )
+        )
+
+
+@pytest.mark.parametrize(
+    "stat",
+    [
+        Stat(
+            platform=PlatformType.GCP,
+            request=LaunchRequest(spot=False, geography="us-central1-b"),
+            create_success=True,
+            create_seconds=12.5,
+        ),
+        Stat(
+            platform=PlatformType.AWS,
+            request=LaunchRequest(spot=True, geography="us-east-1"),
+            create_success=False,
+            create_seconds=7,
+            error="[Code: InsufficientInstanceCapacity]: \"quoted\" ünicode \n newline",
+            warnings=["first", "sécond ☃"],
+        ),
+        Stat(
+            platform=PlatformType.AWS,
+            request=LaunchRequest(spot=True, geography="us-east-1"),
+            create_success=False,
+            create_seconds=float("nan"),
+        ),
+        Stat(
+            platform=PlatformType.GCP,
+            request=LaunchRequest(
+                spot=False,
+                geography="us-central1-b",
+                machine_type="n1-standard-4",
+                accelerator_type="nvidia-tesla-t4",
+                trigger_id=uuid4(),
+            ),
+            create_success=True,
+            phase_seconds={"image_lookup": 0.25, "submit": 1.5, "provisioning": 41.0},
+        ),
+    ]
+)
+def test_encode_stat_matches_json_encoder(stat):
+    assert encode_stat(stat) == dumps(asdict(stat), cls=StatsEncoder)